@@ -1,12 +1,18 @@
-from fastapi import FastAPI, HTTPException , UploadFile, File , Query ,Path 
+from fastapi import FastAPI, HTTPException , UploadFile, File , Query ,Path , Header
 from pydantic import BaseModel ,Field 
-from typing import List, Optional, Any , Dict
+from typing import List, Optional, Any , Dict, Literal
 
 import uuid 
 import os
+import time
 import json
 import uvicorn
 import shutil 
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse, PlainTextResponse
 
 # Import config variables and objects from config.py
 from config import (
@@ -16,8 +22,11 @@ from config import (
     embedding_model,
     llm,
     sql_generation_llm,
+    fast_sql_generation_llm,
     natural_language_llm,
     qdrant_client_instance,
+    example_collection_settings,
+    QDRANT_MANAGE_COLLECTION,
     vector_store,
     DB_CONNECTION_STRING,
     db,
@@ -26,7 +35,53 @@ from config import (
     AZURE_OPENAI_API_VERSION,
     AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME,
     AZURE_OPENAI_CHAT_DEPLOYMENT_NAME,
-    AZURE_OPENAI_CHAT_DEPLOYMENT_NAME2
+    AZURE_OPENAI_CHAT_DEPLOYMENT_NAME2,
+    AZURE_OPENAI_FAST_SQL_DEPLOYMENT_NAME,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKENIZER_ENCODING,
+    VALUE_INDEX_PATH,
+    value_index_options,
+    DATASOURCES,
+    DATASOURCE_CACHE_SIZE,
+    DATASOURCE_IDLE_TTL_SECONDS,
+    EXAMPLE_REUSE_SCORE_THRESHOLD,
+    SQL_ROUTING_FAST_QUERY_TYPES,
+    SQL_ROUTING_FAST_MAX_TABLES,
+    SQL_ROUTING_ESCALATE,
+    LLM_MAX_CONCURRENCY,
+    DB_MAX_CONCURRENCY,
+    SQL_CANDIDATES_MAX,
+    SQL_CANDIDATES_TEMPERATURE,
+    SQL_CANDIDATES_STRATEGY,
+    SQL_CANDIDATES_LATENCY_BUDGET_SECONDS,
+    JOB_STORE_PATH,
+    JOB_WORKERS,
+    JOB_RESULT_TTL_SECONDS,
+    JOB_RECOVER_ON_STARTUP,
+    RESULT_PAGE_SIZE,
+    RESULT_SPOOL_DIR,
+    RESULT_SPOOL_MAX_HANDLES,
+    RESULT_SPOOL_IDLE_TTL_SECONDS,
+    RESULT_SPOOL_MAX_ROWS,
+    RESULT_SPOOL_MAX_ACTIVE,
+    RESULT_SPOOL_INLINE_MAX_ROWS,
+    PROFILING_ENABLED,
+    PROFILING_SAMPLE_RATE,
+    PROFILING_ALLOW_HEADER,
+    PROFILING_DIR,
+    PROFILING_INTERVAL_MS,
+    PROFILING_MAX_PROFILES,
+    PROFILING_RESET_ON_STARTUP,
+    RESPONSE_DEFAULT_VERBOSITY,
+    RESPONSE_COMPRESSION_ENABLED,
+    RESPONSE_COMPRESSION_MIN_BYTES,
+    RESPONSE_COMPRESSION_GZIP_LEVEL,
+    RESPONSE_COMPRESSION_BROTLI_QUALITY,
+    CAPTURE_ENABLED,
+    CAPTURE_DIR,
+    CAPTURE_SAMPLE_RATE,
+    CAPTURE_QUEUE_SIZE,
+    CAPTURE_MAX_FILE_MB
 )
 
 # Import logic functions and constants from backend_logic.py
@@ -34,11 +89,28 @@ from backend_logic import (
     DB_SCHEMA_EXAMPLE,
     DB_SCHEMA_EXAMPLE_DESCRIPTION,
     TEXT_TO_SQL_INSTRUCTION,
+    normalize_question_logic,
+    normalize_sql_logic,
+    parse_schema_tables_logic,
     validate_rewrite_identify_tables_and_types_logic,
     retrieve_similar_examples_logic,
-    assemble_text_to_sql_prompt_logic,
+    find_reusable_example_logic,
+    build_text_to_sql_prompt_logic,
     generate_sql_from_prompt_logic,
-    execute_sql_query_logic,
+    SQL_MODEL_TIERS,
+    choose_sql_model_tier_logic,
+    validate_generated_sql_logic,
+    is_failed_query_result_logic,
+    build_sql_retry_prompt_logic,
+    ModelRoutingStats,
+    with_candidate_temperature_logic,
+    run_sql_candidates_logic,
+    execute_sql_query_paged_logic,
+    build_example_filter_logic,
+    export_qdrant_points_ndjson_logic,
+    count_qdrant_points_logic,
+    facet_qdrant_points_logic,
+    delete_qdrant_points_bulk_logic,
     generate_natural_language_response_logic,
     add_json_examples_to_vector_store_logic,
     add_single_example_to_vector_store_logic,
@@ -56,11 +128,178 @@ from schema import (
     QdrantPoint,
     GetAllPointsResponse,
     DeletePointResponse,
+    JobSubmitResponse,
+    JobStatusResponse,
+    QueryResultPageResponse,
+    BulkDeleteExamplesRequest,
+    BulkDeleteExamplesResponse,
+    ExampleCountResponse,
+    ExampleFacetsResponse,
+    ProfilingSettingsModel,
+    ProfileResponse,
     TEMP_UPLOAD_DIR
 )
 
+from singleflight import SingleFlight, AsyncSingleFlight
+from qdrant_setup import prepare_example_collection
+from value_index import ColumnValueIndex, MappedColumnValueIndex, load_shared_value_index, snapshot_path_for
+from result_spool import ResultSpool, SpooledResult, ResultHandleNotFoundError
+from profiling import SHARED_SETTINGS_FILENAME, ProfilingSettings, ProfileStore, ProfileNotFoundError, profile_stage, run_profiled, run_timed
+from request_capture import RequestCapture
+from response_shaping import CompressionMiddleware, FastJSONResponse, resolve_response_fields, shaped_response, wants_field
+from jobs import (
+    JobCancelledError,
+    JobManager,
+    JobStore,
+    current_cancellation_token,
+    instrument_engine_for_cancellation
+)
+from datasources import (
+    DEFAULT_DATASOURCE_ID,
+    Datasource,
+    DatasourceNotFoundError,
+    DatasourceRegistry,
+    create_datasource_from_config
+)
+
 # --- FastAPI App ---
-app = FastAPI()
+def prepare_default_example_collection():
+    # Explicit startup step (serve.py runs the managed variant once before its workers start).
+    if qdrant_client_instance is None:
+        return
+    try:
+        setup_result = prepare_example_collection(
+            qdrant_client_instance, QDRANT_COLLECTION_NAME, example_collection_settings, embedding_model, manage=QDRANT_MANAGE_COLLECTION
+        )
+    except ValueError:
+        # The collection exists but does not match the configuration: serving from it would return wrong examples.
+        raise
+    except Exception as e:
+        print(f"Warning: could not prepare Qdrant collection '{QDRANT_COLLECTION_NAME}': {e}")
+        return
+    print(f"Qdrant collection '{QDRANT_COLLECTION_NAME}': {', '.join(setup_result['changes']) or 'up to date'}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global result_spool, job_manager
+    await run_in_threadpool(prepare_default_example_collection)
+    result_spool = await run_in_threadpool(create_result_spool)
+    job_manager = await run_in_threadpool(create_job_manager)
+    try:
+        yield
+    finally:
+        # Jobs first: a running one may still be spooling its result.
+        await run_in_threadpool(job_manager.shutdown)
+        result_spool.close()
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+if RESPONSE_COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=RESPONSE_COMPRESSION_MIN_BYTES,
+        gzip_level=RESPONSE_COMPRESSION_GZIP_LEVEL,
+        brotli_quality=RESPONSE_COMPRESSION_BROTLI_QUALITY
+    )
+
+# Fields built for /process-query requests that ask for neither fields nor verbosity (None: all of them).
+default_response_fields = resolve_response_fields(verbosity=RESPONSE_DEFAULT_VERBOSITY)
+
+# --- Request coalescing (single-flight) ---
+# Identical in-flight questions share one pipeline run; identical retrievals and SQL statements share one call.
+query_flight = AsyncSingleFlight()
+retrieval_flight = SingleFlight()
+sql_execution_flight = SingleFlight()
+
+# Query-time HNSW ef / quantization rescoring for example retrieval (see QDRANT_SEARCH_* in config.py).
+example_search_params = example_collection_settings.search_params()
+
+# --- Concurrency limits (every LLM call and SQL execution of the pipeline, including candidate fan-out) ---
+llm_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+db_semaphore = threading.BoundedSemaphore(DB_MAX_CONCURRENCY)
+candidate_executor = ThreadPoolExecutor(max_workers=max(LLM_MAX_CONCURRENCY, DB_MAX_CONCURRENCY) * 2, thread_name_prefix="sql-candidate")
+
+# --- Paged results (server-side cursors spooled to local disk) ---
+# Created by the app's lifespan, like job_manager below: importing backend creates no files or threads.
+result_spool: Optional[ResultSpool] = None
+
+def create_result_spool() -> ResultSpool:
+    return ResultSpool(
+        RESULT_SPOOL_DIR,
+        page_size=RESULT_PAGE_SIZE,
+        max_handles=RESULT_SPOOL_MAX_HANDLES,
+        idle_ttl_seconds=RESULT_SPOOL_IDLE_TTL_SECONDS,
+        max_rows=RESULT_SPOOL_MAX_ROWS,
+        max_active_spools=RESULT_SPOOL_MAX_ACTIVE,
+        inline_max_rows=RESULT_SPOOL_INLINE_MAX_ROWS
+    )
+
+# --- Opt-in pipeline profiling (nothing runs unless a request is selected) ---
+profiling_settings = ProfilingSettings(
+    enabled=PROFILING_ENABLED,
+    sample_rate=PROFILING_SAMPLE_RATE,
+    allow_header=PROFILING_ALLOW_HEADER,
+    shared_path=os.path.join(PROFILING_DIR, SHARED_SETTINGS_FILENAME)
+)
+if PROFILING_RESET_ON_STARTUP:
+    # Otherwise a settings file left by the previous run would override the environment (serve.py does this once).
+    profiling_settings.update(enabled=PROFILING_ENABLED, sample_rate=PROFILING_SAMPLE_RATE, allow_header=PROFILING_ALLOW_HEADER)
+profile_store = ProfileStore(PROFILING_DIR, max_profiles=PROFILING_MAX_PROFILES)
+
+# --- Opt-in request capture for replay load tests (see benchmark_replay.py) ---
+request_capture = None
+if CAPTURE_ENABLED:
+    request_capture = RequestCapture(
+        CAPTURE_DIR,
+        sample_rate=CAPTURE_SAMPLE_RATE,
+        queue_size=CAPTURE_QUEUE_SIZE,
+        max_file_bytes=int(CAPTURE_MAX_FILE_MB * 1024 * 1024)
+    )
+
+# --- SQL model cascade ---
+sql_generation_llms = {"fast": fast_sql_generation_llm, "strong": sql_generation_llm}
+sql_generation_deployments = {"fast": AZURE_OPENAI_FAST_SQL_DEPLOYMENT_NAME, "strong": AZURE_OPENAI_CHAT_DEPLOYMENT_NAME2}
+model_routing_stats = ModelRoutingStats()
+
+# --- Column-value index (built offline by `python value_index.py` or POST /refresh-value-index) ---
+# Served from a memory-mapped snapshot so every worker process shares one copy (see serve.py). Never built here:
+# reading distinct values of every text column would hold up startup on a large database.
+def load_column_value_index():
+    if not os.path.exists(VALUE_INDEX_PATH):
+        if db is not None:
+            print(f"Warning: column-value index {VALUE_INDEX_PATH} not found; build it with `python value_index.py`.")
+        return None
+    try:
+        return load_shared_value_index(VALUE_INDEX_PATH)
+    except Exception as e:
+        print(f"Warning: could not load column-value index from {VALUE_INDEX_PATH}: {e}")
+        return None
+
+# --- Datasources (the default one comes from config.py; tenants from DATASOURCES_CONFIG_PATH) ---
+default_datasource = Datasource(
+    DEFAULT_DATASOURCE_ID,
+    db=db,
+    vector_store=vector_store,
+    collection_name=QDRANT_COLLECTION_NAME,
+    db_schema=DB_SCHEMA_EXAMPLE,
+    db_schema_description=DB_SCHEMA_EXAMPLE_DESCRIPTION,
+    column_value_index=load_column_value_index(),
+    value_index_path=VALUE_INDEX_PATH
+)
+
+datasource_registry = DatasourceRegistry(
+    factory=lambda datasource_id: create_datasource_from_config(
+        datasource_id,
+        DATASOURCES[datasource_id],
+        qdrant_client_instance=qdrant_client_instance,
+        embedding_model=embedding_model,
+        collection_settings=example_collection_settings,
+        manage_collection=QDRANT_MANAGE_COLLECTION
+    ),
+    known_ids=lambda: list(DATASOURCES.keys()),
+    max_size=DATASOURCE_CACHE_SIZE,
+    idle_ttl_seconds=DATASOURCE_IDLE_TTL_SECONDS
+)
+datasource_registry.pin(default_datasource)
 
 @app.get("/")
 async def root():
@@ -75,21 +314,131 @@ async def health_check():
         "status": "ok",
         "database_status": db_status,
         "vector_store_status": vector_store_status,
-        "qdrant_collection": QDRANT_COLLECTION_NAME if vector_store else None
+        "qdrant_collection": QDRANT_COLLECTION_NAME if vector_store else None,
+        "value_index_status": "available" if default_datasource.column_value_index is not None else "not available",
+        "datasources": datasource_registry.status()
     }
 
-@app.post("/process-query", response_model=ProcessQueryResponse)
-async def process_query_endpoint(request: ProcessQueryRequest):
-    user_question = request.user_question
-    response_data = ProcessQueryResponse(original_question=user_question)
+def _execute_sql_with_limit(sql_query: str, db_instance, page_size: int, cancel_token=None):
+    with db_semaphore:
+        if cancel_token is not None:
+            # The wait for a slot can outlast the job the statement belongs to.
+            cancel_token.raise_if_cancelled()
+        return execute_sql_query_paged_logic(
+            sql_query=sql_query, db_instance=db_instance, result_spool=result_spool, page_size=page_size, cancel_token=cancel_token
+        )
+
+def raise_if_job_cancelled(cancel_token=None):
+    # No-op outside async jobs; inside one, stops the pipeline between stages once the job is cancelled.
+    cancel_token = cancel_token if cancel_token is not None else current_cancellation_token()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+def execute_sql_for_datasource(sql_query: str, datasource: Datasource, page_size: int = RESULT_PAGE_SIZE, cancel_token=None):
+    # A statement run under a cancel token is never shared: cancelling that job must not kill another caller's result.
+    if cancel_token is not None and datasource.db is not None:
+        instrument_engine_for_cancellation(datasource.db._engine)
+    return sql_execution_flight.do(
+        (datasource.datasource_id, normalize_sql_logic(sql_query), page_size, id(cancel_token) if cancel_token is not None else None),
+        _execute_sql_with_limit,
+        sql_query,
+        datasource.db,
+        page_size,
+        cancel_token
+    )
+
+def generate_sql_with_limit(assembled_prompt: str, sql_llm_instance) -> str:
+    with llm_semaphore:
+        return generate_sql_from_prompt_logic(assembled_prompt=assembled_prompt, sql_llm_instance=sql_llm_instance)
+
+def generate_sql_candidates(assembled_prompt: str, tier: str, datasource: Datasource, num_candidates: int, strategy: str, page_size: int = RESULT_PAGE_SIZE, cancel_token=None):
+    base_llm = sql_generation_llms[tier]
+    candidate_llm = with_candidate_temperature_logic(base_llm, SQL_CANDIDATES_TEMPERATURE)
+    llm_instances = [base_llm] + [candidate_llm] * (num_candidates - 1)
+    generated_sql, query_result, candidates_info = run_sql_candidates_logic(
+        assembled_prompt=assembled_prompt,
+        llm_instances=llm_instances,
+        execute_fn=lambda sql_query, execution_token: execute_sql_for_datasource(sql_query, datasource, page_size, execution_token),
+        executor=candidate_executor,
+        llm_semaphore=llm_semaphore,
+        strategy=strategy,
+        latency_budget_seconds=SQL_CANDIDATES_LATENCY_BUDGET_SECONDS,
+        cancel_token=cancel_token,
+        discard_result_fn=lambda query_result: result_spool.discard(query_result.handle) if isinstance(query_result, SpooledResult) else None
+    )
+    # Every generated candidate is one call on the tier, timed like a cascade attempt.
+    deployment = sql_generation_deployments[tier]
+    attempts = []
+    for candidate in candidates_info["candidates"]:
+        model_routing_stats.record(tier, deployment, candidate["latency_ms"], candidate["failure"] is None)
+        attempts.append({"tier": tier, "deployment": deployment, "latency_ms": candidate["latency_ms"], "failure": candidate["failure"]})
+    model_routing = {"initial_tier": tier, "final_tier": tier, "escalated": False, "attempts": attempts}
+    return generated_sql, query_result, candidates_info, model_routing
+
+def generate_sql_with_cascade(assembled_prompt: str, starting_tier: str, datasource: Datasource, page_size: int = RESULT_PAGE_SIZE, cancel_token=None):
+    # Starts at the routed tier and escalates to stronger tiers while the SQL fails validation or execution.
+    tiers = SQL_MODEL_TIERS[SQL_MODEL_TIERS.index(starting_tier):] if SQL_ROUTING_ESCALATE else [starting_tier]
+    prompt = assembled_prompt
+    attempts = []
+    generated_sql, query_result = "", None
+    for tier in tiers:
+        profile_stage(f"sql_generation:{tier}")
+        start_time = time.perf_counter()
+        generated_sql = generate_sql_with_limit(prompt, sql_generation_llms[tier])
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        failure_reason = validate_generated_sql_logic(generated_sql)
+        query_result = None
+        if failure_reason is None and datasource.db:
+            profile_stage("sql_execution")
+            query_result = execute_sql_for_datasource(generated_sql, datasource, page_size, cancel_token)
+            if is_failed_query_result_logic(query_result):
+                failure_reason = str(query_result)
+        escalated_from = attempts[-1]["tier"] if attempts else None
+        model_routing_stats.record(tier, sql_generation_deployments[tier], latency_ms, failure_reason is None, escalated_from)
+        attempts.append({
+            "tier": tier,
+            "deployment": sql_generation_deployments[tier],
+            "latency_ms": round(latency_ms, 1),
+            "failure": failure_reason[:300] if failure_reason else None
+        })
+        if failure_reason is None:
+            break
+        raise_if_job_cancelled(cancel_token)
+        prompt = build_sql_retry_prompt_logic(assembled_prompt, generated_sql, failure_reason)
+    model_routing = {
+        "initial_tier": starting_tier,
+        "final_tier": attempts[-1]["tier"],
+        "escalated": len(attempts) > 1,
+        "attempts": attempts
+    }
+    # A validation failure means nothing ran; the caller must not execute the SQL either.
+    validation_failure = failure_reason if failure_reason is not None and query_result is None else None
+    return generated_sql, query_result, validation_failure, model_routing
+
+def run_query_pipeline(
+    user_question: str,
+    datasource: Datasource,
+    sql_candidates: int = 1,
+    candidate_strategy: Optional[str] = None,
+    page_size: int = RESULT_PAGE_SIZE,
+    response_fields: Optional[frozenset] = None,
+    cancel_token=None
+) -> ProcessQueryResponse:
+    # Parts of the response nobody asked for (see response_shaping.py) are not built at all.
+    response_data = ProcessQueryResponse(original_question=user_question, datasource_id=datasource.datasource_id)
+    db = datasource.db
+    vector_store = datasource.vector_store
 
     try:
-        llm_output_json_str_1 = validate_rewrite_identify_tables_and_types_logic(
-            user_query=user_question,
-            db_schema=DB_SCHEMA_EXAMPLE,
-            llm_instance=llm
-        )
+        profile_stage("analysis_llm")
+        with llm_semaphore:
+            llm_output_json_str_1 = validate_rewrite_identify_tables_and_types_logic(
+                user_query=user_question,
+                db_schema=datasource.db_schema,
+                llm_instance=llm
+            )
         
+        profile_stage("analysis_parse")
         extracted_json_str = llm_output_json_str_1
         first_brace = llm_output_json_str_1.find('{')
         last_brace = llm_output_json_str_1.rfind('}')
@@ -104,48 +453,127 @@ async def process_query_endpoint(request: ProcessQueryRequest):
             return response_data
         
         rewritten_query = response_data.analysis.query
+        raise_if_job_cancelled(cancel_token)
 
         if response_data.analysis.relevant in ['yes', 'maybe']:
+            profile_stage("example_retrieval")
+            similar_examples_raw, similar_examples = [], []
             if rewritten_query and rewritten_query.strip() and vector_store:
-                similar_examples_raw = retrieve_similar_examples_logic(
+                similar_examples_raw = retrieval_flight.do(
+                    (datasource.datasource_id, rewritten_query.strip(), 3),
+                    retrieve_similar_examples_logic,
                     query_text=rewritten_query,
                     vector_store_instance=vector_store,
-                    k=3
+                    k=3,
+                    search_params=example_search_params
                 )
-                response_data.similar_examples = [SimilarExample(**ex) for ex in similar_examples_raw]
+                similar_examples = [SimilarExample(**ex) for ex in similar_examples_raw]
+                if wants_field(response_fields, "similar_examples"):
+                    response_data.similar_examples = similar_examples
 
-            final_text_to_sql_prompt = assemble_text_to_sql_prompt_logic(
-                instruction=TEXT_TO_SQL_INSTRUCTION,
-                rewritten_query=rewritten_query,
-                few_shot_examples=[ex.dict() for ex in response_data.similar_examples],
+            raise_if_job_cancelled(cancel_token)
+            # Reuse skips SQL generation only: the analysis call above still runs, since the example's tables must match its relevant tables.
+            reusable_example = find_reusable_example_logic(
+                similar_examples=similar_examples_raw,
                 relevant_table_names=response_data.analysis.relevant_tables,
-                full_db_schema=DB_SCHEMA_EXAMPLE_DESCRIPTION
+                score_threshold=EXAMPLE_REUSE_SCORE_THRESHOLD,
+                distance=example_collection_settings.distance.value
             )
-            response_data.assembled_prompt_snippet = final_text_to_sql_prompt[:1000] + ("..." if len(final_text_to_sql_prompt) > 1000 else "")
+            generated_sql, query_result, sql_validation_failure = None, None, None
+            if reusable_example:
+                generated_sql = reusable_example["sql"].strip()
+                reuse_failure = validate_generated_sql_logic(generated_sql)
+                if reuse_failure is None and db:
+                    profile_stage("sql_execution")
+                    query_result = execute_sql_for_datasource(generated_sql, datasource, page_size, cancel_token)
+                    if is_failed_query_result_logic(query_result):
+                        reuse_failure = str(query_result)
+                if reuse_failure is None:
+                    response_data.sql_source = "example_reuse"
+                else:
+                    # A stored example that no longer runs (schema drift, bad upload) falls back to generation.
+                    print(f"Warning: reused example SQL failed, generating instead: {reuse_failure[:200]}")
+                    generated_sql, query_result = None, None
+                    raise_if_job_cancelled(cancel_token)
+            if generated_sql is None:
+                profile_stage("prompt_build")
+                final_text_to_sql_prompt, prompt_token_counts = build_text_to_sql_prompt_logic(
+                    instruction=TEXT_TO_SQL_INSTRUCTION,
+                    rewritten_query=rewritten_query,
+                    few_shot_examples=[ex.dict() for ex in similar_examples],
+                    relevant_table_names=response_data.analysis.relevant_tables,
+                    full_db_schema=datasource.db_schema_description,
+                    token_budget=PROMPT_TOKEN_BUDGET,
+                    encoding_name=PROMPT_TOKENIZER_ENCODING,
+                    column_value_index=datasource.column_value_index,
+                    foreign_keys=datasource.foreign_keys
+                )
+                response_data.prompt_token_counts = prompt_token_counts
+                if wants_field(response_fields, "assembled_prompt_snippet"):
+                    response_data.assembled_prompt_snippet = final_text_to_sql_prompt[:1000] + ("..." if len(final_text_to_sql_prompt) > 1000 else "")
 
-            generated_sql = generate_sql_from_prompt_logic(
-                assembled_prompt=final_text_to_sql_prompt,
-                sql_llm_instance=sql_generation_llm
-            )
+                sql_model_tier = choose_sql_model_tier_logic(
+                    query_types=response_data.analysis.query_types,
+                    relevant_table_names=response_data.analysis.relevant_tables,
+                    fast_query_types=SQL_ROUTING_FAST_QUERY_TYPES,
+                    fast_max_tables=SQL_ROUTING_FAST_MAX_TABLES
+                )
+                if sql_candidates > 1 and db:
+                    profile_stage("sql_candidates")
+                    generated_sql, query_result, response_data.sql_candidates_info, response_data.model_routing = generate_sql_candidates(
+                        assembled_prompt=final_text_to_sql_prompt,
+                        tier=sql_model_tier,
+                        datasource=datasource,
+                        num_candidates=sql_candidates,
+                        strategy=candidate_strategy or SQL_CANDIDATES_STRATEGY,
+                        page_size=page_size,
+                        cancel_token=cancel_token
+                    )
+                    if generated_sql and query_result is None:
+                        # No candidate ran (all invalid or out of time); the fallback SQL may not be valid either.
+                        sql_validation_failure = validate_generated_sql_logic(generated_sql)
+                else:
+                    generated_sql, query_result, sql_validation_failure, response_data.model_routing = generate_sql_with_cascade(
+                        assembled_prompt=final_text_to_sql_prompt,
+                        starting_tier=sql_model_tier,
+                        datasource=datasource,
+                        page_size=page_size,
+                        cancel_token=cancel_token
+                    )
+                response_data.sql_source = "generated"
             response_data.generated_sql = generated_sql
 
-            if generated_sql and db: 
-                query_result = execute_sql_query_logic(
-                    sql_query=generated_sql,
-                    db_instance=db 
-                )
-                response_data.query_result = str(query_result)
+            if sql_validation_failure:
+                response_data.error_message = f"Generated SQL failed validation and was not executed: {sql_validation_failure}"
+                response_data.nl_response = "Could not generate a final answer due to an issue with the SQL query or its execution."
+            elif generated_sql and db: 
+                if query_result is None:
+                    profile_stage("sql_execution")
+                    query_result = execute_sql_for_datasource(generated_sql, datasource, page_size, cancel_token)
+                if wants_field(response_fields, "query_result"):
+                    response_data.query_result = str(query_result)
+                if isinstance(query_result, SpooledResult):
+                    response_data.result_columns = query_result.columns
+                    response_data.result_rows = query_result.first_page_rows
+                    response_data.result_handle = query_result.handle
+                    response_data.result_has_more = query_result.has_more
+                raise_if_job_cancelled(cancel_token)
 
-                if isinstance(query_result, str) and ("Error executing SQL" in query_result or query_result == "No SQL query to execute."):
+                if is_failed_query_result_logic(query_result):
                     response_data.nl_response = "Could not generate a final answer due to an issue with the SQL query or its execution."
-                elif query_result is not None:
-                    nl_response = generate_natural_language_response_logic(
-                        user_question=user_question,
-                        sql_result=str(query_result),
-                        nl_llm_instance=natural_language_llm
-                    )
+                elif query_result is not None and wants_field(response_fields, "nl_response"):
+                    profile_stage("nl_response")
+                    with llm_semaphore:
+                        nl_response = generate_natural_language_response_logic(
+                            user_question=user_question,
+                            sql_result=response_data.query_result if response_data.query_result is not None else str(query_result),
+                            nl_llm_instance=natural_language_llm
+                        )
+                    if isinstance(query_result, SpooledResult) and query_result.has_more:
+                        # The model only saw the first page; don't let the answer pass for one over the whole result.
+                        nl_response += f"\n\n(This answer is based on {query_result.rows_shown()}; page through result_handle for the rest.)"
                     response_data.nl_response = nl_response
-                else:
+                elif query_result is None:
                      response_data.nl_response = "The query executed but returned no data to form an answer."
 
             elif not db:
@@ -157,11 +585,227 @@ async def process_query_endpoint(request: ProcessQueryRequest):
 
     except HTTPException as e:
         response_data.error_message = e.detail
+    except JobCancelledError:
+        raise
     except Exception as e:
         response_data.error_message = f"An unexpected error occurred: {str(e)}"
     
     return response_data
 
+def resolve_query_response_fields(request: ProcessQueryRequest, fields_param: Optional[str] = None, verbosity_param: Optional[str] = None) -> Optional[frozenset]:
+    if request.fields:
+        return resolve_response_fields(fields=request.fields)
+    if request.verbosity:
+        return resolve_response_fields(verbosity=request.verbosity)
+    if fields_param:
+        return resolve_response_fields(fields=fields_param.split(","))
+    if verbosity_param:
+        return resolve_response_fields(verbosity=verbosity_param)
+    return default_response_fields
+
+def run_query_pipeline_for_request(timed: bool, *args):
+    # Returns (response, per-stage wall times); the timings are only collected for captured requests.
+    if not timed:
+        return run_query_pipeline(*args), None
+    return run_timed(run_query_pipeline, *args)
+
+async def answer_query_request(request: ProcessQueryRequest, x_profile: Optional[str], fields: Optional[str], verbosity: Optional[str], timed: bool = False):
+    user_question = request.user_question
+    try:
+        response_fields = resolve_query_response_fields(request, fields, verbosity)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        datasource = await run_in_threadpool(datasource_registry.get, request.datasource_id)
+    except DatasourceNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown datasource '{request.datasource_id}'.")
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Datasource '{request.datasource_id}' is not available: {str(e)}")
+    sql_candidates = min(request.sql_candidates or 1, SQL_CANDIDATES_MAX)
+    page_size = request.page_size or RESULT_PAGE_SIZE
+    pipeline_args = (user_question, datasource, sql_candidates, request.candidate_strategy, page_size, response_fields)
+    if profiling_settings.should_profile(x_profile):
+        # Profiled requests run on their own (not coalesced) so the profile covers a real pipeline run.
+        (pipeline_response, stages), profile_id = await run_in_threadpool(
+            run_profiled, profile_store, user_question[:200], PROFILING_INTERVAL_MS / 1000.0,
+            run_query_pipeline_for_request, timed, *pipeline_args
+        )
+        return shaped_response(pipeline_response, response_fields, headers={"X-Profile-Id": profile_id}), stages
+    flight_key = (
+        datasource.datasource_id, normalize_question_logic(user_question), datasource.schema_version,
+        sql_candidates, request.candidate_strategy, page_size, response_fields
+    )
+    # With capture on, every shared run is timed, so a captured request that joins another's run still gets its stages.
+    timed_run = timed or request_capture is not None
+    shared_response, stages = await query_flight.do(flight_key, run_in_threadpool, run_query_pipeline_for_request, timed_run, *pipeline_args)
+    # Every coalesced caller gets its own copy, echoing the question exactly as it sent it.
+    return shaped_response(shared_response.model_copy(update={"original_question": user_question}), response_fields), stages
+
+@app.post("/process-query", response_model=ProcessQueryResponse)
+async def process_query_endpoint(
+    request: ProcessQueryRequest,
+    x_profile: Optional[str] = Header(None, description="Send '1' to profile this request; the profile ID is returned in X-Profile-Id."),
+    fields: Optional[str] = Query(None, description="Comma-separated response fields (same as the body's fields; the body wins)."),
+    verbosity: Optional[Literal["minimal", "standard", "full"]] = Query(None, description="Response preset (same as the body's verbosity; the body wins).")
+):
+    if request_capture is None or not request_capture.should_capture():
+        response, _ = await answer_query_request(request, x_profile, fields, verbosity)
+        return response
+    started_at, start_time = time.time(), time.perf_counter()
+    status_code, stages = 500, None
+    try:
+        response, stages = await answer_query_request(request, x_profile, fields, verbosity, timed=True)
+        status_code = response.status_code
+        return response
+    except HTTPException as e:
+        status_code = e.status_code
+        raise
+    finally:
+        # Everything benchmark_replay.py needs to re-issue the request at its original arrival time.
+        request_capture.record({
+            "ts": started_at,
+            "user_question": request.user_question,
+            "datasource_id": request.datasource_id,
+            "sql_candidates": request.sql_candidates,
+            "candidate_strategy": request.candidate_strategy,
+            "page_size": request.page_size,
+            "fields": request.fields or (fields.split(",") if fields else None),
+            "verbosity": request.verbosity or verbosity,
+            "status": status_code,
+            "latency_ms": round((time.perf_counter() - start_time) * 1000, 3),
+            "stages": stages,
+        })
+
+@app.get("/query-results/{handle}", response_model=QueryResultPageResponse)
+async def get_query_result_page_endpoint(
+    handle: str = Path(..., description="result_handle from a /process-query response."),
+    page: int = Query(1, ge=0, description="Zero-based page number; page 0 is the page already returned inline.")
+):
+    try:
+        result_page = await run_in_threadpool(result_spool.fetch_page, handle, page)
+    except ResultHandleNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Result '{handle}' not found (it may have been evicted).")
+    return QueryResultPageResponse(**result_page)
+
+# --- Async query jobs (submit / poll / cancel) ---
+def run_query_job(request: ProcessQueryRequest, cancel_token) -> ProcessQueryResponse:
+    datasource = datasource_registry.get(request.datasource_id)
+    sql_candidates = min(request.sql_candidates or 1, SQL_CANDIDATES_MAX)
+    return run_query_pipeline(
+        request.user_question, datasource, sql_candidates, request.candidate_strategy, request.page_size or RESULT_PAGE_SIZE,
+        resolve_query_response_fields(request), cancel_token
+    )
+
+job_manager: Optional[JobManager] = None
+
+def create_job_manager() -> JobManager:
+    return JobManager(
+        store=JobStore(JOB_STORE_PATH),
+        runner=run_query_job,
+        max_workers=JOB_WORKERS,
+        result_ttl_seconds=JOB_RESULT_TTL_SECONDS,
+        recover_unfinished=JOB_RECOVER_ON_STARTUP
+    )
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job_endpoint(request: ProcessQueryRequest):
+    if request.datasource_id and request.datasource_id != DEFAULT_DATASOURCE_ID and request.datasource_id not in DATASOURCES:
+        raise HTTPException(status_code=404, detail=f"Unknown datasource '{request.datasource_id}'.")
+    try:
+        resolve_query_response_fields(request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job_id = await run_in_threadpool(job_manager.submit, request)
+    return JobSubmitResponse(job_id=job_id, status="queued")
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_endpoint(job_id: str = Path(..., description="ID returned by POST /jobs.")):
+    job = await run_in_threadpool(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found (it may have expired).")
+    return JobStatusResponse(**job)
+
+@app.delete("/jobs/{job_id}", response_model=JobStatusResponse)
+async def cancel_job_endpoint(job_id: str = Path(..., description="ID returned by POST /jobs.")):
+    job = await run_in_threadpool(job_manager.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found (it may have expired).")
+    return JobStatusResponse(**job)
+
+@app.get("/routing-stats")
+async def routing_stats_endpoint():
+    return {
+        "fast_query_types": SQL_ROUTING_FAST_QUERY_TYPES,
+        "fast_max_tables": SQL_ROUTING_FAST_MAX_TABLES,
+        "escalation_enabled": SQL_ROUTING_ESCALATE,
+        "tiers": model_routing_stats.snapshot()
+    }
+
+@app.get("/admin/profiling", response_model=ProfilingSettingsModel)
+async def get_profiling_settings_endpoint():
+    profiling_settings.refresh()
+    return ProfilingSettingsModel(enabled=profiling_settings.enabled, sample_rate=profiling_settings.sample_rate, allow_header=profiling_settings.allow_header)
+
+@app.put("/admin/profiling", response_model=ProfilingSettingsModel)
+async def update_profiling_settings_endpoint(settings: ProfilingSettingsModel):
+    profiling_settings.update(enabled=settings.enabled, sample_rate=settings.sample_rate, allow_header=settings.allow_header)
+    return settings
+
+@app.get("/admin/capture")
+async def get_request_capture_endpoint():
+    if request_capture is None:
+        return {"enabled": False}
+    return {"enabled": True, **request_capture.stats()}
+
+@app.get("/profiles")
+async def list_profiles_endpoint(limit: int = Query(50, ge=1, le=1000, description="Most recent profiles to list.")):
+    return {"profiles": await run_in_threadpool(profile_store.list, limit)}
+
+@app.get("/profiles/{profile_id}", response_model=ProfileResponse)
+async def get_profile_endpoint(profile_id: str = Path(..., description="X-Profile-Id returned by a profiled /process-query call.")):
+    try:
+        return ProfileResponse(**await run_in_threadpool(profile_store.get, profile_id))
+    except ProfileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found.")
+
+@app.get("/profiles/{profile_id}/collapsed", response_class=PlainTextResponse)
+async def get_profile_stacks_endpoint(profile_id: str = Path(..., description="X-Profile-Id returned by a profiled /process-query call.")):
+    # Collapsed stacks: pipe into flamegraph.pl or open in speedscope.
+    try:
+        return PlainTextResponse(await run_in_threadpool(profile_store.get_collapsed, profile_id))
+    except ProfileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found.")
+
+@app.post("/refresh-value-index")
+async def refresh_value_index_endpoint(
+    full: bool = Query(False, description="Also re-check columns previously skipped as high-cardinality."),
+    datasource_id: Optional[str] = Query(None, description="Datasource whose index to refresh (default datasource if omitted).")
+):
+    try:
+        datasource = await run_in_threadpool(datasource_registry.get, datasource_id)
+    except DatasourceNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown datasource '{datasource_id}'.")
+    if not datasource.db:
+        raise HTTPException(status_code=503, detail="Database connection not available.")
+    try:
+        index = datasource.column_value_index
+        if isinstance(index, MappedColumnValueIndex) or index is None:
+            # The mapped snapshot is read-only; refresh the editable JSON index and re-snapshot it.
+            if datasource.value_index_path and os.path.exists(datasource.value_index_path):
+                index = await run_in_threadpool(ColumnValueIndex.load, datasource.value_index_path, **value_index_options)
+            else:
+                index = ColumnValueIndex(**value_index_options)
+        stats = await run_in_threadpool(index.refresh_from_engine, datasource.db._engine, parse_schema_tables_logic(datasource.db_schema), full)
+        if datasource.value_index_path:
+            await run_in_threadpool(index.save, datasource.value_index_path)
+            await run_in_threadpool(index.save_snapshot, snapshot_path_for(datasource.value_index_path))
+            # Other workers remap the replaced snapshot on their next lookup.
+            index = await run_in_threadpool(load_shared_value_index, datasource.value_index_path)
+        datasource.column_value_index = index
+        return {"message": f"Column-value index refreshed for datasource '{datasource.datasource_id}'.", **stats}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred while refreshing the value index: {str(e)}")
+
 @app.post("/add-examples")
 async def add_examples_endpoint(file: UploadFile = File(...)):
     if not vector_store:
@@ -275,6 +919,81 @@ async def delete_example_endpoint(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred while deleting Qdrant point: {str(e)}")
 
+def _require_example_collection():
+    if not qdrant_client_instance:
+        raise HTTPException(status_code=503, detail="Qdrant client is not available.")
+    if not QDRANT_COLLECTION_NAME or QDRANT_COLLECTION_NAME == "your_default_collection_name":
+        raise HTTPException(status_code=400, detail="Qdrant collection name is not configured properly.")
+
+@app.get("/examples/export")
+async def export_examples_endpoint(
+    with_vectors: bool = Query(False, description="Whether to include the vectors."),
+    vector_encoding: Literal["float", "base64"] = Query("base64", description="'base64' packs vectors as little-endian float32."),
+    tables: Optional[List[str]] = Query(None, description="Only export examples that use any of these tables."),
+    type: Optional[str] = Query(None, description="Only export examples of this query type."),
+    batch_size: int = Query(1000, ge=1, le=10000, description="Points fetched from Qdrant per scroll call.")
+):
+    _require_example_collection()
+    return StreamingResponse(
+        export_qdrant_points_ndjson_logic(
+            qdrant_client_instance=qdrant_client_instance,
+            collection_name=QDRANT_COLLECTION_NAME,
+            batch_size=batch_size,
+            with_vectors=with_vectors,
+            vector_encoding=vector_encoding,
+            query_filter=build_example_filter_logic(tables, type)
+        ),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{QDRANT_COLLECTION_NAME}.ndjson"'}
+    )
+
+@app.get("/examples/count", response_model=ExampleCountResponse)
+async def count_examples_endpoint(
+    tables: Optional[List[str]] = Query(None, description="Only count examples that use any of these tables."),
+    type: Optional[str] = Query(None, description="Only count examples of this query type.")
+):
+    _require_example_collection()
+    try:
+        count = await run_in_threadpool(count_qdrant_points_logic, qdrant_client_instance, QDRANT_COLLECTION_NAME, build_example_filter_logic(tables, type))
+        return ExampleCountResponse(count=count)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/examples/facets", response_model=ExampleFacetsResponse)
+async def example_facets_endpoint(
+    key: Literal["tables", "type"] = Query("tables", description="Payload field to count values of."),
+    limit: int = Query(20, ge=1, le=1000, description="Number of most frequent values to return."),
+    tables: Optional[List[str]] = Query(None, description="Restrict to examples that use any of these tables."),
+    type: Optional[str] = Query(None, description="Restrict to examples of this query type.")
+):
+    _require_example_collection()
+    try:
+        facets = await run_in_threadpool(facet_qdrant_points_logic, qdrant_client_instance, QDRANT_COLLECTION_NAME, key, limit, build_example_filter_logic(tables, type))
+        return ExampleFacetsResponse(**facets)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/examples/bulk-delete", response_model=BulkDeleteExamplesResponse)
+async def bulk_delete_examples_endpoint(request: BulkDeleteExamplesRequest):
+    _require_example_collection()
+    try:
+        result = await run_in_threadpool(
+            delete_qdrant_points_bulk_logic,
+            qdrant_client_instance,
+            QDRANT_COLLECTION_NAME,
+            request.ids,
+            build_example_filter_logic(request.tables, request.type)
+        )
+        return BulkDeleteExamplesResponse(
+            message=f"Deleted the examples matching the selection ({result['matched_count']} matched).",
+            matched_count=result["matched_count"],
+            details=result.get("details")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 if __name__ == "__main__":
     if not all([AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME, AZURE_OPENAI_CHAT_DEPLOYMENT_NAME]):
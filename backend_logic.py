@@ -1,12 +1,23 @@
 from fastapi import HTTPException 
-from typing import List, Any, Optional , Dict
+from typing import List, Any, Optional , Dict, Tuple
 from langchain_core.prompts import PromptTemplate
 from langchain_core.documents import Document
 from langchain.chains import LLMChain
+import base64
 import json
+import re
+import struct
+from functools import lru_cache
+from collections import deque
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, TimeoutError as FutureTimeoutError, wait
 from uuid import uuid4, UUID
 from qdrant_client import models
 
+from jobs import CancellationToken, JobCancelledError
+from result_spool import SpooledResult
+
 
 DB_SCHEMA_EXAMPLE = """
 Album(AlbumId, Title, ArtistId)
@@ -47,6 +58,12 @@ Track(TrackId, Name, AlbumId, MediaTypeId, GenreId, Composer, Milliseconds, Byte
 # Stores detailed information about each music track.
 """
 
+# Foreign keys that do not follow the ``<Table>Id`` naming convention (those are inferred from the schema).
+DB_SCHEMA_FOREIGN_KEYS = [
+    ("Customer", "SupportRepId", "Employee", "EmployeeId"),
+    ("Employee", "ReportsTo", "Employee", "EmployeeId"),
+]
+
 RELEVANCE_REWRITE_TABLES_TYPES_PROMPT_TEMPLATE  = """You are an AI assistant. Your task is to analyze a user question based on a database schema, determine if it's answerable, rewrite it for clarity if applicable, identify the relevant tables, and classify query types.
 
 ### Database Schema:
@@ -119,24 +136,189 @@ SQL Query Result:
 Natural Language Answer:
 """
 
+def normalize_question_logic(user_question: str) -> str:
+    normalized = re.sub(r"\s+", " ", user_question or "").strip().lower()
+    return normalized.rstrip(" ?.!")
+
+# Quoted literals / identifiers ('' and "" escapes included) are matched first so the whitespace inside them is kept.
+_SQL_WHITESPACE_OUTSIDE_QUOTES = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)|\s+")
+
+def normalize_sql_logic(sql_query: str) -> str:
+    # Collapses whitespace between tokens only: 'A  B' and 'A B' are different statements.
+    normalized = _SQL_WHITESPACE_OUTSIDE_QUOTES.sub(lambda match: match.group(1) or " ", sql_query or "").strip()
+    return normalized.rstrip(" ;")
+
 def validate_rewrite_identify_tables_and_types_logic(user_query: str, db_schema: str, llm_instance) -> str:
     prompt = PromptTemplate(template=RELEVANCE_REWRITE_TABLES_TYPES_PROMPT_TEMPLATE, input_variables=["query", "schema"])
     chain = LLMChain(llm=llm_instance, prompt=prompt)
     response = chain.invoke({"query": user_query, "schema": db_schema})
     return response['text']
 
-def retrieve_similar_examples_logic(query_text: str, vector_store_instance, k: int = 3) -> list:
+def retrieve_similar_examples_logic(query_text: str, vector_store_instance, k: int = 3, search_params: Optional[models.SearchParams] = None) -> list:
     if not query_text or not query_text.strip() or vector_store_instance is None:
         return []
     try:
-        similar_docs = vector_store_instance.similarity_search(query_text, k=k)
-        return [{"nl": doc.page_content, **doc.metadata} for doc in similar_docs]
+        similar_docs_with_scores = vector_store_instance.similarity_search_with_score(query_text, k=k, search_params=search_params)
+        return [{"nl": doc.page_content, **doc.metadata, "score": score} for doc, score in similar_docs_with_scores]
     except Exception:
         return []
 
-def format_dynamic_schema_logic(relevant_table_names: list, full_db_schema: str) -> str:
+# Distances whose Qdrant scores are similarities (higher is closer) on a fixed scale the reuse threshold can apply to.
+REUSABLE_EXAMPLE_DISTANCES = ("Cosine", "Dot")
+
+def find_reusable_example_logic(similar_examples: list, relevant_table_names: list, score_threshold: float, distance: str = "Cosine") -> Optional[Dict[str, Any]]:
+    # Only the top hit is considered: its vetted SQL is reused when it is near-verbatim and targets the same tables.
+    # Euclid/Manhattan scores are distances (lower is closer, unbounded), so no similarity threshold applies to them.
+    if not similar_examples or not score_threshold or distance not in REUSABLE_EXAMPLE_DISTANCES:
+        return None
+    top_example = similar_examples[0]
+    score = top_example.get("score")
+    if score is None or score < score_threshold or not top_example.get("sql"):
+        return None
+    example_tables = {t.strip().lower() for t in top_example.get("tables") or []}
+    analysis_tables = {t.strip().lower() for t in relevant_table_names or []}
+    if not example_tables or example_tables != analysis_tables:
+        return None
+    return top_example
+
+def parse_schema_tables_logic(full_db_schema: str) -> Dict[str, List[str]]:
+    tables = {}
+    for line in full_db_schema.strip().split("\n"):
+        match = re.match(r"^(\w+)\((.*)\)$", line.strip())
+        if match:
+            tables[match.group(1)] = [c.strip() for c in match.group(2).split(",") if c.strip()]
+    return tables
+
+class JoinGraph:
+    """FK graph over the schema with every shortest join path precomputed, so lookups are dict hits."""
+
+    def __init__(self, tables: Dict[str, List[str]], foreign_keys: List[Tuple[str, str, str, str]]):
+        self.tables = tables
+        self._canonical_names = {name.lower(): name for name in tables}
+        self.edges: Dict[Tuple[str, str], str] = {}
+        # Every (table, column) on either side of a foreign key, including ones whose edge duplicates another.
+        self.key_columns: set = set()
+        self.neighbours: Dict[str, List[str]] = {name: [] for name in tables}
+        for from_table, from_column, to_table, to_column in foreign_keys:
+            self._add_edge(from_table, from_column, to_table, to_column)
+        self.paths: Dict[Tuple[str, str], List[str]] = {}
+        for start in tables:
+            self._record_paths_from(start)
+
+    def _add_edge(self, from_table: str, from_column: str, to_table: str, to_column: str):
+        if from_table == to_table or from_table not in self.tables or to_table not in self.tables:
+            return
+        self.key_columns.add((from_table, from_column))
+        self.key_columns.add((to_table, to_column))
+        if (from_table, to_table) in self.edges:
+            return
+        condition = f"{from_table}.{from_column} = {to_table}.{to_column}"
+        self.edges[(from_table, to_table)] = condition
+        self.edges[(to_table, from_table)] = condition
+        self.neighbours[from_table].append(to_table)
+        self.neighbours[to_table].append(from_table)
+
+    def _record_paths_from(self, start: str):
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for neighbour in self.neighbours[current]:
+                if neighbour not in previous:
+                    previous[neighbour] = current
+                    queue.append(neighbour)
+        for end in previous:
+            path, node = [], end
+            while node is not None:
+                path.append(node)
+                node = previous[node]
+            self.paths[(start, end)] = path[::-1]
+
+    def canonical_name(self, table_name: str) -> Optional[str]:
+        return self._canonical_names.get(str(table_name).strip().lower())
+
+    def path(self, from_table: str, to_table: str) -> Optional[List[str]]:
+        return self.paths.get((from_table, to_table))
+
+    def join_condition(self, table_a: str, table_b: str) -> Optional[str]:
+        return self.edges.get((table_a, table_b))
+
+def infer_foreign_keys_logic(tables: Dict[str, List[str]]) -> List[Tuple[str, str, str, str]]:
+    # A column named like another table's leading ``<Table>Id`` column is treated as a reference to it.
+    primary_keys = {columns[0]: name for name, columns in tables.items() if columns and columns[0] == f"{name}Id"}
+    foreign_keys = []
+    for table_name, columns in tables.items():
+        for column in columns:
+            target_table = primary_keys.get(column)
+            if target_table and target_table != table_name:
+                foreign_keys.append((table_name, column, target_table, column))
+    return foreign_keys
+
+@lru_cache(maxsize=8)
+def get_join_graph_logic(full_db_schema: str, extra_foreign_keys: Tuple[Tuple[str, str, str, str], ...] = tuple(DB_SCHEMA_FOREIGN_KEYS)) -> JoinGraph:
+    # Cached per schema text, so a changed schema builds (and precomputes) a fresh graph on first use.
+    tables = parse_schema_tables_logic(full_db_schema)
+    return JoinGraph(tables, infer_foreign_keys_logic(tables) + list(extra_foreign_keys))
+
+def _join_graph_for(full_db_schema: str, foreign_keys: Optional[list] = None) -> JoinGraph:
+    if foreign_keys is None:
+        return get_join_graph_logic(full_db_schema)
+    return get_join_graph_logic(full_db_schema, tuple(tuple(fk) for fk in foreign_keys))
+
+def resolve_join_tables_logic(relevant_table_names: list, join_graph: JoinGraph) -> Tuple[List[str], List[str]]:
+    # Drops tables the schema does not know, then greedily connects the rest through their shortest join paths.
+    resolved_tables = []
+    for table_name in relevant_table_names:
+        canonical = join_graph.canonical_name(table_name)
+        if canonical and canonical not in resolved_tables:
+            resolved_tables.append(canonical)
+
+    connected_tables = resolved_tables[:1]
+    join_hints = []
+    for table_name in resolved_tables[1:]:
+        if table_name in connected_tables:
+            continue
+        candidate_paths = [join_graph.path(source, table_name) for source in connected_tables]
+        candidate_paths = [path for path in candidate_paths if path]
+        if not candidate_paths:
+            connected_tables.append(table_name)
+            continue
+        best_path = min(candidate_paths, key=len)
+        for table_a, table_b in zip(best_path, best_path[1:]):
+            condition = join_graph.join_condition(table_a, table_b)
+            if condition and condition not in join_hints:
+                join_hints.append(condition)
+        for path_table in best_path:
+            if path_table not in connected_tables:
+                connected_tables.append(path_table)
+    return connected_tables, join_hints
+
+def reflect_db_schema_logic(engine) -> Tuple[str, List[Tuple[str, str, str, str]]]:
+    # Builds the compact ``Table(col, ...)`` schema text (and real FKs) for databases without a hand-written schema.
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    schema_lines = []
+    foreign_keys = []
+    for table_name in inspector.get_table_names():
+        column_names = [column["name"] for column in inspector.get_columns(table_name)]
+        schema_lines.append(f"{table_name}({', '.join(column_names)})")
+        for fk in inspector.get_foreign_keys(table_name):
+            for column_name, referred_column in zip(fk["constrained_columns"], fk["referred_columns"]):
+                foreign_keys.append((table_name, column_name, fk["referred_table"], referred_column))
+    return "\n".join(schema_lines), foreign_keys
+
+def complete_join_tables_logic(relevant_table_names: list, full_db_schema: str, foreign_keys: Optional[list] = None) -> Tuple[List[str], List[str]]:
+    # The analysis tables plus every table on their join paths; falls back to the input when none are known.
+    join_graph = _join_graph_for(full_db_schema, foreign_keys)
+    completed_table_names, join_hints = resolve_join_tables_logic(relevant_table_names or [], join_graph)
+    return completed_table_names or list(relevant_table_names or []), join_hints
+
+def format_dynamic_schema_logic(relevant_table_names: list, full_db_schema: str, complete_join_paths: bool = True, foreign_keys: Optional[list] = None) -> str:
     if not relevant_table_names:
         return "No specific table schema provided. Please infer from the question."
+    join_hints = []
+    if complete_join_paths:
+        relevant_table_names, join_hints = complete_join_tables_logic(relevant_table_names, full_db_schema, foreign_keys)
     schema_lines = full_db_schema.strip().split('\n')
     dynamic_schema_parts = []
     for table_name in relevant_table_names:
@@ -152,6 +334,9 @@ def format_dynamic_schema_logic(relevant_table_names: list, full_db_schema: str)
                     elif not desc_line.startswith("#") and desc_line:
                         break
                 break
+    if dynamic_schema_parts and join_hints:
+        dynamic_schema_parts.append("# Join hints:")
+        dynamic_schema_parts.extend(f"# {condition}" for condition in join_hints)
     return "\n".join(dynamic_schema_parts) if dynamic_schema_parts else "Selected table schemas not found or empty."
 
 def format_few_shot_examples_logic(few_shot_examples: list) -> str:
@@ -164,14 +349,144 @@ def format_few_shot_examples_logic(few_shot_examples: list) -> str:
         formatted_examples_str += f"-- User Question: {nl}\nSQL: {sql}\n\n"
     return formatted_examples_str.strip()
 
-def assemble_text_to_sql_prompt_logic(instruction: str, rewritten_query: str, few_shot_examples: list, relevant_table_names: list, full_db_schema: str) -> str:
-    dynamic_schema_str = format_dynamic_schema_logic(relevant_table_names, full_db_schema)
-    few_shots_str = format_few_shot_examples_logic(few_shot_examples)
-    prompt_parts = [instruction, "\n### Database Schema:", "Only use the following tables and their columns.", dynamic_schema_str]
-    if few_shots_str:
-        prompt_parts.append("\n" + few_shots_str)
-    prompt_parts.extend(["\n### Task:", "Convert the following user question to a SQL query.", f"User Question: {rewritten_query}", "SQL Query:"])
-    return "\n".join(prompt_parts)
+@lru_cache(maxsize=4)
+def _get_tokenizer(encoding_name: str):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        return None
+
+def count_tokens_logic(text: str, encoding_name: str = "cl100k_base") -> int:
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer(encoding_name)
+    if tokenizer is None:
+        # tiktoken unavailable: ~4 characters per token is close enough for budgeting.
+        return (len(text) + 3) // 4
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+def _name_words(name: str) -> List[str]:
+    # "BillingCountry" / "billing_country" -> ["billing", "country"]
+    return [word.lower() for word in re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", name)]
+
+def _question_words(question: str) -> set:
+    # Lowercased words with a plural "s" stripped, so "countries"/"country" and "genres"/"genre" meet.
+    words = set()
+    for word in re.findall(r"[a-z0-9]+", (question or "").lower()):
+        words.add(word)
+        if word.endswith("ies"):
+            words.add(word[:-3] + "y")
+        elif word.endswith("s"):
+            words.add(word[:-1])
+    return words
+
+def is_key_column_logic(table_name: str, column_name: str) -> bool:
+    # Naming convention fallback for keys the FK list does not cover: Id, CustomerId, id, customer_id.
+    lowered = column_name.lower()
+    return lowered in ("id", f"{table_name.lower()}id") or column_name.endswith("Id") or lowered.endswith("_id")
+
+def _column_relevance(column_name: str, question_words: set) -> float:
+    words = _name_words(column_name)
+    if not words:
+        return 0.0
+    return sum(1 for word in words if word in question_words) / len(words)
+
+def _drop_one_schema_column(dynamic_schema_str: str, protected_columns: Optional[set] = None, question_words: Optional[set] = None) -> Optional[str]:
+    # Drops the lowest-ranked column: least related to the question, then from the widest table, then the last one.
+    # Protected columns ((table, column), lowercased: join keys, columns with value hints) and key columns are kept.
+    protected_columns = protected_columns or set()
+    question_words = question_words or set()
+    lines = dynamic_schema_str.split("\n")
+    best = None
+    for idx, line in enumerate(lines):
+        match = re.match(r"^(\w+)\((.*)\)$", line.strip())
+        if not match:
+            continue
+        table_name = match.group(1)
+        columns = [c.strip() for c in match.group(2).split(",") if c.strip()]
+        for position, column in enumerate(columns):
+            if (table_name.lower(), column.lower()) in protected_columns or is_key_column_logic(table_name, column):
+                continue
+            rank = (_column_relevance(column, question_words), -len(columns), -position)
+            if best is None or rank < best[0]:
+                best = (rank, idx, table_name, columns, column)
+    if best is None:
+        return None
+    _, best_idx, table_name, columns, drop_column = best
+    lines[best_idx] = f"{table_name}({', '.join(c for c in columns if c != drop_column)})"
+    return "\n".join(lines)
+
+def format_column_value_hints_logic(value_matches: list) -> str:
+    if not value_matches:
+        return ""
+    hint_lines = ["### Known column values (use these exact literals):"]
+    for match in value_matches:
+        literal = match["value"].replace("'", "''")
+        hint_lines.append(f"-- {match['table']}.{match['column']} = '{literal}'")
+    return "\n".join(hint_lines)
+
+def _join_prompt_sections(instruction: str, dynamic_schema_str: str, few_shots_str: str, rewritten_query: str, value_hints_str: str = "") -> Tuple[str, Dict[str, str]]:
+    schema_section = "\n".join(["\n### Database Schema:", "Only use the following tables and their columns.", dynamic_schema_str])
+    values_section = "\n" + value_hints_str if value_hints_str else ""
+    examples_section = "\n" + few_shots_str if few_shots_str else ""
+    task_section = "\n".join(["\n### Task:", "Convert the following user question to a SQL query.", f"User Question: {rewritten_query}", "SQL Query:"])
+    sections = {"instruction": instruction, "schema": schema_section, "values": values_section, "examples": examples_section, "task": task_section}
+    return "\n".join(part for part in sections.values() if part), sections
+
+def build_text_to_sql_prompt_logic(
+    instruction: str,
+    rewritten_query: str,
+    few_shot_examples: list,
+    relevant_table_names: list,
+    full_db_schema: str,
+    token_budget: Optional[int] = None,
+    encoding_name: str = "cl100k_base",
+    column_value_index=None,
+    foreign_keys: Optional[list] = None
+) -> Tuple[str, Dict[str, int]]:
+    # few_shot_examples are expected best-first (as returned by the vector store), so trimming pops from the end.
+    kept_examples = list(few_shot_examples or [])
+    dynamic_schema_str = format_dynamic_schema_logic(relevant_table_names, full_db_schema, foreign_keys=foreign_keys)
+    value_hints_str = ""
+    value_matches = []
+    if column_value_index is not None:
+        # Same table set the schema section shows, so literals of join-path tables are grounded too.
+        value_tables, _ = complete_join_tables_logic(relevant_table_names, full_db_schema, foreign_keys)
+        value_matches = column_value_index.lookup(rewritten_query, tables=value_tables)
+        value_hints_str = format_column_value_hints_logic(value_matches)
+    prompt, sections = _join_prompt_sections(instruction, dynamic_schema_str, format_few_shot_examples_logic(kept_examples), rewritten_query, value_hints_str)
+    dropped_examples = 0
+    dropped_columns = 0
+
+    if token_budget:
+        while kept_examples and count_tokens_logic(prompt, encoding_name) > token_budget:
+            kept_examples.pop()
+            dropped_examples += 1
+            prompt, sections = _join_prompt_sections(instruction, dynamic_schema_str, format_few_shot_examples_logic(kept_examples), rewritten_query, value_hints_str)
+        # Join keys and columns the value hints name must survive, or the prompt would contradict itself.
+        join_graph = _join_graph_for(full_db_schema, foreign_keys)
+        protected_columns = {(table.lower(), column.lower()) for table, column in join_graph.key_columns}
+        protected_columns |= {(match["table"].lower(), match["column"].lower()) for match in value_matches}
+        question_words = _question_words(rewritten_query)
+        while count_tokens_logic(prompt, encoding_name) > token_budget:
+            trimmed_schema_str = _drop_one_schema_column(dynamic_schema_str, protected_columns, question_words)
+            if trimmed_schema_str is None:
+                break
+            dynamic_schema_str = trimmed_schema_str
+            dropped_columns += 1
+            prompt, sections = _join_prompt_sections(instruction, dynamic_schema_str, format_few_shot_examples_logic(kept_examples), rewritten_query, value_hints_str)
+
+    token_counts = {name: count_tokens_logic(text, encoding_name) for name, text in sections.items()}
+    token_counts["total"] = count_tokens_logic(prompt, encoding_name)
+    token_counts["budget"] = token_budget or 0
+    token_counts["dropped_examples"] = dropped_examples
+    token_counts["dropped_columns"] = dropped_columns
+    return prompt, token_counts
+
+def assemble_text_to_sql_prompt_logic(instruction: str, rewritten_query: str, few_shot_examples: list, relevant_table_names: list, full_db_schema: str, token_budget: Optional[int] = None) -> str:
+    prompt, _ = build_text_to_sql_prompt_logic(instruction, rewritten_query, few_shot_examples, relevant_table_names, full_db_schema, token_budget=token_budget)
+    return prompt
 
 def generate_sql_from_prompt_logic(assembled_prompt: str, sql_llm_instance) -> str:
     prompt_template = PromptTemplate.from_template("{final_prompt}")
@@ -179,6 +494,238 @@ def generate_sql_from_prompt_logic(assembled_prompt: str, sql_llm_instance) -> s
     response = sql_generation_chain.invoke({"final_prompt": assembled_prompt})
     return response.get('text', '').strip()
 
+SQL_MODEL_TIERS = ["fast", "strong"]
+
+def choose_sql_model_tier_logic(query_types: list, relevant_table_names: list, fast_query_types: list, fast_max_tables: int = 1) -> str:
+    normalized_types = {t.strip().lower() for t in query_types or []}
+    allowed_types = {t.strip().lower() for t in fast_query_types or []}
+    if normalized_types and normalized_types <= allowed_types and len(relevant_table_names or []) <= fast_max_tables:
+        return "fast"
+    return "strong"
+
+def validate_generated_sql_logic(sql_query: str) -> Optional[str]:
+    # Cheap structural checks only; returns a reason when the SQL should not be trusted as-is.
+    if not sql_query or not sql_query.strip():
+        return "No SQL was generated."
+    if "```" in sql_query:
+        return "SQL is wrapped in markdown fences."
+    if not re.match(r"^\s*(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+        return "SQL does not start with SELECT or WITH."
+    return None
+
+def is_failed_query_result_logic(query_result) -> bool:
+    return isinstance(query_result, str) and ("Error executing SQL" in query_result or query_result == "No SQL query to execute.")
+
+def query_result_vote_key_logic(query_result, timeout_seconds: float) -> str:
+    # A spooled result's text covers only its first page, so spooled results are compared by a digest of all
+    # their rows. One not fully spooled in time cannot be compared and only collects the votes for its own SQL.
+    if isinstance(query_result, SpooledResult):
+        if query_result.wait_until_complete(timeout_seconds) and query_result.error is None:
+            return f"{query_result.row_count}:{query_result.truncated}:{query_result.digest}"
+        return query_result.handle
+    return str(query_result)
+
+def build_sql_retry_prompt_logic(assembled_prompt: str, failed_sql: str, failure_reason: str) -> str:
+    prompt_head = assembled_prompt.rsplit("SQL Query:", 1)[0].rstrip()
+    return "\n".join([
+        prompt_head,
+        "\n### Previous Attempt (failed):",
+        failed_sql or "(empty)",
+        f"Failure: {failure_reason[:500]}",
+        "Write a corrected SQL query.",
+        "SQL Query:"
+    ])
+
+class ModelRoutingStats:
+    """Per-tier call counts, failures and recent latencies, kept in-process for tuning the routing thresholds."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._window = window
+        self._tiers: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, tier: str, deployment: str, latency_ms: float, succeeded: bool, escalated_from: Optional[str] = None):
+        with self._lock:
+            tier_stats = self._tiers.setdefault(tier, {"deployment": deployment, "calls": 0, "failures": 0, "escalations_in": 0, "latencies_ms": deque(maxlen=self._window)})
+            tier_stats["calls"] += 1
+            tier_stats["failures"] += 0 if succeeded else 1
+            tier_stats["escalations_in"] += 1 if escalated_from else 0
+            tier_stats["latencies_ms"].append(latency_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {}
+            for tier, tier_stats in self._tiers.items():
+                latencies = sorted(tier_stats["latencies_ms"])
+                snapshot[tier] = {
+                    "deployment": tier_stats["deployment"],
+                    "calls": tier_stats["calls"],
+                    "failures": tier_stats["failures"],
+                    "escalations_in": tier_stats["escalations_in"],
+                    "latency_ms_avg": round(sum(latencies) / len(latencies), 1) if latencies else None,
+                    "latency_ms_p50": round(latencies[len(latencies) // 2], 1) if latencies else None,
+                    "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1) if latencies else None,
+                }
+            return snapshot
+
+def with_candidate_temperature_logic(llm_instance, temperature: float):
+    # Candidates after the first are sampled at a higher temperature so the fan-out actually explores.
+    if hasattr(llm_instance, "temperature") and hasattr(llm_instance, "model_copy"):
+        return llm_instance.model_copy(update={"temperature": temperature})
+    return llm_instance
+
+def run_sql_candidates_logic(
+    assembled_prompt: str,
+    llm_instances: list,
+    execute_fn,
+    executor,
+    llm_semaphore=None,
+    strategy: str = "first_valid",
+    latency_budget_seconds: float = 30.0,
+    cancel_token: Optional[CancellationToken] = None,
+    discard_result_fn=None
+) -> Tuple[str, Any, Dict[str, Any]]:
+    """Generates one SQL candidate per LLM instance concurrently and executes the distinct valid ones.
+
+    ``first_valid`` returns as soon as any candidate executes cleanly; ``majority`` waits (within the budget)
+    and returns the result produced by the most candidates, comparing spooled results by all their rows rather
+    than their first page. ``execute_fn(sql, cancel_token)`` runs one
+    statement; each distinct SQL runs once, under its own child of the caller's (job's) ``cancel_token``.
+    Once decided, candidates that have not generated or executed yet are skipped and every execution but
+    the winner's is cancelled, which kills its running statement; ``discard_result_fn(result)`` is called
+    on each losing execution's result, now or when it finishes. ``candidates_info["candidates"]`` reports
+    each candidate's generation latency and outcome.
+    """
+    start_time = time.perf_counter()
+    deadline = start_time + latency_budget_seconds
+    decided = threading.Event()
+    seen_lock = threading.Lock()
+    seen_sql: Dict[str, int] = {}
+    # normalized SQL -> (its result, the token that cancels its execution)
+    executions: Dict[str, Tuple[Future, CancellationToken]] = {}
+
+    def generate(llm_instance) -> Tuple[Optional[str], float]:
+        if llm_semaphore is None:
+            generation_start = time.perf_counter()
+            return generate_sql_from_prompt_logic(assembled_prompt, llm_instance), (time.perf_counter() - generation_start) * 1000
+        with llm_semaphore:
+            # The wait for a slot can outlast the decision; a decided run must not spend an LLM call.
+            if decided.is_set():
+                return None, 0.0
+            generation_start = time.perf_counter()
+            return generate_sql_from_prompt_logic(assembled_prompt, llm_instance), (time.perf_counter() - generation_start) * 1000
+
+    def run_candidate(candidate_index: int, llm_instance):
+        if decided.is_set():
+            return {"index": candidate_index, "skipped": True}
+        sql, latency_ms = generate(llm_instance)
+        if sql is None:
+            return {"index": candidate_index, "skipped": True}
+        normalized_sql = normalize_sql_logic(sql)
+        failure_reason = validate_generated_sql_logic(sql)
+        with seen_lock:
+            duplicate_of = seen_sql.setdefault(normalized_sql, candidate_index)
+            runs_execution = failure_reason is None and normalized_sql not in executions
+            if runs_execution:
+                execution_token = cancel_token.child() if cancel_token is not None else CancellationToken()
+                executions[normalized_sql] = (Future(), execution_token)
+        candidate = {
+            "index": candidate_index,
+            "sql": sql,
+            "normalized_sql": normalized_sql,
+            "latency_ms": round(latency_ms, 1),
+            "duplicate_of": duplicate_of if duplicate_of != candidate_index else None
+        }
+        query_result = None
+        if runs_execution:
+            result_future, execution_token = executions[normalized_sql]
+            try:
+                if not decided.is_set():
+                    query_result = execute_fn(sql, execution_token)
+            except JobCancelledError:
+                pass
+            finally:
+                result_future.set_result(query_result)
+        elif failure_reason is None and strategy == "majority":
+            # Duplicates still count as votes: they take the first identical candidate's result instead of re-running it.
+            try:
+                query_result = executions[normalized_sql][0].result(timeout=max(0.0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                pass
+        if query_result is not None:
+            candidate["query_result"] = query_result
+            if is_failed_query_result_logic(query_result):
+                failure_reason = str(query_result)
+        candidate["failure"] = failure_reason
+        candidate["valid"] = failure_reason is None and "query_result" in candidate
+        return candidate
+
+    pending = {executor.submit(run_candidate, i, llm_instance) for i, llm_instance in enumerate(llm_instances)}
+    finished = []
+    winner = None
+    while pending and winner is None:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.perf_counter()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            try:
+                candidate = future.result()
+            except Exception as e:
+                candidate = {"index": -1, "sql": "", "failure": f"Candidate generation failed: {e}", "valid": False}
+            finished.append(candidate)
+            if strategy == "first_valid" and candidate.get("valid") and winner is None:
+                winner = candidate
+    decided.set()
+    for future in pending:
+        future.cancel()
+
+    valid_candidates = [c for c in finished if c.get("valid")]
+    if winner is None and valid_candidates:
+        votes: Dict[str, List[Dict[str, Any]]] = {}
+        for candidate in valid_candidates:
+            vote_key = query_result_vote_key_logic(candidate["query_result"], max(0.0, deadline - time.perf_counter()))
+            votes.setdefault(vote_key, []).append(candidate)
+        winner = max(votes.values(), key=len)[0]
+
+    # Everything still running (or still spooling rows) except the winning statement is stopped, and its
+    # result released: nobody pages through it, and it would hold a result handle (and maybe a spooler).
+    with seen_lock:
+        losing_executions = [execution for normalized_sql, execution in executions.items() if winner is None or normalized_sql != winner["normalized_sql"]]
+    for result_future, token in losing_executions:
+        token.cancel()
+        if discard_result_fn is not None:
+            result_future.add_done_callback(lambda finished: finished.result() is not None and discard_result_fn(finished.result()))
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    candidates_info = {
+        "strategy": strategy,
+        "requested": len(llm_instances),
+        "completed": len([c for c in finished if not c.get("skipped")]),
+        "unique_sql": len(seen_sql),
+        "valid": len(valid_candidates),
+        "timed_out": bool(pending) and winner is None,
+        "winner_index": winner["index"] if winner else None,
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 1),
+        "candidates": [
+            {
+                "index": c["index"],
+                "latency_ms": c["latency_ms"],
+                "duplicate_of": c["duplicate_of"],
+                "valid": c["valid"],
+                "failure": c["failure"][:300] if c["failure"] else None
+            }
+            for c in sorted(finished, key=lambda c: c["index"]) if "latency_ms" in c
+        ]
+    }
+    if winner is not None:
+        return winner["sql"], winner["query_result"], candidates_info
+    attempted = [c for c in finished if c.get("sql")]
+    if attempted:
+        fallback = min(attempted, key=lambda c: c["index"])
+        return fallback["sql"], fallback.get("query_result"), candidates_info
+    return "", None, candidates_info
+
 def execute_sql_query_logic(sql_query: str, db_instance):
     if not db_instance:
         raise HTTPException(status_code=500, detail="Database connection not available in logic.")
@@ -189,6 +736,18 @@ def execute_sql_query_logic(sql_query: str, db_instance):
     except Exception as e:
         return f"Error executing SQL: {str(e)}"
 
+def execute_sql_query_paged_logic(sql_query: str, db_instance, result_spool, page_size: Optional[int] = None, cancel_token=None):
+    # Same contract as execute_sql_query_logic, but rows stream through a server-side cursor into the spool.
+    # ``cancel_token`` kills the statement (on an instrumented engine) and stops the spooling when cancelled.
+    if not db_instance:
+        raise HTTPException(status_code=500, detail="Database connection not available in logic.")
+    if not sql_query or not sql_query.strip():
+        return "No SQL query to execute."
+    try:
+        return result_spool.execute(db_instance._engine, sql_query, page_size=page_size, cancel_token=cancel_token)
+    except Exception as e:
+        return f"Error executing SQL: {str(e)}"
+
 def generate_natural_language_response_logic(user_question: str, sql_result: str, nl_llm_instance) -> str:
     prompt = PromptTemplate(template=SQL_RESULT_TO_NL_PROMPT_TEMPLATE, input_variables=["user_question", "sql_result"])
     chain = LLMChain(llm=nl_llm_instance, prompt=prompt)
@@ -366,4 +925,165 @@ def delete_qdrant_point_logic(
             raise RuntimeError(f"Failed to delete point {point_id}. Status: {status}, Info: {operation_info}")
             
     except Exception as e:
-        raise RuntimeError(f"Error deleting point {point_id} from Qdrant collection '{collection_name}': {e}")
\ No newline at end of file
+        raise RuntimeError(f"Error deleting point {point_id} from Qdrant collection '{collection_name}': {e}")
+
+# --- Bulk example administration ---
+# Example metadata lives under the "metadata" payload key written by the LangChain Qdrant wrapper.
+EXAMPLE_FACET_KEYS = {"tables": "metadata.tables", "type": "metadata.type"}
+
+def parse_qdrant_point_id_logic(point_id: Any) -> Any:
+    """Qdrant point ID (unsigned integer or UUID string) from an int or string; ValueError for anything else.
+
+    Malformed IDs are rejected here rather than passed on for Qdrant to refuse with an opaque client error."""
+    if isinstance(point_id, int) and not isinstance(point_id, bool):
+        if point_id < 0:
+            raise ValueError(f"Point ID '{point_id}' must not be negative.")
+        return point_id
+    if isinstance(point_id, str):
+        point_id = point_id.strip()
+        if point_id.isdigit():
+            return int(point_id)
+        try:
+            return str(UUID(point_id))
+        except ValueError:
+            raise ValueError(f"Point ID '{point_id}' is neither an unsigned integer nor a UUID.")
+    raise ValueError(f"Point ID '{point_id}' must be an integer or a string (UUID).")
+
+def build_example_filter_logic(tables: Optional[List[str]] = None, example_type: Optional[str] = None) -> Optional[models.Filter]:
+    """Payload filter matching examples that use any of ``tables`` and/or have the given ``type``."""
+    conditions = []
+    if tables:
+        conditions.append(models.FieldCondition(key=EXAMPLE_FACET_KEYS["tables"], match=models.MatchAny(any=list(tables))))
+    if example_type:
+        conditions.append(models.FieldCondition(key=EXAMPLE_FACET_KEYS["type"], match=models.MatchValue(value=example_type)))
+    return models.Filter(must=conditions) if conditions else None
+
+def _encode_vector(vector: Any, vector_encoding: str) -> Any:
+    if vector_encoding == "base64":
+        # Little-endian float32, 4 bytes per dimension instead of ~20 characters of JSON.
+        if isinstance(vector, dict):
+            return {name: _encode_vector(v, vector_encoding) for name, v in vector.items()}
+        return base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+    return vector
+
+def export_qdrant_points_ndjson_logic(
+    qdrant_client_instance,
+    collection_name: str,
+    batch_size: int = 1000,
+    with_vectors: bool = False,
+    vector_encoding: str = "float",
+    query_filter: Optional[models.Filter] = None
+):
+    """Yields one JSON line per point, scrolling the collection batch by batch so memory stays flat."""
+    if not qdrant_client_instance:
+        raise ValueError("Qdrant client instance is not available.")
+    offset = None
+    while True:
+        points, offset = qdrant_client_instance.scroll(
+            collection_name=collection_name,
+            scroll_filter=query_filter,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=with_vectors
+        )
+        lines = []
+        for point in points:
+            point_dict = {"id": point.id, "payload": point.payload}
+            if with_vectors and point.vector is not None:
+                point_dict["vector"] = _encode_vector(point.vector, vector_encoding)
+                point_dict["vector_encoding"] = vector_encoding
+            lines.append(json.dumps(point_dict, ensure_ascii=False, separators=(",", ":")))
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+        if offset is None:
+            break
+
+def count_qdrant_points_logic(qdrant_client_instance, collection_name: str, query_filter: Optional[models.Filter] = None, exact: bool = True) -> int:
+    if not qdrant_client_instance:
+        raise ValueError("Qdrant client instance is not available.")
+    try:
+        return qdrant_client_instance.count(collection_name=collection_name, count_filter=query_filter, exact=exact).count
+    except Exception as e:
+        raise RuntimeError(f"Error counting points in Qdrant collection '{collection_name}': {e}")
+
+def facet_qdrant_points_logic(
+    qdrant_client_instance,
+    collection_name: str,
+    key: str,
+    limit: int = 20,
+    query_filter: Optional[models.Filter] = None
+) -> Dict[str, Any]:
+    """Value counts for one example payload field, computed server-side by the Qdrant facet API.
+
+    Servers without facet support (or without a keyword index on the field) fall back to a
+    payload-only scroll that transfers just that field.
+    """
+    if not qdrant_client_instance:
+        raise ValueError("Qdrant client instance is not available.")
+    payload_key = EXAMPLE_FACET_KEYS[key]
+    try:
+        facet_response = qdrant_client_instance.facet(
+            collection_name=collection_name,
+            key=payload_key,
+            facet_filter=query_filter,
+            limit=limit,
+            exact=True
+        )
+        return {"key": key, "source": "facet", "values": [{"value": hit.value, "count": hit.count} for hit in facet_response.hits]}
+    except Exception as e:
+        print(f"Warning: facet API unavailable for '{payload_key}', falling back to scrolling: {e}")
+
+    counts: Dict[Any, int] = {}
+    offset = None
+    try:
+        while True:
+            points, offset = qdrant_client_instance.scroll(
+                collection_name=collection_name,
+                scroll_filter=query_filter,
+                limit=1000,
+                offset=offset,
+                with_payload=models.PayloadSelectorInclude(include=[payload_key]),
+                with_vectors=False
+            )
+            for point in points:
+                value = (point.payload or {}).get("metadata", {}).get(key)
+                for item in value if isinstance(value, list) else [value]:
+                    if item is not None:
+                        counts[item] = counts.get(item, 0) + 1
+            if offset is None:
+                break
+    except Exception as e:
+        raise RuntimeError(f"Error computing facets for '{key}' in Qdrant collection '{collection_name}': {e}")
+    top_values = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+    return {"key": key, "source": "scroll", "values": [{"value": value, "count": count} for value, count in top_values]}
+
+def delete_qdrant_points_bulk_logic(
+    qdrant_client_instance,
+    collection_name: str,
+    point_ids: Optional[List[Any]] = None,
+    query_filter: Optional[models.Filter] = None
+) -> Dict[str, Any]:
+    """Deletes by ID list or by payload filter in one request; refuses an empty selector.
+
+    ``matched_count`` is how many points matched just before the delete, not a count of deleted points:
+    Qdrant does not report one, and writes landing in between can change it.
+    """
+    if not qdrant_client_instance:
+        raise ValueError("Qdrant client instance is not available.")
+    if bool(point_ids) == bool(query_filter):
+        raise ValueError("Provide either a non-empty list of IDs or a filter (not both).")
+    try:
+        if point_ids:
+            processed_ids = [parse_qdrant_point_id_logic(point_id) for point_id in point_ids]
+            matched = len(qdrant_client_instance.retrieve(collection_name=collection_name, ids=processed_ids, with_payload=False, with_vectors=False))
+            points_selector = models.PointIdsList(points=processed_ids)
+        else:
+            matched = qdrant_client_instance.count(collection_name=collection_name, count_filter=query_filter, exact=True).count
+            points_selector = models.FilterSelector(filter=query_filter)
+        operation_info = qdrant_client_instance.delete(collection_name=collection_name, points_selector=points_selector, wait=True)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error bulk-deleting points from Qdrant collection '{collection_name}': {e}")
+    return {"status": "success", "matched_count": matched, "details": str(operation_info)}
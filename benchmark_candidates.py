@@ -0,0 +1,93 @@
+"""Benchmarks multi-candidate SQL generation against a fake LLM and a local SQLite database.
+
+Usage: python benchmark_candidates.py [--runs 50] [--candidates 1 3 5] [--failure-rate 0.4]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+from backend_logic import execute_sql_query_logic, run_sql_candidates_logic
+
+GOOD_SQL = "SELECT FirstName FROM Customer WHERE Country = 'Brazil'"
+BAD_SQL = "SELECT FirstName FROM Customers WHERE Country = 'Brazil'"
+
+
+class FakeSQLLLM(LLM):
+    """Returns valid SQL with probability 1 - failure_rate after a random, LLM-like delay."""
+
+    failure_rate: float = 0.4
+    mean_delay_seconds: float = 0.2
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-sql"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        time.sleep(random.expovariate(1.0 / self.mean_delay_seconds))
+        return BAD_SQL if random.random() < self.failure_rate else GOOD_SQL
+
+
+def create_benchmark_db(path: str) -> SQLDatabase:
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE Customer (CustomerId INTEGER PRIMARY KEY, FirstName TEXT, Country TEXT)")
+    connection.executemany(
+        "INSERT INTO Customer VALUES (?, ?, ?)",
+        [(i, f"Name{i}", ["Brazil", "USA", "France"][i % 3]) for i in range(1, 1001)],
+    )
+    connection.commit()
+    connection.close()
+    return SQLDatabase(engine=create_engine(f"sqlite:///{path}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--failure-rate", type=float, default=0.4)
+    parser.add_argument("--mean-delay", type=float, default=0.2)
+    parser.add_argument("--strategy", choices=["first_valid", "majority"], default="first_valid")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = create_benchmark_db(os.path.join(tmp_dir, "bench.db"))
+        llm = FakeSQLLLM(failure_rate=args.failure_rate, mean_delay_seconds=args.mean_delay)
+        llm_semaphore = threading.BoundedSemaphore(args.llm_concurrency)
+        executor = ThreadPoolExecutor(max_workers=max(args.candidates) * 2)
+
+        print(f"{'candidates':>10} {'success':>8} {'p50_ms':>8} {'p95_ms':>8}")
+        for num_candidates in args.candidates:
+            latencies, successes = [], 0
+            for _ in range(args.runs):
+                start_time = time.perf_counter()
+                _, query_result, info = run_sql_candidates_logic(
+                    assembled_prompt="SQL Query:",
+                    llm_instances=[llm] * num_candidates,
+                    execute_fn=lambda sql_query, cancel_token: execute_sql_query_logic(sql_query, db),
+                    executor=executor,
+                    llm_semaphore=llm_semaphore,
+                    strategy=args.strategy,
+                )
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                successes += 1 if info["valid"] else 0
+            latencies.sort()
+            print(
+                f"{num_candidates:>10} {successes / args.runs:>8.0%} "
+                f"{statistics.median(latencies):>8.0f} {latencies[int(len(latencies) * 0.95) - 1]:>8.0f}"
+            )
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
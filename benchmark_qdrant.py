@@ -0,0 +1,117 @@
+"""Benchmarks example-retrieval latency and recall for different Qdrant collection settings.
+
+Usage: python benchmark_qdrant.py [--url http://localhost:6333] [--points 20000] [--dim 1536] [--queries 200]
+
+Without --url the benchmark runs against Qdrant's local (in-process) mode. Local mode always searches
+exhaustively, so it only gives the exact baseline; HNSW and quantization effects show up against a server.
+"""
+import argparse
+import statistics
+import time
+import warnings
+from typing import List
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from backend_logic import EXAMPLE_FACET_KEYS
+from qdrant_setup import CollectionSettings, ensure_example_collection
+
+BUILD_VARIANTS = {
+    "m16_efc100": dict(hnsw_m=16, hnsw_ef_construct=100),
+    "m32_efc200": dict(hnsw_m=32, hnsw_ef_construct=200),
+    "m16_scalar": dict(hnsw_m=16, hnsw_ef_construct=100, quantization="scalar"),
+    "m16_binary": dict(hnsw_m=16, hnsw_ef_construct=100, quantization="binary"),
+}
+
+
+def make_vectors(num_points: int, dim: int, num_clusters: int, seed: int) -> np.ndarray:
+    # Clustered unit vectors: closer to real question embeddings than uniform noise, which makes every index look perfect.
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim))
+    vectors = centers[rng.integers(0, num_clusters, num_points)] + 0.35 * rng.normal(size=(num_points, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def wait_until_indexed(client: QdrantClient, collection_name: str, timeout_seconds: float = 600.0):
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        if client.get_collection(collection_name).status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(0.5)
+    print(f"Warning: '{collection_name}' still optimizing after {timeout_seconds:.0f}s; results may be skewed.")
+
+
+def load_collection(client: QdrantClient, collection_name: str, settings: CollectionSettings, vectors: np.ndarray, batch_size: int = 512):
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    ensure_example_collection(client, collection_name, settings)
+    types = ["selection", "join", "aggregation"]
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        client.upsert(
+            collection_name=collection_name,
+            points=models.Batch(
+                ids=list(range(start, start + len(batch))),
+                vectors=batch.tolist(),
+                payloads=[{"page_content": f"q{start + i}", "metadata": {"tables": ["Customer"], "type": types[(start + i) % 3]}} for i in range(len(batch))],
+            ),
+            wait=True,
+        )
+    wait_until_indexed(client, collection_name)
+
+
+def run_queries(client: QdrantClient, collection_name: str, queries: np.ndarray, truth: List[set], k: int, search_params: models.SearchParams):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start_time = time.perf_counter()
+        response = client.query_points(collection_name=collection_name, query=query.tolist(), limit=k, search_params=search_params, with_payload=False)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        hits += len(expected & {point.id for point in response.points})
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], hits / (len(queries) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="Qdrant server URL; omit for local in-process mode.")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 64, 128, 256])
+    parser.add_argument("--variants", nargs="+", choices=list(BUILD_VARIANTS), default=list(BUILD_VARIANTS))
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.url:
+        client = QdrantClient(url=args.url, api_key=args.api_key)
+    else:
+        # Local mode warns on every call that indexes and search_params are ignored; the docstring already says so.
+        warnings.simplefilter("ignore", UserWarning)
+        client = QdrantClient(":memory:")
+    vectors = make_vectors(args.points, args.dim, args.clusters, args.seed)
+    queries = make_vectors(args.queries, args.dim, args.clusters, args.seed + 1)
+    # Exact top-k by cosine similarity is the recall reference for every variant.
+    truth = [set(np.argsort(-(vectors @ query))[:args.k].tolist()) for query in queries]
+
+    print(f"{'variant':>12} {'hnsw_ef':>8} {'rescore':>8} {'p50_ms':>8} {'p95_ms':>8} {'recall':>8}")
+    for variant_name in args.variants:
+        collection_name = f"bench_{variant_name}"
+        build_settings = CollectionSettings(vector_size=args.dim, payload_index_keys=list(EXAMPLE_FACET_KEYS.values()), **BUILD_VARIANTS[variant_name])
+        load_collection(client, collection_name, build_settings, vectors)
+        rescore_options = [False, True] if build_settings.quantization != "none" else [False]
+        for hnsw_ef in args.ef:
+            for rescore in rescore_options:
+                query_settings = CollectionSettings(
+                    vector_size=args.dim, quantization=build_settings.quantization, search_hnsw_ef=hnsw_ef, search_rescore=rescore
+                )
+                p50, p95, recall = run_queries(client, collection_name, queries, truth, args.k, query_settings.search_params())
+                print(f"{variant_name:>12} {hnsw_ef:>8} {str(rescore):>8} {p50:>8.2f} {p95:>8.2f} {recall:>8.1%}")
+        client.delete_collection(collection_name)
+
+
+if __name__ == "__main__":
+    main()
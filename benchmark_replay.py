@@ -0,0 +1,372 @@
+"""Replays captured /process-query traffic at recorded or scaled arrival rates and reports where the service saturates.
+
+Usage: python benchmark_replay.py captures/*.jsonl [--speeds 1 2 4 8] [--rates 5 10 20 --duration 30]
+       [--url http://localhost:8000 | --workers N]
+
+Captures come from running the API with CAPTURE_ENABLED=true. Without --url the API runs on a local port against
+stand-ins: a fake LLM whose latency is sampled from the captured stage timings, Qdrant's local in-process mode
+with deterministic fake embeddings (loaded from fewshots.json), and a SQLite database shaped like
+DB_SCHEMA_EXAMPLE. It runs in-process, or with --workers N as ``serve.py --workers N`` serving the same
+stand-ins, to measure multi-worker scaling. Load is open-loop: requests go out at their scheduled times whether or not earlier ones have
+returned, and latency is measured from the scheduled time, so queueing shows up in the tail instead of being hidden.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+DEFAULT_STAGE_DELAYS_MS = {"analysis_llm": 600.0, "sql_generation": 900.0, "nl_response": 700.0}
+
+
+def load_captures(patterns: List[str]) -> List[Dict[str, Any]]:
+    entries = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries
+
+
+def recorded_schedule(entries: List[Dict[str, Any]], speed: float) -> List[Tuple[float, Dict[str, Any]]]:
+    first_ts = entries[0]["ts"]
+    return [((entry["ts"] - first_ts) / speed, entry) for entry in entries]
+
+
+def poisson_schedule(entries: List[Dict[str, Any]], rate: float, duration_seconds: float, rng: random.Random) -> List[Tuple[float, Dict[str, Any]]]:
+    # Recorded questions in recorded order, re-timed as a Poisson process at the requested rate.
+    schedule, offset, index = [], 0.0, 0
+    while True:
+        offset += rng.expovariate(rate)
+        if offset >= duration_seconds:
+            return schedule
+        schedule.append((offset, entries[index % len(entries)]))
+        index += 1
+
+
+def request_body(entry: Dict[str, Any]) -> Dict[str, Any]:
+    body = {"user_question": entry["user_question"]}
+    for key in ("datasource_id", "sql_candidates", "candidate_strategy", "page_size", "fields", "verbosity"):
+        if entry.get(key) is not None:
+            body[key] = entry[key]
+    return body
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(len(sorted_values) * fraction + 0.5) - 1))]
+
+
+async def run_step(base_url: str, schedule: List[Tuple[float, Dict[str, Any]]], timeout_seconds: float) -> Dict[str, Any]:
+    latencies, finish_times, errors, in_flight, max_in_flight = [], [], 0, 0, 0
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_seconds, limits=limits) as client:
+        start_time = time.perf_counter()
+
+        async def send(scheduled_at: float, entry: Dict[str, Any]):
+            nonlocal errors, in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            try:
+                response = await client.post("/process-query", json=request_body(entry))
+                failed = response.status_code != 200 or response.json().get("error_message") is not None
+            except (httpx.HTTPError, ValueError):
+                failed = True
+            finally:
+                in_flight -= 1
+            finished = time.perf_counter()
+            finish_times.append(finished)
+            latencies.append((finished - scheduled_at) * 1000)
+            errors += 1 if failed else 0
+
+        tasks = []
+        for offset, entry in schedule:
+            scheduled_at = start_time + offset
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(scheduled_at, entry)))
+        await asyncio.gather(*tasks)
+
+    # Both rates are measured between the first and last event, so a short step is not skewed by one request's latency.
+    arrival_span = schedule[-1][0] - schedule[0][0]
+    completion_span = max(finish_times) - min(finish_times)
+    latencies.sort()
+    return {
+        "requests": len(schedule),
+        "offered_rps": (len(schedule) - 1) / arrival_span if arrival_span > 0 else float("inf"),
+        "throughput_rps": (len(schedule) - 1) / completion_span if completion_span > 0 else float("inf"),
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "error_rate": errors / len(schedule) if schedule else 0.0,
+        "max_in_flight": max_in_flight,
+    }
+
+
+def is_saturated(step: Dict[str, Any], slo_p99_ms: float, max_error_rate: float) -> bool:
+    return (
+        step["throughput_rps"] < 0.9 * step["offered_rps"]
+        or step["p99_ms"] > slo_p99_ms
+        or step["error_rate"] > max_error_rate
+    )
+
+
+# --- Local stand-ins (used without --url) ---
+def recorded_stage_delays(entries: List[Dict[str, Any]]) -> Dict[str, List[float]]:
+    # Per-tier stages (sql_generation:fast/strong) are pooled; the fake LLM cannot tell tiers apart.
+    delays: Dict[str, List[float]] = {}
+    for entry in entries:
+        for stage in entry.get("stages") or []:
+            name = stage["name"].split(":", 1)[0]
+            if name in DEFAULT_STAGE_DELAYS_MS:
+                delays.setdefault(name, []).append(stage["wall_ms"])
+    return delays
+
+
+def create_fake_llm_class():
+    from langchain_core.language_models.llms import LLM
+
+    class ReplayFakeLLM(LLM):
+        """Answers the analysis, SQL and answer prompts for DB_SCHEMA_EXAMPLE, sleeping like the recorded stages."""
+
+        tables: List[str]
+        stage_delays_ms: Dict[str, List[float]] = {}
+        latency_scale: float = 1.0
+
+        @property
+        def _llm_type(self) -> str:
+            return "replay-fake"
+
+        def _sleep_like(self, stage: str):
+            recorded = self.stage_delays_ms.get(stage)
+            delay_ms = random.choice(recorded) if recorded else random.expovariate(1.0 / DEFAULT_STAGE_DELAYS_MS[stage])
+            time.sleep(delay_ms * self.latency_scale / 1000.0)
+
+        def _mentioned_tables(self, text: str) -> List[str]:
+            lowered = text.lower()
+            return [table for table in self.tables if table.lower() in lowered] or ["Customer"]
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+            if prompt.rstrip().endswith("Output JSON:"):
+                self._sleep_like("analysis_llm")
+                question = prompt.rsplit("User Question:", 1)[-1].rsplit("Output JSON:", 1)[0].strip()
+                tables = self._mentioned_tables(question)
+                return json.dumps({
+                    "relevant": "yes",
+                    "query": question,
+                    "relevant_tables": tables,
+                    "query_types": ["join"] if len(tables) > 1 else ["filter"],
+                })
+            if prompt.rstrip().endswith("SQL Query:"):
+                self._sleep_like("sql_generation")
+                match = re.search(r"User Question:(.*)\nSQL Query:\s*$", prompt, re.S)
+                return f"SELECT * FROM {self._mentioned_tables(match.group(1) if match else '')[0]} LIMIT 20"
+            self._sleep_like("nl_response")
+            return "Here is the answer based on the returned rows."
+
+    return ReplayFakeLLM
+
+
+def create_standin_db(path: str, tables: Dict[str, List[str]], rows_per_table: int):
+    connection = sqlite3.connect(path)
+    for table, columns in tables.items():
+        connection.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+        connection.executemany(
+            f"INSERT INTO {table} VALUES ({', '.join('?' for _ in columns)})",
+            [[i if column.endswith("Id") else f"{column}{i % 25}" for column in columns] for i in range(1, rows_per_table + 1)],
+        )
+    connection.commit()
+    connection.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_standin_environment(entries: List[Dict[str, Any]], work_dir: str, rows_per_table: int, latency_scale: float):
+    # Everything create_standin_app() needs, passed through the environment so serve.py's workers see it too.
+    from backend_logic import DB_SCHEMA_EXAMPLE, parse_schema_tables_logic
+
+    tables = parse_schema_tables_logic(DB_SCHEMA_EXAMPLE)
+    db_path = os.path.join(work_dir, "replay.db")
+    create_standin_db(db_path, tables, rows_per_table)
+    standin_path = os.path.join(work_dir, "standin.json")
+    with open(standin_path, "w", encoding="utf-8") as f:
+        json.dump({"tables": list(tables), "stage_delays_ms": recorded_stage_delays(entries), "latency_scale": latency_scale}, f)
+    # config.py refuses to load without Azure settings; the clients it builds are replaced and never called.
+    for name in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_API_VERSION",
+                 "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME", "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"):
+        os.environ.setdefault(name, "https://replay.invalid" if name == "AZURE_OPENAI_ENDPOINT" else "replay")
+    os.environ.update(
+        REPLAY_STANDIN_PATH=standin_path,
+        qdrant_host="",
+        DB_CONNECTION_STRING=f"sqlite:///{db_path}",
+        DATASOURCES_CONFIG_PATH="",
+        VALUE_INDEX_PATH=os.path.join(work_dir, "value_index.json"),
+        JOB_STORE_PATH=os.path.join(work_dir, "jobs.db"),
+        RESULT_SPOOL_DIR=os.path.join(work_dir, "result_spool"),
+        PROFILING_DIR=os.path.join(work_dir, "profiles"),
+        CAPTURE_ENABLED="false",
+    )
+
+
+def create_standin_app():
+    """App factory for ``serve.py --app benchmark_replay:create_standin_app --factory``: backend.app on stand-ins."""
+    from langchain_community.vectorstores import Qdrant
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from qdrant_client import QdrantClient
+
+    import backend
+    from backend_logic import add_json_examples_to_vector_store_logic
+    from qdrant_setup import CollectionSettings, ensure_example_collection
+
+    with open(os.environ["REPLAY_STANDIN_PATH"], "r", encoding="utf-8") as f:
+        standin = json.load(f)
+    fake_llm = create_fake_llm_class()(
+        tables=standin["tables"], stage_delays_ms=standin["stage_delays_ms"], latency_scale=standin["latency_scale"]
+    )
+    backend.llm = backend.natural_language_llm = fake_llm
+    backend.sql_generation_llms.update(fast=fake_llm, strong=fake_llm)
+    qdrant_client_instance = QdrantClient(":memory:")
+    ensure_example_collection(qdrant_client_instance, "replay_examples", CollectionSettings(vector_size=256))
+    vector_store = Qdrant(client=qdrant_client_instance, collection_name="replay_examples", embeddings=DeterministicFakeEmbedding(size=256))
+    examples_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fewshots.json")
+    if os.path.exists(examples_path):
+        add_json_examples_to_vector_store_logic(examples_path, vector_store)
+    backend.default_datasource.vector_store = vector_store
+    return backend.app
+
+
+def start_local_api() -> str:
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_standin_app(), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="replay-api", daemon=True).start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Local API did not start within 30s.")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def start_local_workers(workers: int) -> Tuple[str, subprocess.Popen]:
+    port = free_port()
+    serve_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+    process = subprocess.Popen(
+        [sys.executable, serve_path, "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port),
+         "--app", "benchmark_replay:create_standin_app", "--factory"],
+        cwd=os.path.dirname(serve_path),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with code {process.returncode}.")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=2).status_code == 200:
+                break
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError("serve.py did not start within 120s.")
+        time.sleep(0.2)
+    # /health answers as soon as the first worker is up; give the others time to finish importing.
+    time.sleep(2.0 * workers)
+    return base_url, process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("captures", nargs="+", help="Capture JSONL files or glob patterns (CAPTURE_DIR/*.jsonl).")
+    parser.add_argument("--url", default=None, help="Running API to drive; omit to run it locally against stand-ins.")
+    parser.add_argument("--workers", type=int, default=None, help="Run the stand-in API as serve.py with this many worker processes.")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1.0, 2.0, 4.0, 8.0], help="Replay the recorded arrivals this many times faster.")
+    parser.add_argument("--rates", type=float, nargs="+", default=None, help="Instead of --speeds: Poisson arrivals at these requests/s.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per --rates step.")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N captured requests.")
+    parser.add_argument("--include-failed", action="store_true", help="Also replay requests that failed when captured (they count as errors).")
+    parser.add_argument("--slo-p99-ms", type=float, default=10000.0, help="A step whose p99 exceeds this counts as saturated.")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Scale the fake LLM's recorded latencies (local mode).")
+    parser.add_argument("--rows-per-table", type=int, default=500, help="Rows per stand-in SQLite table (local mode).")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    entries = [
+        entry for entry in load_captures(args.captures)
+        if entry.get("user_question") and (args.include_failed or entry.get("status") == 200)
+    ][:args.limit]
+    if not entries:
+        sys.exit("No captured requests found.")
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        server_process = None
+        if args.url:
+            base_url = args.url
+        else:
+            prepare_standin_environment(entries, work_dir, args.rows_per_table, args.latency_scale)
+            if args.workers:
+                base_url, server_process = start_local_workers(args.workers)
+            else:
+                base_url = start_local_api()
+        try:
+            run_steps(args, entries, base_url, rng)
+        finally:
+            if server_process is not None:
+                server_process.terminate()
+                server_process.wait(timeout=60)
+
+
+def run_steps(args, entries: List[Dict[str, Any]], base_url: str, rng: random.Random):
+    if args.rates:
+        steps = [(f"{rate:g}/s", poisson_schedule(entries, rate, args.duration, rng)) for rate in args.rates]
+    else:
+        steps = [(f"x{speed:g}", recorded_schedule(entries, speed)) for speed in args.speeds]
+
+    print(f"Replaying {len(entries)} captured requests against {base_url}")
+    print(f"{'step':>8} {'requests':>8} {'offered':>8} {'achieved':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'errors':>7} {'in_flight':>9}")
+    saturation = None
+    for step_name, schedule in steps:
+        if not schedule:
+            continue
+        step = asyncio.run(run_step(base_url, schedule, args.timeout))
+        print(
+            f"{step_name:>8} {step['requests']:>8} {step['offered_rps']:>8.2f} {step['throughput_rps']:>8.2f} "
+            f"{step['p50_ms']:>8.0f} {step['p95_ms']:>8.0f} {step['p99_ms']:>8.0f} {step['error_rate']:>7.1%} {step['max_in_flight']:>9}"
+        )
+        if saturation is None and is_saturated(step, args.slo_p99_ms, args.max_error_rate):
+            saturation = step
+    if saturation is None:
+        print("Not saturated at the highest step; try higher --speeds or --rates.")
+    else:
+        print(f"Saturation point: ~{saturation['offered_rps']:.2f} req/s offered ({saturation['throughput_rps']:.2f} req/s achieved).")
+
+
+if __name__ == "__main__":
+    main()
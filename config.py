@@ -1,10 +1,12 @@
 import os
+import json
 from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from langchain_community.vectorstores import Qdrant
 import qdrant_client
 from sqlalchemy import create_engine
 from langchain_community.utilities import SQLDatabase
+from qdrant_setup import CollectionSettings
 
 # --- Environment Setup & Global Variables ---
 load_dotenv()
@@ -50,17 +52,128 @@ sql_generation_llm = AzureChatOpenAI(
     temperature=0,
     streaming=False,
 )
+# Small/fast deployment for simple single-table questions; join/subquery questions use sql_generation_llm.
+AZURE_OPENAI_FAST_SQL_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_FAST_SQL_DEPLOYMENT_NAME", AZURE_OPENAI_CHAT_DEPLOYMENT_NAME)
+fast_sql_generation_llm = AzureChatOpenAI(
+    azure_deployment=AZURE_OPENAI_FAST_SQL_DEPLOYMENT_NAME,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    api_key=AZURE_OPENAI_API_KEY,
+    openai_api_version=AZURE_OPENAI_API_VERSION,
+    temperature=0,
+    streaming=False,
+)
 natural_language_llm = llm
 
+# --- SQL Model Routing ---
+# Questions whose query_types are all in this list and that touch at most SQL_ROUTING_FAST_MAX_TABLES tables go to
+# the fast deployment; failures (invalid SQL or execution errors) escalate to the strong one when enabled.
+SQL_ROUTING_FAST_QUERY_TYPES = [t.strip() for t in os.getenv("SQL_ROUTING_FAST_QUERY_TYPES", "selection,filter,order,limit").split(",") if t.strip()]
+SQL_ROUTING_FAST_MAX_TABLES = int(os.getenv("SQL_ROUTING_FAST_MAX_TABLES", "1"))
+SQL_ROUTING_ESCALATE = os.getenv("SQL_ROUTING_ESCALATE", "true").lower() == "true"
+
+# --- Example Collection Setup ---
+# The example collection is created/migrated with these settings at app startup or by `python qdrant_setup.py`;
+# with QDRANT_MANAGE_COLLECTION=false it is only validated against them. Importing this module never touches it.
+# QDRANT_VECTOR_SIZE=0 detects the size from the embedding deployment when the collection has to be created.
+QDRANT_MANAGE_COLLECTION = os.getenv("QDRANT_MANAGE_COLLECTION", "true").lower() == "true"
+example_collection_settings = CollectionSettings(
+    vector_size=int(os.getenv("QDRANT_VECTOR_SIZE", "0")),
+    distance=os.getenv("QDRANT_DISTANCE", "Cosine"),
+    hnsw_m=int(os.getenv("QDRANT_HNSW_M", "16")),
+    hnsw_ef_construct=int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100")),
+    quantization=os.getenv("QDRANT_QUANTIZATION", "none"),  # "none", "scalar" or "binary"
+    quantization_always_ram=os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "true").lower() == "true",
+    on_disk=os.getenv("QDRANT_VECTORS_ON_DISK", "false").lower() == "true",
+    search_hnsw_ef=int(os.getenv("QDRANT_SEARCH_HNSW_EF", "128")),
+    search_rescore=os.getenv("QDRANT_SEARCH_RESCORE", "true").lower() == "true",
+    search_oversampling=float(os.getenv("QDRANT_SEARCH_OVERSAMPLING", "2.0")),
+)
+
 qdrant_client_instance = None
 vector_store = None
 if QDRANT_HOST and QDRANT_API_KEY and QDRANT_COLLECTION_NAME != "your_default_collection_name":
     try:
         qdrant_client_instance = qdrant_client.QdrantClient(url=QDRANT_HOST, api_key=QDRANT_API_KEY)
         vector_store = Qdrant(client=qdrant_client_instance, collection_name=QDRANT_COLLECTION_NAME, embeddings=embedding_model)
-    except Exception:
+    except Exception as e:
+        print(f"Warning: Qdrant example store is not available: {e}")
         vector_store = None
 
+# --- Prompt Budget ---
+# Upper bound (in tokens) for the assembled text-to-SQL prompt; 0 disables trimming.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "cl100k_base")
+
+# --- Concurrency Limits ---
+# Upper bounds per process on simultaneous chat LLM calls (analysis, SQL generation including candidate fan-out,
+# answers) and SQL executions across all requests. Embedding calls for example retrieval are not counted.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "8"))
+
+# --- Multi-Candidate SQL Generation ---
+# Opt-in per request via ProcessQueryRequest.sql_candidates; values are capped at SQL_CANDIDATES_MAX.
+SQL_CANDIDATES_MAX = int(os.getenv("SQL_CANDIDATES_MAX", "5"))
+SQL_CANDIDATES_TEMPERATURE = float(os.getenv("SQL_CANDIDATES_TEMPERATURE", "0.7"))
+SQL_CANDIDATES_STRATEGY = os.getenv("SQL_CANDIDATES_STRATEGY", "first_valid")  # "first_valid" or "majority"
+SQL_CANDIDATES_LATENCY_BUDGET_SECONDS = float(os.getenv("SQL_CANDIDATES_LATENCY_BUDGET_SECONDS", "30"))
+
+# --- Paged Query Results ---
+# Results stream through server-side cursors; the first page is returned inline and the rest is spooled to disk.
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "50"))
+RESULT_SPOOL_DIR = os.getenv("RESULT_SPOOL_DIR", "result_spool")
+RESULT_SPOOL_MAX_HANDLES = int(os.getenv("RESULT_SPOOL_MAX_HANDLES", "64"))
+RESULT_SPOOL_IDLE_TTL_SECONDS = float(os.getenv("RESULT_SPOOL_IDLE_TTL_SECONDS", "600"))
+# Rows spooled per result before it is marked truncated; the spooler holds its DB connection until then.
+RESULT_SPOOL_MAX_ROWS = int(os.getenv("RESULT_SPOOL_MAX_ROWS", "100000"))
+# Each background spooler holds a pooled DB connection outside DB_MAX_CONCURRENCY, so keep
+# DB_MAX_CONCURRENCY + RESULT_SPOOL_MAX_ACTIVE within the engine's pool (SQLAlchemy default: 5 + 10 overflow).
+# With every spooler busy, results are fetched inline up to RESULT_SPOOL_INLINE_MAX_ROWS and marked truncated.
+RESULT_SPOOL_MAX_ACTIVE = int(os.getenv("RESULT_SPOOL_MAX_ACTIVE", "4"))
+RESULT_SPOOL_INLINE_MAX_ROWS = int(os.getenv("RESULT_SPOOL_INLINE_MAX_ROWS", "1000"))
+
+# --- Pipeline Profiling ---
+# Requests sent with "X-Profile: 1" are always profiled (unless PROFILING_ALLOW_HEADER=false); with PROFILING_ENABLED,
+# a PROFILING_SAMPLE_RATE fraction of other requests is profiled too. Both can be changed at runtime via /admin/profiling.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+PROFILING_ALLOW_HEADER = os.getenv("PROFILING_ALLOW_HEADER", "true").lower() == "true"
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "200"))
+# Runtime changes made via /admin/profiling persist in PROFILING_DIR; by default a restart resets them to the values above.
+PROFILING_RESET_ON_STARTUP = os.getenv("PROFILING_RESET_ON_STARTUP", "true").lower() == "true"
+
+# --- Async Query Jobs ---
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+# serve.py sets this to false in worker processes; the supervisor recovers interrupted jobs once before starting them.
+JOB_RECOVER_ON_STARTUP = os.getenv("JOB_RECOVER_ON_STARTUP", "true").lower() == "true"
+
+# --- Example SQL Reuse ---
+# When the top retrieved example scores at least this similarity and uses the same tables as the analysis,
+# its stored SQL is executed directly instead of calling the SQL generation LLM. 0 disables reuse.
+EXAMPLE_REUSE_SCORE_THRESHOLD = float(os.getenv("EXAMPLE_REUSE_SCORE_THRESHOLD", "0.97"))
+
+# --- Column-Value Index ---
+# Distinct values of low-cardinality text columns, used to ground literals like 'Brazil' in the SQL prompt.
+VALUE_INDEX_PATH = os.getenv("VALUE_INDEX_PATH", "value_index.json")
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", "200"))
+# Columns with more distinct values per row than this are near-unique (names, emails) and are not indexed. Tables of
+# at most VALUE_INDEX_RATIO_MIN_ROWS rows are lookup tables (genres, media types) and only get the VALUE_INDEX_MAX_DISTINCT cap.
+VALUE_INDEX_MAX_DISTINCT_RATIO = float(os.getenv("VALUE_INDEX_MAX_DISTINCT_RATIO", "0.5"))
+VALUE_INDEX_RATIO_MIN_ROWS = int(os.getenv("VALUE_INDEX_RATIO_MIN_ROWS", "50"))
+# Comma-separated "Table.Column" lists: INCLUDE skips the ratio check (small lookup tables), EXCLUDE is never indexed.
+VALUE_INDEX_INCLUDE_COLUMNS = [c for c in os.getenv("VALUE_INDEX_INCLUDE_COLUMNS", "").split(",") if c.strip()]
+VALUE_INDEX_EXCLUDE_COLUMNS = [c for c in os.getenv("VALUE_INDEX_EXCLUDE_COLUMNS", "").split(",") if c.strip()]
+value_index_options = dict(
+    max_distinct_values=VALUE_INDEX_MAX_DISTINCT,
+    max_distinct_ratio=VALUE_INDEX_MAX_DISTINCT_RATIO,
+    ratio_min_rows=VALUE_INDEX_RATIO_MIN_ROWS,
+    include_columns=VALUE_INDEX_INCLUDE_COLUMNS,
+    exclude_columns=VALUE_INDEX_EXCLUDE_COLUMNS
+)
+
 DB_CONNECTION_STRING = os.getenv("DB_CONNECTION_STRING")
 db = None
 if DB_CONNECTION_STRING:
@@ -69,3 +182,42 @@ if DB_CONNECTION_STRING:
         db = SQLDatabase(engine=sql_alchemy_engine)
     except Exception:
         db = None
+
+# --- Multi-Tenant Datasources ---
+# JSON file mapping datasource IDs to {"db_connection_string", "qdrant_collection_name", optional "schema",
+# "schema_description", "foreign_keys", "value_index_path", "engine_options"}. Requests without a datasource_id
+# use the default datasource configured above.
+DATASOURCES_CONFIG_PATH = os.getenv("DATASOURCES_CONFIG_PATH")
+DATASOURCE_CACHE_SIZE = int(os.getenv("DATASOURCE_CACHE_SIZE", "16"))
+DATASOURCE_IDLE_TTL_SECONDS = float(os.getenv("DATASOURCE_IDLE_TTL_SECONDS", "900"))
+
+DATASOURCES = {}
+if DATASOURCES_CONFIG_PATH:
+    try:
+        with open(DATASOURCES_CONFIG_PATH, "r", encoding="utf-8") as f:
+            DATASOURCES = json.load(f)
+    except Exception as e:
+        print(f"Warning: could not load datasources config from {DATASOURCES_CONFIG_PATH}: {e}")
+        DATASOURCES = {}
+
+# --- Request Capture ---
+# Appends /process-query arrivals (question, timestamp, status, latency, stage timings) to JSONL for
+# benchmark_replay.py. Off by default: captured questions are user data.
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "captures")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "10000"))
+CAPTURE_MAX_FILE_MB = float(os.getenv("CAPTURE_MAX_FILE_MB", "100"))
+
+# --- Response Shaping & Compression ---
+# Default /process-query response preset ("minimal", "standard" or "full"); requests override it with fields/verbosity.
+RESPONSE_DEFAULT_VERBOSITY = os.getenv("RESPONSE_DEFAULT_VERBOSITY", "full")
+RESPONSE_COMPRESSION_ENABLED = os.getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_GZIP_LEVEL", "6"))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv("RESPONSE_COMPRESSION_BROTLI_QUALITY", "4"))
+
+# --- Multi-Worker Serving (serve.py) ---
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import create_engine
+from langchain_community.utilities import SQLDatabase
+from langchain_community.vectorstores import Qdrant
+
+from backend_logic import reflect_db_schema_logic
+from qdrant_setup import CollectionSettings, prepare_example_collection
+from singleflight import SingleFlight
+from value_index import ColumnValueIndex, MappedColumnValueIndex, load_shared_value_index
+
+DEFAULT_DATASOURCE_ID = "default"
+
+
+class DatasourceNotFoundError(KeyError):
+    pass
+
+
+class Datasource:
+    """Everything the pipeline needs to answer questions against one tenant database."""
+
+    def __init__(
+        self,
+        datasource_id: str,
+        db=None,
+        vector_store=None,
+        collection_name: Optional[str] = None,
+        db_schema: str = "",
+        db_schema_description: str = "",
+        foreign_keys: Optional[List[Tuple[str, str, str, str]]] = None,
+        column_value_index: Optional[Union[ColumnValueIndex, MappedColumnValueIndex]] = None,
+        value_index_path: Optional[str] = None,
+        engine=None,
+    ):
+        self.datasource_id = datasource_id
+        self.db = db
+        self.vector_store = vector_store
+        self.collection_name = collection_name
+        self.db_schema = db_schema
+        self.db_schema_description = db_schema_description or db_schema
+        self.foreign_keys = foreign_keys
+        self.column_value_index = column_value_index
+        self.value_index_path = value_index_path
+        self.engine = engine
+        self.schema_version = hashlib.sha1(
+            (self.db_schema + self.db_schema_description + repr(foreign_keys)).encode("utf-8")
+        ).hexdigest()[:12]
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.dispose()
+
+
+def create_datasource_from_config(
+    datasource_id: str,
+    datasource_config: Dict[str, Any],
+    qdrant_client_instance=None,
+    embedding_model=None,
+    collection_settings: Optional[CollectionSettings] = None,
+    manage_collection: bool = True,
+) -> Datasource:
+    connection_string = datasource_config.get("db_connection_string")
+    if not connection_string:
+        raise ValueError(f"Datasource '{datasource_id}' has no db_connection_string configured.")
+    engine = create_engine(
+        connection_string,
+        pool_pre_ping=True,
+        **datasource_config.get("engine_options", {}),
+    )
+    db = SQLDatabase(engine=engine)
+
+    db_schema = datasource_config.get("schema")
+    foreign_keys = [tuple(fk) for fk in datasource_config.get("foreign_keys", [])] or None
+    if not db_schema:
+        db_schema, reflected_foreign_keys = reflect_db_schema_logic(engine)
+        foreign_keys = foreign_keys or reflected_foreign_keys
+
+    vector_store = None
+    collection_name = datasource_config.get("qdrant_collection_name")
+    if collection_name and qdrant_client_instance is not None and embedding_model is not None:
+        if collection_settings is not None:
+            prepare_example_collection(qdrant_client_instance, collection_name, collection_settings, embedding_model, manage=manage_collection)
+        vector_store = Qdrant(client=qdrant_client_instance, collection_name=collection_name, embeddings=embedding_model)
+
+    value_index_path = datasource_config.get("value_index_path")
+    column_value_index = None
+    if value_index_path and os.path.exists(value_index_path):
+        try:
+            column_value_index = load_shared_value_index(value_index_path)
+        except Exception as e:
+            print(f"Warning: could not load column-value index for datasource '{datasource_id}': {e}")
+
+    return Datasource(
+        datasource_id,
+        db=db,
+        vector_store=vector_store,
+        collection_name=collection_name,
+        db_schema=db_schema,
+        db_schema_description=datasource_config.get("schema_description", db_schema),
+        foreign_keys=foreign_keys,
+        column_value_index=column_value_index,
+        value_index_path=value_index_path,
+        engine=engine,
+    )
+
+
+class DatasourceRegistry:
+    """LRU of lazily created tenant datasources; idle or least-recently-used ones are closed and dropped.
+
+    Pinned datasources (the default one built from config.py) are never evicted.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Datasource],
+        known_ids: Callable[[], List[str]],
+        max_size: int = 16,
+        idle_ttl_seconds: float = 900.0,
+    ):
+        self._factory = factory
+        self._known_ids = known_ids
+        self.max_size = max_size
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._lock = threading.Lock()
+        self._pinned: Dict[str, Datasource] = {}
+        self._cache: "OrderedDict[str, Datasource]" = OrderedDict()
+        self._creation_flight = SingleFlight()
+
+    def pin(self, datasource: Datasource):
+        self._pinned[datasource.datasource_id] = datasource
+
+    def get(self, datasource_id: Optional[str] = None) -> Datasource:
+        datasource_id = datasource_id or DEFAULT_DATASOURCE_ID
+        if datasource_id in self._pinned:
+            datasource = self._pinned[datasource_id]
+            datasource.last_used = time.monotonic()
+            return datasource
+
+        self.evict_idle()
+        with self._lock:
+            datasource = self._cache.get(datasource_id)
+            if datasource is not None:
+                self._cache.move_to_end(datasource_id)
+                datasource.last_used = time.monotonic()
+                return datasource
+
+        if datasource_id not in self._known_ids():
+            raise DatasourceNotFoundError(datasource_id)
+        # Creating a datasource (engine + schema reflection) is slow; concurrent first requests share one creation.
+        datasource = self._creation_flight.do(datasource_id, self._create_and_cache, datasource_id)
+        datasource.last_used = time.monotonic()
+        return datasource
+
+    def _create_and_cache(self, datasource_id: str) -> Datasource:
+        with self._lock:
+            if datasource_id in self._cache:
+                return self._cache[datasource_id]
+        datasource = self._factory(datasource_id)
+        evicted = []
+        with self._lock:
+            self._cache[datasource_id] = datasource
+            while len(self._cache) > self.max_size:
+                _, oldest = self._cache.popitem(last=False)
+                evicted.append(oldest)
+        for old_datasource in evicted:
+            old_datasource.close()
+        return datasource
+
+    def evict_idle(self) -> int:
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for datasource_id, datasource in list(self._cache.items()):
+                if now - datasource.last_used > self.idle_ttl_seconds:
+                    evicted.append(self._cache.pop(datasource_id))
+        for datasource in evicted:
+            datasource.close()
+        return len(evicted)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            cached_ids = list(self._cache.keys())
+        return {
+            "pinned": list(self._pinned.keys()),
+            "cached": cached_ids,
+            "configured": self._known_ids(),
+            "max_size": self.max_size,
+        }
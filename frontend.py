@@ -2,16 +2,44 @@ import streamlit as st
 import requests
 import json
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- Configuration ---
 FASTAPI_BASE_URL = "http://localhost:8000"
 ADMIN_PASSWORD = "admin"
+CONNECT_TIMEOUT_SECONDS = 3.05
+READ_TIMEOUT_SECONDS = 30
+QUERY_READ_TIMEOUT_SECONDS = 180  # LLM calls plus SQL execution
+EXAMPLES_CACHE_TTL_SECONDS = 300
+HEALTH_CACHE_TTL_SECONDS = 15
 
 # --- Helper Functions to Interact with FastAPI ---
 
-def process_user_query(user_question: str):
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    # One pooled keep-alive session per server process instead of a new TCP/TLS connection per call.
+    session = requests.Session()
+    retries = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def invalidate_example_caches():
+    fetch_examples_page.clear()
+    fetch_example_facets.clear()
+
+
+def process_user_query(user_question: str, page_size: int = None):
+    payload = {"user_question": user_question}
+    if page_size:
+        payload["page_size"] = page_size
     try:
-        response = requests.post(f"{FASTAPI_BASE_URL}/process-query", json={"user_question": user_question})
+        response = get_http_session().post(
+            f"{FASTAPI_BASE_URL}/process-query", json=payload, timeout=(CONNECT_TIMEOUT_SECONDS, QUERY_READ_TIMEOUT_SECONDS)
+        )
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -22,10 +50,25 @@ def process_user_query(user_question: str):
         return {"error_message": "Invalid JSON response."}
 
 
+def get_result_page(handle: str, page: int):
+    try:
+        response = get_http_session().get(
+            f"{FASTAPI_BASE_URL}/query-results/{handle}", params={"page": page}, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+        )
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching result page {page}: {e}")
+        return None
+
+
 def add_single_example(example_data: dict):
     try:
-        response = requests.post(f"{FASTAPI_BASE_URL}/add-single-example", json=example_data)
+        response = get_http_session().post(
+            f"{FASTAPI_BASE_URL}/add-single-example", json=example_data, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+        )
         response.raise_for_status()
+        invalidate_example_caches()
         return response.json()
     except requests.exceptions.RequestException as e:
         st.error(f"Error adding example: {e}")
@@ -39,9 +82,12 @@ def add_examples_from_file(uploaded_file): # Renamed function for clarity intern
     if uploaded_file is not None:
         try:
             files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-            # CORRECTED ENDPOINT URL HERE
-            response = requests.post(f"{FASTAPI_BASE_URL}/add-examples", files=files)
+            # Embedding a large file can take a while; allow the same read timeout as a query.
+            response = get_http_session().post(
+                f"{FASTAPI_BASE_URL}/add-examples", files=files, timeout=(CONNECT_TIMEOUT_SECONDS, QUERY_READ_TIMEOUT_SECONDS)
+            )
             response.raise_for_status()
+            invalidate_example_caches()
             return response.json()
         except requests.exceptions.RequestException as e:
             st.error(f"Error uploading file: {e}")
@@ -51,14 +97,23 @@ def add_examples_from_file(uploaded_file): # Renamed function for clarity intern
             return {"message": "Failed to upload due to invalid JSON response."}
     return None
 
-def get_all_examples(limit: int = 10, offset: str = None, with_payload: bool = True, with_vectors: bool = False):
+
+@st.cache_data(ttl=EXAMPLES_CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_examples_page(limit: int, offset: str = None, with_payload: bool = True, with_vectors: bool = False):
+    # Raises on failure so errors are never cached; cleared by invalidate_example_caches() after add/delete.
     params = {"limit": limit, "with_payload": with_payload, "with_vectors": with_vectors}
     if offset:
         params["offset"] = offset
+    response = get_http_session().get(
+        f"{FASTAPI_BASE_URL}/get-all-examples", params=params, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def get_all_examples(limit: int = 10, offset: str = None, with_payload: bool = True, with_vectors: bool = False):
     try:
-        response = requests.get(f"{FASTAPI_BASE_URL}/get-all-examples", params=params)
-        response.raise_for_status()
-        return response.json()
+        return fetch_examples_page(limit, offset, with_payload, with_vectors)
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching examples: {e}")
         return None
@@ -67,10 +122,48 @@ def get_all_examples(limit: int = 10, offset: str = None, with_payload: bool = T
         return {"points": [], "count": 0, "next_offset": None}
 
 
+@st.cache_data(ttl=EXAMPLES_CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_example_facets(key: str):
+    response = get_http_session().get(
+        f"{FASTAPI_BASE_URL}/examples/facets", params={"key": key}, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def stream_examples_export(batch_rows: int = 500):
+    """Yields lists of example rows as the NDJSON export arrives, so large collections render incrementally."""
+    with get_http_session().get(
+        f"{FASTAPI_BASE_URL}/examples/export", stream=True, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+    ) as response:
+        response.raise_for_status()
+        rows = []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            point = json.loads(line)
+            rows.append(example_point_to_row(point))
+            if len(rows) >= batch_rows:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+
+def example_point_to_row(point: dict) -> dict:
+    row = {"qdrant_id": point.get("id")}
+    if point.get("payload"):
+        row.update(point["payload"])
+    return row
+
+
 def delete_example_by_id(point_id: str):
     try:
-        response = requests.delete(f"{FASTAPI_BASE_URL}/delete-example/{point_id}")
+        response = get_http_session().delete(
+            f"{FASTAPI_BASE_URL}/delete-example/{point_id}", timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+        )
         response.raise_for_status()
+        invalidate_example_caches()
         return response.json()
     except requests.exceptions.RequestException as e:
         st.error(f"Error deleting example {point_id}: {e}")
@@ -79,15 +172,58 @@ def delete_example_by_id(point_id: str):
         st.error("Error decoding JSON response from backend.")
         return {"message": f"Failed to delete example {point_id} due to invalid JSON response."}
 
-def get_health_check():
+
+def bulk_delete_examples(point_ids: list):
     try:
-        response = requests.get(f"{FASTAPI_BASE_URL}/health")
+        response = get_http_session().post(
+            f"{FASTAPI_BASE_URL}/examples/bulk-delete", json={"ids": point_ids}, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+        )
         response.raise_for_status()
+        invalidate_example_caches()
         return response.json()
-    except:
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error deleting examples: {e}")
+        return None
+
+
+@st.cache_data(ttl=HEALTH_CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_health_check():
+    # Raises on failure: st.cache_data does not cache exceptions, so an outage is not remembered for the TTL.
+    response = get_http_session().get(f"{FASTAPI_BASE_URL}/health", timeout=(CONNECT_TIMEOUT_SECONDS, 5))
+    response.raise_for_status()
+    return response.json()
+
+
+def get_health_check():
+    try:
+        return fetch_health_check()
+    except Exception:
         return {"status": "error", "detail": "Backend not reachable"}
 
 
+def render_query_result_table(result: dict, key_prefix: str):
+    """Shows the inline first page of rows and lets the user load further pages from the result spool."""
+    columns = result.get("result_columns")
+    rows = result.get("result_rows")
+    if not columns or rows is None:
+        return
+    handle = result.get("result_handle")
+    pages_key = f"{key_prefix}_result_pages"
+    if st.session_state.get(f"{pages_key}_handle") != handle:
+        st.session_state[f"{pages_key}_handle"] = handle
+        st.session_state[pages_key] = {"rows": list(rows), "next_page": 1, "has_more": bool(result.get("result_has_more"))}
+    pages = st.session_state[pages_key]
+    st.dataframe(pd.DataFrame(pages["rows"], columns=columns), use_container_width=True)
+    if pages["has_more"] and handle:
+        if st.button(f"Load more rows ({len(pages['rows'])} shown)", key=f"{key_prefix}_load_more"):
+            page_data = get_result_page(handle, pages["next_page"])
+            if page_data:
+                pages["rows"].extend(page_data["rows"])
+                pages["next_page"] += 1
+                pages["has_more"] = page_data["has_more"]
+                st.rerun()
+
+
 # --- Streamlit UI ---
 
 if "logged_in" not in st.session_state:
@@ -102,6 +238,12 @@ if "current_tables" not in st.session_state:
     st.session_state.current_tables = []
 if "current_query_type" not in st.session_state:
     st.session_state.current_query_type = ""
+if "last_user_result" not in st.session_state:
+    st.session_state.last_user_result = None
+if "last_admin_result" not in st.session_state:
+    st.session_state.last_admin_result = None
+if "examples_page_offsets" not in st.session_state:
+    st.session_state.examples_page_offsets = [None]  # offsets of the pages visited so far, for Previous/Next
 
 
 st.set_page_config(layout="wide", page_title="NL to SQL Query Engine")
@@ -130,6 +272,8 @@ else:
         st.session_state.current_sql_query = ""
         st.session_state.current_tables = []
         st.session_state.current_query_type = ""
+        st.session_state.last_user_result = None
+        st.session_state.last_admin_result = None
         st.rerun()
 
     if st.session_state.logged_in:
@@ -139,18 +283,22 @@ else:
             if st.button("Get Answer", key="user_get_answer"):
                 if user_question:
                     with st.spinner("Processing..."):
-                        result = process_user_query(user_question)
-                    if result:
-                        if result.get("error_message"):
-                            st.error(f"Error: {result['error_message']}")
-                        elif result.get("nl_response"):
-                            st.success("Your Answer:")
-                            st.markdown(result["nl_response"])
-                        else:
-                            st.warning("No answer received or unfamiliar response.")
+                        st.session_state.last_user_result = process_user_query(user_question)
                 else:
                     st.warning("Please enter a question.")
 
+            # Kept in session state so reruns (e.g. "Load more rows") redraw the answer without re-querying the backend.
+            result = st.session_state.last_user_result
+            if result:
+                if result.get("error_message"):
+                    st.error(f"Error: {result['error_message']}")
+                elif result.get("nl_response"):
+                    st.success("Your Answer:")
+                    st.markdown(result["nl_response"])
+                    render_query_result_table(result, key_prefix="user")
+                else:
+                    st.warning("No answer received or unfamiliar response.")
+
         elif st.session_state.mode == "Admin":
             st.header("Admin Dashboard")
             admin_action = st.selectbox(
@@ -166,9 +314,9 @@ else:
                     if nl_query_admin:
                         with st.spinner("Processing..."):
                             result = process_user_query(nl_query_admin)
+                        st.session_state.last_admin_result = result
                         if result:
                             st.session_state.current_nl_query = nl_query_admin
-                            st.json(result)
 
                             if result.get("analysis") and result.get("analysis").get("relevant") in ["yes", "maybe"]:
                                 st.session_state.current_sql_query = result.get("generated_sql", "")
@@ -183,6 +331,11 @@ else:
                     else:
                         st.warning("Please enter a query.")
 
+                if st.session_state.last_admin_result:
+                    render_query_result_table(st.session_state.last_admin_result, key_prefix="admin")
+                    with st.expander("Full response", expanded=True):
+                        st.json(st.session_state.last_admin_result)
+
                 if st.session_state.current_nl_query and st.session_state.current_sql_query:
                     st.markdown("---")
                     st.markdown("#### Add this result as an example?")
@@ -250,39 +403,72 @@ else:
 
             elif admin_action == "View All Examples":
                 st.subheader("View All Examples")
-                limit_view = st.number_input("Items per page:", min_value=1, max_value=100, value=10, key="view_limit")
-                offset_view = st.text_input("Offset (for next page):", key="view_offset_input")
-
-                if st.button("Fetch Examples", key="admin_fetch_examples"):
-                    with st.spinner("Fetching..."):
-                        data = get_all_examples(limit=limit_view, offset=offset_view if offset_view else None)
-                    if data and "points" in data:
-                        st.success(f"{data.get('count', 0)} examples found. Next offset: {data.get('next_offset', 'None')}")
-                        if data["points"]:
-                            try:
-                                df_data = []
-                                for p in data["points"]:
-                                    row = {"qdrant_id": p.get("id")}
-                                    if p.get("payload"):
-                                        row.update(p["payload"])
-                                    df_data.append(row)
-                                df = pd.DataFrame(df_data)
-                                st.dataframe(df)
-                            except Exception as e:
-                                st.write(f"Error displaying payloads as table ({e}), showing raw JSON:")
-                                st.json(data["points"])
-                        else:
-                            st.info("No examples found.")
+                page_offsets = st.session_state.examples_page_offsets
+                limit_view = st.number_input("Items per page:", min_value=1, max_value=1000, value=100, key="view_limit", on_change=lambda: st.session_state.update(examples_page_offsets=[None]))
+
+                nav_prev, nav_refresh, nav_next = st.columns(3)
+                if nav_refresh.button("Refresh", key="admin_refresh_examples"):
+                    invalidate_example_caches()
+
+                # Pages come from st.cache_data, so reruns and back/forward navigation do not hit the backend again.
+                with st.spinner("Fetching..."):
+                    data = get_all_examples(limit=int(limit_view), offset=page_offsets[-1])
+                if data and "points" in data:
+                    next_offset = data.get("next_offset")
+                    if nav_prev.button("Previous page", key="admin_examples_prev", disabled=len(page_offsets) <= 1):
+                        page_offsets.pop()
+                        st.rerun()
+                    if nav_next.button("Next page", key="admin_examples_next", disabled=not next_offset):
+                        page_offsets.append(next_offset)
+                        st.rerun()
+                    st.caption(f"Page {len(page_offsets)} - {data.get('count', 0)} examples on this page.")
+                    if data["points"]:
+                        try:
+                            st.dataframe(pd.DataFrame([example_point_to_row(p) for p in data["points"]]), use_container_width=True)
+                        except Exception as e:
+                            st.write(f"Error displaying payloads as table ({e}), showing raw JSON:")
+                            st.json(data["points"])
                     else:
-                        st.error("Failed to fetch examples.")
+                        st.info("No examples found.")
+                else:
+                    st.error("Failed to fetch examples.")
+
+                with st.expander("Counts by table / type"):
+                    try:
+                        facet_cols = st.columns(2)
+                        for facet_col, facet_key in zip(facet_cols, ["tables", "type"]):
+                            facets = fetch_example_facets(facet_key)
+                            facet_col.dataframe(pd.DataFrame(facets["values"]), use_container_width=True)
+                    except requests.exceptions.RequestException as e:
+                        st.error(f"Error fetching facets: {e}")
+
+                if st.button("Load entire collection (streamed)", key="admin_stream_examples"):
+                    progress_placeholder = st.empty()
+                    all_rows = []
+                    try:
+                        # Only a counter while streaming; the table is built once at the end, not once per batch.
+                        for rows in stream_examples_export():
+                            all_rows.extend(rows)
+                            progress_placeholder.caption(f"Loaded {len(all_rows)} examples...")
+                        progress_placeholder.empty()
+                        st.dataframe(pd.DataFrame(all_rows), use_container_width=True)
+                        st.success(f"Loaded {len(all_rows)} examples.")
+                    except requests.exceptions.RequestException as e:
+                        st.error(f"Error exporting examples: {e}")
 
 
             elif admin_action == "Delete Example":
                 st.subheader("Delete Example")
-                point_id_to_delete = st.text_input("Qdrant Point ID to delete:", key="admin_delete_point_id")
+                point_id_to_delete = st.text_input("Qdrant Point ID(s) to delete (comma-separated):", key="admin_delete_point_id")
                 if st.button("Delete Example", key="admin_confirm_delete"):
-                    if point_id_to_delete:
-                        response = delete_example_by_id(point_id_to_delete)
+                    point_ids = [p.strip() for p in point_id_to_delete.split(",") if p.strip()]
+                    if len(point_ids) == 1:
+                        response = delete_example_by_id(point_ids[0])
+                        if response:
+                            st.success(response.get("message", "Deletion attempt processed."))
+                            st.json(response)
+                    elif point_ids:
+                        response = bulk_delete_examples(point_ids)
                         if response:
                             st.success(response.get("message", "Deletion attempt processed."))
                             st.json(response)
@@ -291,9 +477,9 @@ else:
 
             elif admin_action == "Backend Health":
                 st.subheader("Backend Health")
-                if st.button("Check Health", key="admin_check_health"):
-                    health_status = get_health_check()
-                    st.json(health_status)
+                if st.button("Refresh", key="admin_check_health"):
+                    fetch_health_check.clear()
+                st.json(get_health_check())
 
 st.markdown("---")
 st.markdown("NL-SQL App | Built with FastAPI & Streamlit")
\ No newline at end of file
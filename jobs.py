@@ -0,0 +1,372 @@
+import json
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from uuid import uuid4
+
+from sqlalchemy import event, text
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+JOB_STATUS_CANCELLED = "cancelled"
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+# --- Cooperative cancellation ---
+class CancellationToken:
+    """Set by DELETE /jobs/{id}; the pipeline checks it between stages and its running SQL statements are killed.
+
+    Every thread executing a statement under the token registers a killer for it, so statements of the
+    same job running concurrently (candidate fan-out) are all interrupted; so does every streamed result
+    still being fetched (see ``cancellable_fetch``). ``child()`` tokens are cancelled
+    with their parent but can also be cancelled on their own.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._statement_killers: Dict[Hashable, Callable[[], None]] = {}
+        self._children: List["CancellationToken"] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelledError("Job was cancelled.")
+
+    def child(self) -> "CancellationToken":
+        child = CancellationToken()
+        with self._lock:
+            self._children.append(child)
+        if self._event.is_set():
+            child.cancel()
+        return child
+
+    def set_statement_killer(self, killer: Optional[Callable[[], None]], key: Optional[Hashable] = None):
+        # Only set while a statement is actually running, so a pooled connection is never killed after reuse.
+        # Keyed by the executing thread unless ``key`` names something else that owns the statement.
+        key = key if key is not None else threading.get_ident()
+        with self._lock:
+            if killer is None:
+                self._statement_killers.pop(key, None)
+            else:
+                self._statement_killers[key] = killer
+        if killer is not None and self._event.is_set():
+            self._kill(killer)
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            killers = list(self._statement_killers.values())
+            children = list(self._children)
+        for killer in killers:
+            self._kill(killer)
+        for child in children:
+            child.cancel()
+
+    @staticmethod
+    def _kill(killer: Callable[[], None]):
+        try:
+            killer()
+        except Exception as e:
+            print(f"Warning: could not kill running statement: {e}")
+
+
+_current_job = threading.local()
+# Engines themselves, weakly: a disposed tenant engine drops out, and a new one can never pass for it (ids get reused).
+_instrumented_engines = weakref.WeakSet()
+_instrumented_engines_lock = threading.Lock()
+
+
+def current_cancellation_token() -> Optional[CancellationToken]:
+    return getattr(_current_job, "token", None)
+
+
+def _statement_killer(engine, dbapi_connection) -> Optional[Callable[[], None]]:
+    dialect_name = engine.dialect.name
+    if dialect_name == "sqlite":
+        return dbapi_connection.interrupt
+    if dialect_name == "postgresql" and hasattr(dbapi_connection, "cancel"):
+        return dbapi_connection.cancel
+    if dialect_name in ("mysql", "mariadb") and hasattr(dbapi_connection, "thread_id"):
+        thread_id = dbapi_connection.thread_id()
+
+        def kill_mysql_query():
+            with engine.connect() as kill_connection:
+                kill_connection.execute(text(f"KILL QUERY {int(thread_id)}"))
+        return kill_mysql_query
+    return None
+
+
+def _statement_cancellation_token(context) -> Optional[CancellationToken]:
+    # The token passed as the ``cancel_token`` execution option wins; the job thread's own token is the fallback.
+    token = context.execution_options.get("cancel_token") if context is not None else None
+    return token if token is not None else current_cancellation_token()
+
+
+def instrument_engine_for_cancellation(engine):
+    # Records which DBAPI connection a token's statement is executing on, so cancel() can interrupt it.
+    if engine is None:
+        return
+    with _instrumented_engines_lock:
+        if engine in _instrumented_engines:
+            return
+        _instrumented_engines.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _register_running_statement(conn, cursor, statement, parameters, context, executemany):
+        token = _statement_cancellation_token(context)
+        if token is not None:
+            token.set_statement_killer(_statement_killer(engine, conn.connection.dbapi_connection))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _unregister_finished_statement(conn, cursor, statement, parameters, context, executemany):
+        token = _statement_cancellation_token(context)
+        if token is not None:
+            token.set_statement_killer(None)
+
+    @event.listens_for(engine, "handle_error")
+    def _unregister_failed_statement(exception_context):
+        token = _statement_cancellation_token(exception_context.execution_context)
+        if token is not None:
+            token.set_statement_killer(None)
+
+
+@contextmanager
+def cancellable_fetch(connection, cancel_token: Optional[CancellationToken]):
+    # A streamed result (stream_results) is still running on the server while its rows are fetched, long after
+    # after_cursor_execute unregistered its killer: keep ``connection``'s statement killable until the block ends.
+    killer = None
+    if cancel_token is not None and connection.engine in _instrumented_engines:
+        killer = _statement_killer(connection.engine, connection.connection.dbapi_connection)
+    if killer is None:
+        yield
+        return
+    key = object()
+    cancel_token.set_statement_killer(killer, key=key)
+    try:
+        yield
+    finally:
+        cancel_token.set_statement_killer(None, key=key)
+
+
+# --- Persistent result store ---
+class JobStore:
+    """SQLite-backed job records; results are kept as ProcessQueryResponse JSON until their TTL expires."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                request_json TEXT NOT NULL,
+                response_json TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_jobs_expires_at ON jobs (expires_at)")
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        if "cancel_requested" not in columns:
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+        self._connection.commit()
+
+    def create(self, job_id: str, request_json: str):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (job_id, status, request_json, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, JOB_STATUS_QUEUED, request_json, now, now),
+            )
+            self._connection.commit()
+
+    def update(self, job_id: str, status: str, response_json: Optional[str] = None, error: Optional[str] = None, ttl_seconds: Optional[float] = None):
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds is not None else None
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, response_json = COALESCE(?, response_json), error = COALESCE(?, error), "
+                "updated_at = ?, expires_at = COALESCE(?, expires_at) WHERE job_id = ?",
+                (status, response_json, error, now, expires_at, job_id),
+            )
+            self._connection.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT job_id, status, response_json, error, created_at, updated_at, expires_at FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "created_at": row[4],
+            "updated_at": row[5],
+            "expires_at": row[6],
+        }
+
+    def request_cancel(self, job_id: str):
+        # Seen by whichever worker process runs the job (JobManager polls for it).
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+            self._connection.commit()
+
+    def cancel_requested_ids(self, job_ids: List[str]) -> List[str]:
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({placeholders})", job_ids
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_expired(self) -> int:
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+            self._connection.commit()
+            return cursor.rowcount
+
+    def fail_unfinished(self, reason: str, ttl_seconds: float) -> int:
+        # Jobs still queued/running when the process died can never finish; mark them failed on startup.
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, expires_at = ? WHERE status IN (?, ?)",
+                (JOB_STATUS_FAILED, reason, now, now + ttl_seconds, JOB_STATUS_QUEUED, JOB_STATUS_RUNNING),
+            )
+            self._connection.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# --- Worker pool ---
+class JobManager:
+    def __init__(
+        self,
+        store: JobStore,
+        runner: Callable[[Any, CancellationToken], Any],
+        max_workers: int = 4,
+        result_ttl_seconds: float = 3600.0,
+        cleanup_interval_seconds: float = 60.0,
+        recover_unfinished: bool = True,
+        cancel_poll_seconds: float = 0.5,
+    ):
+        self.store = store
+        self._runner = runner
+        self.result_ttl_seconds = result_ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query-job")
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._tokens_lock = threading.Lock()
+        # With several worker processes only the supervisor recovers, or a starting worker would fail its peers' jobs.
+        if recover_unfinished:
+            self.store.fail_unfinished("Job was interrupted by a server restart.", result_ttl_seconds)
+        self._cleanup_interval_seconds = cleanup_interval_seconds
+        self._cancel_poll_seconds = cancel_poll_seconds
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._cleanup_loop, name="query-job-cleanup", daemon=True),
+            threading.Thread(target=self._cancel_watch_loop, name="query-job-cancel-watch", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _cleanup_loop(self):
+        while not self._stopped.wait(self._cleanup_interval_seconds):
+            try:
+                self.store.delete_expired()
+            except Exception as e:
+                print(f"Warning: job cleanup failed: {e}")
+
+    def _cancel_watch_loop(self):
+        # Applies DELETE /jobs/{id} requests that were received by another worker process.
+        while not self._stopped.wait(self._cancel_poll_seconds):
+            with self._tokens_lock:
+                local_job_ids = list(self._tokens.keys())
+            if not local_job_ids:
+                continue
+            try:
+                for job_id in self.store.cancel_requested_ids(local_job_ids):
+                    with self._tokens_lock:
+                        token = self._tokens.get(job_id)
+                    if token is not None and not token.cancelled:
+                        token.cancel()
+            except Exception as e:
+                print(f"Warning: job cancel watch failed: {e}")
+
+    def submit(self, request) -> str:
+        job_id = str(uuid4())
+        token = CancellationToken()
+        self.store.create(job_id, request.model_dump_json())
+        with self._tokens_lock:
+            self._tokens[job_id] = token
+        self._executor.submit(self._run, job_id, request, token)
+        return job_id
+
+    def _run(self, job_id: str, request, token: CancellationToken):
+        try:
+            if token.cancelled or self.store.cancel_requested_ids([job_id]):
+                self.store.update(job_id, JOB_STATUS_CANCELLED, ttl_seconds=self.result_ttl_seconds)
+                return
+            self.store.update(job_id, JOB_STATUS_RUNNING)
+            _current_job.token = token
+            try:
+                response = self._runner(request, token)
+            finally:
+                _current_job.token = None
+                token.set_statement_killer(None)
+            if token.cancelled:
+                self.store.update(job_id, JOB_STATUS_CANCELLED, ttl_seconds=self.result_ttl_seconds)
+            else:
+                self.store.update(job_id, JOB_STATUS_SUCCEEDED, response_json=response.model_dump_json(), ttl_seconds=self.result_ttl_seconds)
+        except JobCancelledError:
+            self.store.update(job_id, JOB_STATUS_CANCELLED, ttl_seconds=self.result_ttl_seconds)
+        except Exception as e:
+            self.store.update(job_id, JOB_STATUS_FAILED, error=str(e), ttl_seconds=self.result_ttl_seconds)
+        finally:
+            with self._tokens_lock:
+                self._tokens.pop(job_id, None)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._tokens_lock:
+            token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel()
+        self.store.request_cancel(job_id)
+        return self.store.get(job_id)
+
+    def shutdown(self):
+        # Running jobs finish; queued ones stay queued in the store, where the next startup's recovery fails them.
+        self._stopped.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for thread in self._threads:
+            thread.join()
+        self.store.close()
@@ -0,0 +1,292 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+
+# Shared runtime settings file inside the profiles directory (not *.json, which ProfileStore lists as profiles).
+SHARED_SETTINGS_FILENAME = "sampling.settings"
+
+
+class ProfileNotFoundError(KeyError):
+    pass
+
+
+class ProfilingSettings:
+    """Runtime switch for pipeline profiling: always on for opted-in requests (header), sampled otherwise.
+
+    With ``shared_path`` set, runtime changes are written there and picked up by every worker process. The
+    file outlives the processes, so startup rewrites it from the configured values (``update``) unless told to
+    keep runtime changes across restarts.
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, allow_header: bool = True, shared_path: Optional[str] = None, refresh_interval_seconds: float = 1.0):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.allow_header = allow_header
+        self.shared_path = shared_path
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._next_refresh = 0.0
+        self._loaded_mtime = None
+
+    def update(self, enabled: bool, sample_rate: float, allow_header: bool):
+        self.enabled, self.sample_rate, self.allow_header = enabled, sample_rate, allow_header
+        if self.shared_path:
+            os.makedirs(os.path.dirname(self.shared_path) or ".", exist_ok=True)
+            tmp_path = f"{self.shared_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"enabled": enabled, "sample_rate": sample_rate, "allow_header": allow_header}, f)
+            os.replace(tmp_path, self.shared_path)
+            self._loaded_mtime = os.stat(self.shared_path).st_mtime_ns
+
+    def refresh(self, force: bool = True):
+        if not self.shared_path:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        self._next_refresh = now + self.refresh_interval_seconds
+        try:
+            mtime = os.stat(self.shared_path).st_mtime_ns
+            if mtime == self._loaded_mtime:
+                return
+            with open(self.shared_path, "r", encoding="utf-8") as f:
+                shared = json.load(f)
+            self.enabled, self.sample_rate, self.allow_header = shared["enabled"], shared["sample_rate"], shared["allow_header"]
+            self._loaded_mtime = mtime
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def should_profile(self, header_value: Optional[str] = None) -> bool:
+        self.refresh(force=False)
+        if header_value and self.allow_header and header_value.strip().lower() in ("1", "true", "yes", "on"):
+            return True
+        return self.enabled and self.sample_rate > 0 and random.random() < self.sample_rate
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack every ``interval_seconds``; cost does not grow with the number of calls."""
+
+    def __init__(self, profile: "RequestProfile", thread_id: int, interval_seconds: float):
+        super().__init__(name=f"profiler-{profile.profile_id[:8]}", daemon=True)
+        self._profile = profile
+        self._thread_id = thread_id
+        self._interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self.stack_counts: Counter = Counter()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval_seconds):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            # Root the stack at the current pipeline stage so the flamegraph splits by stage first.
+            frames.append(f"stage:{self._profile.current_stage or 'startup'}")
+            self.stack_counts[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, profile_id: str, label: str, interval_seconds: float):
+        self.profile_id = profile_id
+        self.label = label
+        self.interval_seconds = interval_seconds
+        self.created_at = time.time()
+        self.current_stage: Optional[str] = None
+        self.stages: List[Dict[str, Any]] = []
+        self._stage_wall_start = 0.0
+        self._stage_cpu_start = 0.0
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._sampler = _StackSampler(self, threading.get_ident(), interval_seconds)
+        self._sampler.start()
+
+    def begin_stage(self, name: str):
+        self._close_stage()
+        self.current_stage = name
+        self._stage_wall_start = time.perf_counter()
+        self._stage_cpu_start = time.thread_time()
+
+    def _close_stage(self):
+        if self.current_stage is None:
+            return
+        self.stages.append({
+            "name": self.current_stage,
+            "wall_ms": round((time.perf_counter() - self._stage_wall_start) * 1000, 3),
+            "cpu_ms": round((time.thread_time() - self._stage_cpu_start) * 1000, 3),
+        })
+        self.current_stage = None
+
+    def finish(self, error: Optional[str] = None) -> Dict[str, Any]:
+        self._close_stage()
+        wall_seconds = time.perf_counter() - self._wall_start
+        cpu_seconds = time.thread_time() - self._cpu_start
+        self._sampler.stop()
+        return {
+            "profile_id": self.profile_id,
+            "label": self.label,
+            "created_at": self.created_at,
+            "wall_ms": round(wall_seconds * 1000, 3),
+            "cpu_ms": round(cpu_seconds * 1000, 3),
+            "sample_interval_ms": self.interval_seconds * 1000,
+            "sample_count": sum(self._sampler.stack_counts.values()),
+            "stages": self.stages,
+            "error": error,
+        }
+
+    def collapsed_stacks(self) -> str:
+        # Brendan Gregg's collapsed format ("frame;frame;frame count"), readable by flamegraph.pl and speedscope.
+        return "".join(f"{stack} {count}\n" for stack, count in self._sampler.stack_counts.most_common())
+
+
+class StageTimer:
+    """Wall time per pipeline stage only (no stack sampling), cheap enough for every captured request."""
+
+    def __init__(self):
+        self.current_stage: Optional[str] = None
+        self.stages: List[Dict[str, Any]] = []
+        self._stage_start = 0.0
+
+    def begin_stage(self, name: str):
+        self._close_stage()
+        self.current_stage = name
+        self._stage_start = time.perf_counter()
+
+    def _close_stage(self):
+        if self.current_stage is None:
+            return
+        self.stages.append({"name": self.current_stage, "wall_ms": round((time.perf_counter() - self._stage_start) * 1000, 3)})
+        self.current_stage = None
+
+    def finish(self) -> List[Dict[str, Any]]:
+        self._close_stage()
+        return self.stages
+
+
+_active = threading.local()
+
+
+def profile_stage(name: str):
+    """Marks the start of a pipeline stage; a no-op unless the current thread is being profiled or timed."""
+    profile = getattr(_active, "profile", None)
+    if profile is not None:
+        profile.begin_stage(name)
+    timer = getattr(_active, "timer", None)
+    if timer is not None:
+        timer.begin_stage(name)
+
+
+class ProfileStore:
+    """Profiles on local disk: ``<id>.json`` (summary and per-stage wall/CPU) and ``<id>.collapsed`` (stacks)."""
+
+    def __init__(self, directory: str, max_profiles: int = 200):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        # IDs are generated hex UUIDs; anything else could escape the directory.
+        if not profile_id.isalnum():
+            raise ProfileNotFoundError(profile_id)
+        return os.path.join(self.directory, f"{profile_id}.{suffix}")
+
+    def save(self, summary: Dict[str, Any], collapsed: str):
+        profile_id = summary["profile_id"]
+        with open(self._path(profile_id, "collapsed"), "w", encoding="utf-8") as f:
+            f.write(collapsed)
+        with open(self._path(profile_id, "json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f)
+        self._prune()
+
+    def _summaries_by_age(self) -> List[Tuple[float, str]]:
+        # (mtime, profile_id), oldest first. Other files and profiles removed meanwhile (by another worker) are skipped.
+        summaries = []
+        for entry in os.scandir(self.directory):
+            profile_id = entry.name[:-len(".json")]
+            if not entry.name.endswith(".json") or not profile_id.isalnum():
+                continue
+            try:
+                summaries.append((entry.stat().st_mtime, profile_id))
+            except OSError:
+                continue
+        summaries.sort()
+        return summaries
+
+    def _prune(self):
+        with self._lock:
+            summaries = self._summaries_by_age()
+            for _, profile_id in summaries[:max(0, len(summaries) - self.max_profiles)]:
+                for suffix in ("json", "collapsed"):
+                    try:
+                        os.remove(self._path(profile_id, suffix))
+                    except OSError:
+                        pass
+
+    def get(self, profile_id: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(profile_id, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ProfileNotFoundError(profile_id)
+
+    def get_collapsed(self, profile_id: str) -> str:
+        try:
+            with open(self._path(profile_id, "collapsed"), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ProfileNotFoundError(profile_id)
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        summaries = []
+        for _, profile_id in reversed(self._summaries_by_age()[-limit:]):
+            try:
+                summary = self.get(profile_id)
+            except (ProfileNotFoundError, ValueError):
+                continue
+            summaries.append({key: summary.get(key) for key in ("profile_id", "label", "created_at", "wall_ms", "cpu_ms")})
+        return summaries
+
+
+def run_profiled(store: ProfileStore, label: str, interval_seconds: float, fn: Callable, *args, profile_id: Optional[str] = None, **kwargs):
+    """Runs ``fn`` in the calling thread under the stack sampler and saves the profile; returns (result, profile_id)."""
+    profile_id = profile_id or uuid4().hex
+    profile = RequestProfile(profile_id, label, interval_seconds)
+    _active.profile = profile
+    error = None
+    try:
+        return fn(*args, **kwargs), profile_id
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _active.profile = None
+        summary = profile.finish(error=error)
+        try:
+            store.save(summary, profile.collapsed_stacks())
+        except Exception as e:
+            print(f"Warning: could not save profile {profile_id}: {e}")
+
+
+def run_timed(fn: Callable, *args, **kwargs):
+    """Runs ``fn`` in the calling thread recording per-stage wall time; returns (result, stages)."""
+    timer = StageTimer()
+    _active.timer = timer
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _active.timer = None
+    return result, timer.finish()
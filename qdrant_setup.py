@@ -0,0 +1,191 @@
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import models
+
+from backend_logic import EXAMPLE_FACET_KEYS
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+class CollectionSettings:
+    """Explicit configuration for an example collection, applied on startup instead of server defaults."""
+
+    def __init__(
+        self,
+        vector_size: int = 0,
+        distance: str = "Cosine",
+        hnsw_m: int = 16,
+        hnsw_ef_construct: int = 100,
+        quantization: str = "none",
+        quantization_always_ram: bool = True,
+        on_disk: bool = False,
+        search_hnsw_ef: Optional[int] = 128,
+        search_rescore: bool = True,
+        search_oversampling: float = 2.0,
+        payload_index_keys: Optional[List[str]] = None,
+    ):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode '{quantization}'; expected one of {QUANTIZATION_MODES}.")
+        self.vector_size = vector_size
+        self.distance = models.Distance(distance)
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construct = hnsw_ef_construct
+        self.quantization = quantization
+        self.quantization_always_ram = quantization_always_ram
+        self.on_disk = on_disk
+        self.search_hnsw_ef = search_hnsw_ef
+        self.search_rescore = search_rescore
+        self.search_oversampling = search_oversampling
+        self.payload_index_keys = payload_index_keys if payload_index_keys is not None else list(EXAMPLE_FACET_KEYS.values())
+
+    def hnsw_config(self) -> models.HnswConfigDiff:
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=self.quantization_always_ram)
+            )
+        if self.quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        return None
+
+    def search_params(self) -> models.SearchParams:
+        # Query-time knobs: larger hnsw_ef trades latency for recall; rescoring re-ranks quantized hits with full vectors.
+        quantization_params = None
+        if self.quantization != "none":
+            quantization_params = models.QuantizationSearchParams(
+                rescore=self.search_rescore,
+                oversampling=self.search_oversampling if self.search_rescore else None,
+            )
+        return models.SearchParams(hnsw_ef=self.search_hnsw_ef, quantization=quantization_params)
+
+
+def _quantization_mode(quantization_config) -> str:
+    if isinstance(quantization_config, models.ScalarQuantization):
+        return "scalar"
+    if isinstance(quantization_config, models.BinaryQuantization):
+        return "binary"
+    return "none"
+
+
+def _configured_vector_size(settings: CollectionSettings, embedding_model=None) -> int:
+    if settings.vector_size:
+        return settings.vector_size
+    if embedding_model is None:
+        return 0
+    return len(embedding_model.embed_query("dimension probe"))
+
+
+def validate_example_collection(client, collection_name: str, settings: CollectionSettings, embedding_model=None):
+    """Checks an existing collection's vector layout against the settings without changing it; returns its info.
+
+    A missing collection, named vectors, or a distance or vector size other than the configured one raise
+    ValueError: none of them can be migrated in place, and searching such a collection returns scores the
+    rest of the pipeline misreads. With ``vector_size=0`` the size is only checked when ``embedding_model``
+    is given to probe it.
+    """
+    if not client.collection_exists(collection_name):
+        raise ValueError(f"Collection '{collection_name}' does not exist; run `python qdrant_setup.py` to create it.")
+    collection_info = client.get_collection(collection_name)
+    vectors = collection_info.config.params.vectors
+    if isinstance(vectors, dict):
+        raise ValueError(f"Collection '{collection_name}' uses named vectors; the example store expects a single unnamed vector.")
+    if vectors.distance != settings.distance:
+        raise ValueError(
+            f"Collection '{collection_name}' uses distance {vectors.distance.value}, configured {settings.distance.value}; "
+            "re-create the collection or fix QDRANT_DISTANCE."
+        )
+    vector_size = _configured_vector_size(settings, embedding_model)
+    if vector_size and vectors.size != vector_size:
+        raise ValueError(
+            f"Collection '{collection_name}' has vector size {vectors.size}, configured {vector_size}; "
+            "re-create the collection or fix QDRANT_VECTOR_SIZE."
+        )
+    return collection_info
+
+
+def ensure_example_collection(client, collection_name: str, settings: CollectionSettings, embedding_model=None) -> Dict[str, Any]:
+    """Creates the collection if missing, otherwise migrates HNSW/quantization settings and payload indexes in place.
+
+    The unnamed dense vector layout matches what the LangChain ``Qdrant`` wrapper writes. An existing
+    collection whose distance or vector size differs from the settings cannot be migrated and raises
+    ValueError (see ``validate_example_collection``).
+    """
+    changes: List[str] = []
+    if not client.collection_exists(collection_name):
+        vector_size = _configured_vector_size(settings, embedding_model)
+        if not vector_size:
+            raise ValueError("Vector size is not configured and no embedding model is available to detect it.")
+        client.create_collection(
+            collection_name=collection_name,
+            vectors_config=models.VectorParams(size=vector_size, distance=settings.distance, on_disk=settings.on_disk),
+            hnsw_config=settings.hnsw_config(),
+            quantization_config=settings.quantization_config(),
+        )
+        changes.append(f"created (size={vector_size}, distance={settings.distance.value})")
+    else:
+        collection_info = validate_example_collection(client, collection_name, settings, embedding_model)
+
+        current_hnsw = collection_info.config.hnsw_config
+        hnsw_diff = None
+        if current_hnsw.m != settings.hnsw_m or current_hnsw.ef_construct != settings.hnsw_ef_construct:
+            hnsw_diff = settings.hnsw_config()
+            changes.append(f"hnsw m={current_hnsw.m}->{settings.hnsw_m}, ef_construct={current_hnsw.ef_construct}->{settings.hnsw_ef_construct}")
+
+        quantization_diff = None
+        current_quantization = _quantization_mode(collection_info.config.quantization_config)
+        if current_quantization != settings.quantization:
+            quantization_diff = settings.quantization_config() or models.Disabled.DISABLED
+            changes.append(f"quantization {current_quantization}->{settings.quantization}")
+
+        if hnsw_diff is not None or quantization_diff is not None:
+            client.update_collection(collection_name=collection_name, hnsw_config=hnsw_diff, quantization_config=quantization_diff)
+
+    payload_schema = client.get_collection(collection_name).payload_schema or {}
+    for key in settings.payload_index_keys:
+        if key not in payload_schema:
+            client.create_payload_index(collection_name=collection_name, field_name=key, field_schema=models.PayloadSchemaType.KEYWORD, wait=True)
+            changes.append(f"payload index on {key}")
+
+    return {"collection": collection_name, "changes": changes}
+
+
+def prepare_example_collection(client, collection_name: str, settings: CollectionSettings, embedding_model=None, manage: bool = True) -> Dict[str, Any]:
+    # Startup step: create/migrate the collection when this process manages it, otherwise only check it.
+    if manage:
+        return ensure_example_collection(client, collection_name, settings, embedding_model)
+    validate_example_collection(client, collection_name, settings)
+    return {"collection": collection_name, "changes": []}
+
+
+def example_collection_names(default_collection_name: str, datasources: Dict[str, Dict[str, Any]]) -> List[str]:
+    # The default collection plus every tenant collection from DATASOURCES_CONFIG_PATH, each once.
+    collection_names = [default_collection_name]
+    for datasource_config in datasources.values():
+        collection_name = datasource_config.get("qdrant_collection_name")
+        if collection_name and collection_name not in collection_names:
+            collection_names.append(collection_name)
+    return collection_names
+
+
+def main():
+    import argparse
+
+    from config import DATASOURCES, QDRANT_COLLECTION_NAME, embedding_model, example_collection_settings, qdrant_client_instance
+
+    parser = argparse.ArgumentParser(description="Create/migrate (or with --check, only validate) the example collections.")
+    parser.add_argument("--check", action="store_true", help="Validate the collections against the settings without changing them.")
+    args = parser.parse_args()
+
+    if qdrant_client_instance is None:
+        raise SystemExit("Qdrant is not configured (qdrant_host / qdrant_api_key / qdrant_collection_name).")
+    for collection_name in example_collection_names(QDRANT_COLLECTION_NAME, DATASOURCES):
+        result = prepare_example_collection(
+            qdrant_client_instance, collection_name, example_collection_settings, embedding_model, manage=not args.check
+        )
+        print(f"Qdrant collection '{collection_name}': {', '.join(result['changes']) or 'up to date'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCapture:
+    """Appends request records to JSONL from a background thread; recording never blocks a request.
+
+    Each process writes its own ``requests-<pid>.jsonl`` under ``directory`` so worker processes never
+    interleave lines; past ``max_file_bytes`` the file is rotated to the next free ``requests-<pid>.<n>.jsonl``
+    segment, so nothing already captured is overwritten (prune old segments yourself). When the queue is
+    full (the disk cannot keep up), records are dropped and counted rather than queued without bound.
+    """
+
+    def __init__(self, directory: str, sample_rate: float = 1.0, queue_size: int = 10000, max_file_bytes: int = 100 * 1024 * 1024):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_file_bytes = max_file_bytes
+        self.path = os.path.join(directory, f"requests-{os.getpid()}.jsonl")
+        self.recorded = 0
+        self.dropped = 0
+        self._segment = 1
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._write_loop, name="request-capture", daemon=True)
+        self._writer.start()
+
+    def should_capture(self) -> bool:
+        return self.sample_rate >= 1.0 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def record(self, entry: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+        }
+
+    def _rotate(self, capture_file):
+        capture_file.close()
+        # Segments left by an earlier process with the same pid are kept too.
+        while os.path.exists(self._segment_path(self._segment)):
+            self._segment += 1
+        os.rename(self.path, self._segment_path(self._segment))
+        return open(self.path, "a", encoding="utf-8")
+
+    def _segment_path(self, segment: int) -> str:
+        return f"{self.path[:-len('.jsonl')]}.{segment}.jsonl"
+
+    def _write_loop(self):
+        capture_file = open(self.path, "a", encoding="utf-8")
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is queued so a burst costs one write and one flush.
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                capture_file.write("".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch))
+                capture_file.flush()
+                self.recorded += len(batch)
+                if capture_file.tell() > self.max_file_bytes:
+                    capture_file = self._rotate(capture_file)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning("could not write request capture to %s: %s", self.path, e)
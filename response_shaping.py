@@ -0,0 +1,192 @@
+import json
+import zlib
+from typing import Any, FrozenSet, Iterable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+from schema import ProcessQueryResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Always returned, whatever was asked for: who/what the response is about and why it may be empty.
+ALWAYS_INCLUDED_FIELDS = frozenset({"original_question", "datasource_id", "error_message"})
+RESPONSE_VERBOSITY_FIELDS = {
+    "minimal": frozenset({"generated_sql", "nl_response"}),
+    "standard": frozenset({
+        "generated_sql", "nl_response", "analysis", "sql_source", "model_routing",
+        "result_columns", "result_rows", "result_handle", "result_has_more"
+    }),
+    "full": None,
+}
+
+
+def resolve_response_fields(fields: Optional[Iterable[str]] = None, verbosity: Optional[str] = None) -> Optional[FrozenSet[str]]:
+    """Turns a ``fields`` list or a verbosity preset into the set of response fields to build; None means all.
+
+    Unknown field names or presets raise ValueError.
+    """
+    if fields:
+        requested = frozenset(name.strip() for name in fields if name and name.strip())
+        unknown = requested - set(ProcessQueryResponse.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown response fields: {', '.join(sorted(unknown))}.")
+        return requested | ALWAYS_INCLUDED_FIELDS
+    if verbosity is None:
+        return None
+    if verbosity not in RESPONSE_VERBOSITY_FIELDS:
+        raise ValueError(f"Unknown verbosity '{verbosity}'; expected one of {', '.join(RESPONSE_VERBOSITY_FIELDS)}.")
+    preset = RESPONSE_VERBOSITY_FIELDS[verbosity]
+    return None if preset is None else preset | ALWAYS_INCLUDED_FIELDS
+
+
+def wants_field(response_fields: Optional[FrozenSet[str]], name: str) -> bool:
+    return response_fields is None or name in response_fields
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (stdlib json if it is not installed)."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def shaped_response(model: ProcessQueryResponse, response_fields: Optional[FrozenSet[str]], headers: Optional[dict] = None) -> FastJSONResponse:
+    # Serialized straight from the model: FastAPI's response_model pass would validate and encode it a second time.
+    return FastJSONResponse(model.model_dump(include=response_fields), headers=headers)
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _accepted_encodings(accept_encoding: str) -> FrozenSet[str]:
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.strip().lower())
+    return frozenset(accepted)
+
+
+class CompressionMiddleware:
+    """Compresses responses of at least ``minimum_size`` bytes with brotli or gzip, whichever the client prefers.
+
+    Brotli is used when the ``brotli`` package is installed and the client accepts ``br``; otherwise gzip.
+    Streaming responses are compressed chunk by chunk. Responses that already carry a Content-Encoding and
+    server-sent event streams are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4, allow_brotli: bool = True):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.allow_brotli = allow_brotli and brotli is not None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if self.allow_brotli and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+        else:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(self, encoding, send))
+
+
+class _CompressingSend:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+
+    def _new_encoder(self):
+        if self.encoding == "br":
+            return _BrotliEncoder(self.middleware.brotli_quality)
+        return _GzipEncoder(self.middleware.gzip_level)
+
+    async def __call__(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Held back until the first body chunk shows whether the response is worth compressing.
+            self.start_message = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.encoder is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            skip = (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith("text/event-stream")
+                or (not more_body and len(body) < self.middleware.minimum_size)
+            )
+            if skip:
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.encoder = self._new_encoder()
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                await self.send(self.start_message)
+            else:
+                compressed = self.encoder.compress(body) + self.encoder.finish()
+                headers["Content-Length"] = str(len(compressed))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+
+        chunk = self.encoder.compress(body)
+        if not more_body:
+            chunk += self.encoder.finish()
+        if chunk or not more_body:
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -0,0 +1,407 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from sqlalchemy import text
+from langchain_community.utilities.sql_database import truncate_word
+
+from jobs import cancellable_fetch
+
+
+class ResultHandleNotFoundError(KeyError):
+    pass
+
+
+# One little-endian uint64 byte offset per page in ``<handle>.offsets``, so other workers can seek to a page.
+_PAGE_OFFSET = struct.Struct("<Q")
+
+
+def _json_row(row) -> List[Any]:
+    return [value if isinstance(value, (str, int, float, bool)) or value is None else str(value) for value in row]
+
+
+class SpooledResult:
+    """A query result streamed page by page into a JSONL file; only the first page is kept in memory."""
+
+    def __init__(self, handle: str, path: str, columns: List[str], page_size: int, max_string_length: int = 300):
+        self.handle = handle
+        self.path = path
+        self.columns = columns
+        self.page_size = page_size
+        self.max_string_length = max_string_length
+        self.first_page_rows: List[List[Any]] = []
+        self.page_offsets: List[int] = []
+        self.row_count = 0
+        self.complete = False
+        self.truncated = False
+        self.error: Optional[str] = None
+        # SHA-256 of every spooled row, set once complete: compares whole results without reading them back.
+        self.digest: Optional[str] = None
+        self.evicted = False
+        self.last_access = time.monotonic()
+        self._rows_hash = hashlib.sha256()
+        self._condition = threading.Condition()
+
+    def __str__(self) -> str:
+        # Same text SQLDatabase.run() would produce, restricted to the first page, plus how much is left out.
+        if not self.first_page_rows:
+            return ""
+        result_text = str([tuple(truncate_word(value, length=self.max_string_length) for value in row) for row in self.first_page_rows])
+        if self.has_more:
+            result_text += f"\n(Only {self.rows_shown()} are shown.)"
+        return result_text
+
+    def rows_shown(self) -> str:
+        # "the first 50 of 1234 rows"; while still spooling (or when truncated) the total is a lower bound, if known at all.
+        shown = len(self.first_page_rows)
+        if self.complete and not self.truncated:
+            return f"the first {shown} of {self.row_count} rows"
+        if self.row_count > shown:
+            return f"the first {shown} of {self.row_count} or more rows"
+        return f"the first {shown} rows"
+
+    @property
+    def has_more(self) -> bool:
+        return not self.complete or self.row_count > self.page_size
+
+    def _record_page(self, offset: int, rows_in_page: int):
+        with self._condition:
+            self.page_offsets.append(offset)
+            self.row_count += rows_in_page
+            self._condition.notify_all()
+
+    def _finish(self, error: Optional[str] = None, truncated: bool = False):
+        with self._condition:
+            self.complete = True
+            self.error = error
+            self.truncated = truncated
+            self.digest = self._rows_hash.hexdigest()
+            self._condition.notify_all()
+
+    def wait_until_complete(self, timeout_seconds: float) -> bool:
+        with self._condition:
+            self._condition.wait_for(lambda: self.complete or self.evicted, timeout=timeout_seconds)
+            return self.complete and not self.evicted
+
+    def read_page(self, page: int, timeout_seconds: float = 30.0) -> List[List[Any]]:
+        self.last_access = time.monotonic()
+        with self._condition:
+            self._condition.wait_for(lambda: page < len(self.page_offsets) or self.complete or self.evicted, timeout=timeout_seconds)
+            if self.evicted:
+                raise ResultHandleNotFoundError(self.handle)
+            if page >= len(self.page_offsets):
+                return []
+            offset = self.page_offsets[page]
+        rows = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                f.seek(offset)
+                for _ in range(self.page_size):
+                    line = f.readline()
+                    if not line:
+                        break
+                    rows.append(json.loads(line))
+        except FileNotFoundError:
+            # Evicted (and its file removed) between the check above and the open.
+            raise ResultHandleNotFoundError(self.handle)
+        return rows
+
+
+class _SpoolFile:
+    """Writer for a result's ``.jsonl`` rows and its ``.offsets`` page index."""
+
+    def __init__(self, path: str, offsets_path: str):
+        self._rows_file = open(path, "w", encoding="utf-8")
+        self._offsets_file = open(offsets_path, "wb")
+
+    def write_page(self, spooled: SpooledResult, rows: List[List[Any]]):
+        offset = self._rows_file.tell()
+        for row in rows:
+            line = json.dumps(row, default=str) + "\n"
+            self._rows_file.write(line)
+            spooled._rows_hash.update(line.encode("utf-8"))
+        self._rows_file.flush()
+        # Written only once the page's rows are on disk: a listed page is always complete.
+        self._offsets_file.write(_PAGE_OFFSET.pack(offset))
+        self._offsets_file.flush()
+        spooled._record_page(offset, len(rows))
+
+    def close(self):
+        self._rows_file.close()
+        self._offsets_file.close()
+
+
+class ResultSpool:
+    """Bounded, idle-evicted set of spooled query results on local disk.
+
+    With several worker processes sharing ``directory``, pages of a result spooled by another worker are
+    served from its ``.jsonl``/``.offsets``/``.meta.json`` files. Such reads touch the ``.meta.json`` file,
+    and the owning worker does not evict a result whose meta file was touched within ``idle_ttl_seconds``.
+
+    A background spooler keeps its DB connection until the result is fully spooled, so at most
+    ``max_active_spools`` run at once. When all are busy, the rest of a result is fetched inline, up to
+    ``inline_max_rows`` rows, and the result is marked truncated if more rows remain.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        page_size: int = 50,
+        max_handles: int = 64,
+        idle_ttl_seconds: float = 600.0,
+        max_rows: int = 100_000,
+        max_active_spools: int = 4,
+        inline_max_rows: int = 1000,
+    ):
+        self.directory = directory
+        self.page_size = page_size
+        self.max_handles = max_handles
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_rows = max_rows
+        self.inline_max_rows = inline_max_rows
+        self._spool_slots = threading.BoundedSemaphore(max_active_spools)
+        self._lock = threading.Lock()
+        self._results: "OrderedDict[str, SpooledResult]" = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        # Only results idle past the TTL are stale; newer ones may belong to another worker process. A result
+        # counts as used when any of its files is recent (readers in other workers only touch the meta file).
+        now = time.time()
+        files_by_handle: Dict[str, List[os.DirEntry]] = {}
+        for entry in os.scandir(directory):
+            if entry.name.endswith((".jsonl", ".offsets", ".meta.json")):
+                files_by_handle.setdefault(entry.name.split(".", 1)[0], []).append(entry)
+        for entries in files_by_handle.values():
+            if now - max(entry.stat().st_mtime for entry in entries) > idle_ttl_seconds:
+                for entry in entries:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def execute(self, engine, sql_query: str, page_size: Optional[int] = None, cancel_token=None):
+        """Runs the query on a server-side cursor; returns "" for no rows, otherwise a SpooledResult.
+
+        The first page is read before returning; the rest is spooled to disk by a background thread, which
+        stops once ``cancel_token`` (see jobs.CancellationToken) is cancelled. On an instrumented engine the
+        cancel also interrupts a fetch that is waiting on the database.
+        """
+        page_size = page_size or self.page_size
+        self.evict_idle()
+        connection = engine.connect()
+        try:
+            result = connection.execution_options(stream_results=True, yield_per=page_size, cancel_token=cancel_token).execute(text(sql_query))
+            if not result.returns_rows:
+                connection.commit()
+                connection.close()
+                return ""
+            with cancellable_fetch(connection, cancel_token):
+                first_page = result.fetchmany(page_size)
+        except Exception:
+            connection.close()
+            raise
+
+        handle = uuid4().hex
+        spooled = SpooledResult(handle, os.path.join(self.directory, f"{handle}.jsonl"), list(result.keys()), page_size)
+        spooled.first_page_rows = [_json_row(row) for row in first_page]
+        self._write_meta(spooled)
+        spool_file = _SpoolFile(spooled.path, self._offsets_path(handle))
+        spool_file.write_page(spooled, spooled.first_page_rows)
+
+        if len(first_page) < page_size:
+            spool_file.close()
+            connection.close()
+            spooled._finish()
+            self._write_meta(spooled)
+        elif self._spool_slots.acquire(blocking=False):
+            spool_thread = threading.Thread(target=self._spool_remaining, args=(connection, result, spool_file, spooled, cancel_token), name=f"result-spool-{handle[:8]}", daemon=True)
+            spool_thread.start()
+        else:
+            self._spool_inline(connection, result, spool_file, spooled, cancel_token)
+
+        self._register(spooled)
+        return spooled
+
+    def _spool_remaining(self, connection, result, spool_file, spooled: SpooledResult, cancel_token=None):
+        try:
+            self._copy_rows(connection, result, spool_file, spooled, self.max_rows, cancel_token)
+        finally:
+            self._spool_slots.release()
+
+    def _spool_inline(self, connection, result, spool_file, spooled: SpooledResult, cancel_token=None):
+        # No spooler free: read a capped remainder now, on the caller's DB slot, and release the connection.
+        self._copy_rows(connection, result, spool_file, spooled, min(self.max_rows, spooled.page_size + self.inline_max_rows), cancel_token)
+
+    def _copy_rows(self, connection, result, spool_file, spooled: SpooledResult, max_rows: int, cancel_token=None):
+        error, truncated = None, False
+        try:
+            # A cancel interrupts a fetch that is waiting on the database, not just the next page.
+            with cancellable_fetch(connection, cancel_token):
+                for partition in result.partitions(spooled.page_size):
+                    if spooled.evicted:
+                        break
+                    if cancel_token is not None and cancel_token.cancelled:
+                        error = "Query was cancelled."
+                        break
+                    if spooled.row_count >= max_rows:
+                        truncated = True
+                        break
+                    spool_file.write_page(spooled, [_json_row(row) for row in partition])
+        except Exception as e:
+            error = "Query was cancelled." if cancel_token is not None and cancel_token.cancelled else str(e)
+        finally:
+            spool_file.close()
+            result.close()
+            connection.close()
+            spooled._finish(error=error, truncated=truncated)
+            if not spooled.evicted:
+                self._write_meta(spooled)
+
+    def _meta_path(self, handle: str) -> str:
+        if not handle.isalnum():
+            raise ResultHandleNotFoundError(handle)
+        return os.path.join(self.directory, f"{handle}.meta.json")
+
+    def _offsets_path(self, handle: str) -> str:
+        return os.path.join(self.directory, f"{handle}.offsets")
+
+    def _write_meta(self, spooled: SpooledResult):
+        meta = {
+            "columns": spooled.columns,
+            "page_size": spooled.page_size,
+            "row_count": spooled.row_count,
+            "complete": spooled.complete,
+            "truncated": spooled.truncated,
+            "error": spooled.error,
+        }
+        tmp_path = f"{self._meta_path(spooled.handle)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(spooled.handle))
+
+    def _register(self, spooled: SpooledResult):
+        evicted = []
+        with self._lock:
+            self._results[spooled.handle] = spooled
+            while len(self._results) > self.max_handles:
+                evicted.append(self._results.popitem(last=False)[1])
+        for old in evicted:
+            self._discard(old)
+
+    def _discard(self, spooled: SpooledResult):
+        with spooled._condition:
+            spooled.evicted = True
+            spooled._condition.notify_all()
+        # The spooling thread (if any) stops at its next page; removing the file is safe on POSIX either way.
+        for path in (spooled.path, self._offsets_path(spooled.handle), self._meta_path(spooled.handle)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def discard(self, handle: str):
+        # For a result nobody will page through; its spooler (if any) stops at the next page.
+        with self._lock:
+            spooled = self._results.pop(handle, None)
+        if spooled is not None:
+            self._discard(spooled)
+
+    def close(self):
+        # Results still spooling are discarded, so their spoolers release their DB connections; finished ones stay
+        # on disk for other workers to page through (and are removed by the next startup once idle).
+        with self._lock:
+            spooling = [spooled for spooled in self._results.values() if not spooled.complete]
+            self._results.clear()
+        for spooled in spooling:
+            self._discard(spooled)
+
+    def _read_elsewhere_recently(self, handle: str) -> bool:
+        try:
+            return time.time() - os.stat(self._meta_path(handle)).st_mtime <= self.idle_ttl_seconds
+        except OSError:
+            return False
+
+    def evict_idle(self) -> int:
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for handle, spooled in list(self._results.items()):
+                if now - spooled.last_access <= self.idle_ttl_seconds:
+                    continue
+                if self._read_elsewhere_recently(handle):
+                    # Another worker is paging through it (see _fetch_page_from_disk).
+                    spooled.last_access = now
+                    continue
+                evicted.append(self._results.pop(handle))
+        for spooled in evicted:
+            self._discard(spooled)
+        return len(evicted)
+
+    def get(self, handle: str) -> SpooledResult:
+        self.evict_idle()
+        with self._lock:
+            spooled = self._results.get(handle)
+            if spooled is None:
+                raise ResultHandleNotFoundError(handle)
+            self._results.move_to_end(handle)
+        spooled.last_access = time.monotonic()
+        return spooled
+
+    def _fetch_page_from_disk(self, handle: str, page: int) -> Dict[str, Any]:
+        # Result spooled by another worker: its page index gives the byte offset to seek to.
+        meta_path = self._meta_path(handle)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # Tells the owning worker the result is still in use, so it is not evicted mid-pagination.
+            os.utime(meta_path)
+            with open(self._offsets_path(handle), "rb") as f:
+                f.seek(page * _PAGE_OFFSET.size)
+                packed_offset = f.read(_PAGE_OFFSET.size)
+            rows = []
+            if len(packed_offset) == _PAGE_OFFSET.size:
+                with open(os.path.join(self.directory, f"{handle}.jsonl"), "r", encoding="utf-8") as f:
+                    f.seek(_PAGE_OFFSET.unpack(packed_offset)[0])
+                    for _ in range(meta["page_size"]):
+                        line = f.readline()
+                        if not line.endswith("\n"):
+                            break
+                        rows.append(json.loads(line))
+        except FileNotFoundError:
+            raise ResultHandleNotFoundError(handle)
+        return {
+            "handle": handle,
+            "page": page,
+            "page_size": meta["page_size"],
+            "columns": meta["columns"],
+            "rows": rows,
+            "has_more": not meta["complete"] or (page + 1) * meta["page_size"] < meta["row_count"],
+            "complete": meta["complete"],
+            "total_rows": meta["row_count"] if meta["complete"] else None,
+            "truncated": meta["truncated"],
+            "error": meta["error"],
+        }
+
+    def fetch_page(self, handle: str, page: int) -> Dict[str, Any]:
+        try:
+            spooled = self.get(handle)
+        except ResultHandleNotFoundError:
+            return self._fetch_page_from_disk(handle, page)
+        rows = spooled.read_page(page)
+        return {
+            "handle": handle,
+            "page": page,
+            "page_size": spooled.page_size,
+            "columns": spooled.columns,
+            "rows": rows,
+            "has_more": not spooled.complete or (page + 1) < len(spooled.page_offsets),
+            "complete": spooled.complete,
+            "total_rows": spooled.row_count if spooled.complete else None,
+            "truncated": spooled.truncated,
+            "error": spooled.error,
+        }
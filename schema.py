@@ -1,9 +1,15 @@
-from pydantic import BaseModel ,Field 
-from typing import List, Optional, Any , Dict
+from pydantic import BaseModel ,ConfigDict ,Field 
+from typing import List, Optional, Any , Dict, Literal
 import os
 # --- Pydantic Models for API ---
 class ProcessQueryRequest(BaseModel):
     user_question: str
+    datasource_id: Optional[str] = None
+    sql_candidates: Optional[int] = Field(None, ge=1, description="Generate this many SQL candidates in parallel (opt-in).")
+    candidate_strategy: Optional[Literal["first_valid", "majority"]] = None
+    page_size: Optional[int] = Field(None, ge=1, le=10000, description="Rows per result page (defaults to RESULT_PAGE_SIZE).")
+    fields: Optional[List[str]] = Field(None, description="Response fields to build and return; overrides verbosity.")
+    verbosity: Optional[Literal["minimal", "standard", "full"]] = Field(None, description="Response preset (defaults to RESPONSE_DEFAULT_VERBOSITY).")
 
 class QueryAnalysisData(BaseModel):
     relevant: str
@@ -17,18 +23,77 @@ class SimilarExample(BaseModel):
     sql: Optional[str] = None
     tables: Optional[List[str]] = None
     type: Optional[str] = None
+    score: Optional[float] = None
     
 
 class ProcessQueryResponse(BaseModel):
+    # ``model_routing`` is a response field, not pydantic API: don't warn about the "model_" prefix.
+    model_config = ConfigDict(protected_namespaces=())
+
     original_question: str
+    datasource_id: Optional[str] = None
     analysis: Optional[QueryAnalysisData] = None
     similar_examples: List[SimilarExample] = []
     assembled_prompt_snippet: Optional[str] = None
+    prompt_token_counts: Optional[Dict[str, int]] = None
     generated_sql: Optional[str] = None
+    sql_source: Optional[str] = None  # "generated" or "example_reuse"
+    model_routing: Optional[Dict[str, Any]] = None
+    sql_candidates_info: Optional[Dict[str, Any]] = None
     query_result: Optional[Any] = None
+    result_columns: Optional[List[str]] = None
+    result_rows: Optional[List[List[Any]]] = None  # first page only
+    result_handle: Optional[str] = None  # pass to GET /query-results/{handle} for further pages
+    result_has_more: Optional[bool] = None
     nl_response: Optional[str] = None
     error_message: Optional[str] = None
 
+class QueryResultPageResponse(BaseModel):
+    handle: str
+    page: int
+    page_size: int
+    columns: List[str]
+    rows: List[List[Any]]
+    has_more: bool
+    complete: bool
+    total_rows: Optional[int] = None
+    truncated: bool = False
+    error: Optional[str] = None
+
+class ProfilingSettingsModel(BaseModel):
+    enabled: bool
+    sample_rate: float = Field(..., ge=0.0, le=1.0)
+    allow_header: bool = True
+
+class ProfileStage(BaseModel):
+    name: str
+    wall_ms: float
+    cpu_ms: float
+
+class ProfileResponse(BaseModel):
+    profile_id: str
+    label: str
+    created_at: float
+    wall_ms: float
+    cpu_ms: float
+    sample_interval_ms: float
+    sample_count: int
+    stages: List[ProfileStage]
+    error: Optional[str] = None
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, succeeded, failed or cancelled
+    created_at: float
+    updated_at: float
+    expires_at: Optional[float] = None
+    result: Optional[ProcessQueryResponse] = None
+    error: Optional[str] = None
+
 class NLSQLInputExample(BaseModel): 
     nl: str = Field(..., description="Natural language question.")
     sql: Optional[str] = Field(None, description="The corresponding SQL query.")
@@ -51,6 +116,28 @@ class DeletePointResponse(BaseModel):
     point_id_deleted: Any
     details: Optional[str] = None
 
+class BulkDeleteExamplesRequest(BaseModel):
+    ids: Optional[List[str]] = Field(None, description="Point IDs (integer or UUID strings) to delete.")
+    tables: Optional[List[str]] = Field(None, description="Delete examples that use any of these tables.")
+    type: Optional[str] = Field(None, description="Delete examples of this query type.")
+
+class BulkDeleteExamplesResponse(BaseModel):
+    message: str
+    matched_count: int = Field(..., description="Points matching the selection just before the delete.")
+    details: Optional[str] = None
+
+class ExampleCountResponse(BaseModel):
+    count: int
+
+class FacetValue(BaseModel):
+    value: Any
+    count: int
+
+class ExampleFacetsResponse(BaseModel):
+    key: str
+    source: str  # "facet" (server-side) or "scroll" (fallback)
+    values: List[FacetValue]
+
 # Temporary directory for uploaded files
 TEMP_UPLOAD_DIR = "temp_uploads"
 os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
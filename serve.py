@@ -0,0 +1,90 @@
+"""Production entry point: runs N uvicorn worker processes of backend:app on one port.
+
+Usage: python serve.py [--workers N] [--host 0.0.0.0] [--port 8000] [--app module:attr [--factory]]
+
+The supervisor preloads the shared work once before any worker starts. It sets up the example collections,
+writes the column-value index snapshots that every worker memory-maps read-only, marks jobs interrupted by
+the last shutdown as failed and resets the shared profiling settings to the configured values. Workers are
+spawned fresh rather than forked from a preloaded app: the LLM/Qdrant clients, DB pools and job threads are
+not fork-safe, and what is large and read-only is shared through the mapped snapshots instead.
+"""
+import argparse
+import os
+
+import uvicorn
+
+
+def preload():
+    from config import (
+        embedding_model,
+        example_collection_settings,
+        qdrant_client_instance,
+        DATASOURCES,
+        JOB_STORE_PATH,
+        JOB_RESULT_TTL_SECONDS,
+        PROFILING_ALLOW_HEADER,
+        PROFILING_DIR,
+        PROFILING_ENABLED,
+        PROFILING_RESET_ON_STARTUP,
+        PROFILING_SAMPLE_RATE,
+        QDRANT_COLLECTION_NAME,
+        QDRANT_MANAGE_COLLECTION,
+        VALUE_INDEX_PATH,
+    )
+    from jobs import JobStore
+    from profiling import SHARED_SETTINGS_FILENAME, ProfilingSettings
+    from qdrant_setup import ensure_example_collection, example_collection_names
+    from value_index import load_shared_value_index
+
+    if QDRANT_MANAGE_COLLECTION and qdrant_client_instance is not None:
+        # Tenant collections too: workers only validate theirs, so one missing here would fail every request to it.
+        for collection_name in example_collection_names(QDRANT_COLLECTION_NAME, DATASOURCES):
+            try:
+                setup_result = ensure_example_collection(qdrant_client_instance, collection_name, example_collection_settings, embedding_model)
+                print(f"Qdrant collection '{collection_name}': {', '.join(setup_result['changes']) or 'up to date'}")
+            except ValueError:
+                # The collection does not match the configuration: fail before any worker starts.
+                raise
+            except Exception as e:
+                print(f"Warning: could not set up Qdrant collection '{collection_name}': {e}")
+
+    index_paths = [VALUE_INDEX_PATH] + [ds.get("value_index_path") for ds in DATASOURCES.values()]
+    for index_path in index_paths:
+        if index_path and os.path.exists(index_path):
+            load_shared_value_index(index_path)  # (re)writes the snapshot if missing or stale
+
+    job_store = JobStore(JOB_STORE_PATH)
+    recovered = job_store.fail_unfinished("Job was interrupted by a server restart.", JOB_RESULT_TTL_SECONDS)
+    job_store.close()
+    if recovered:
+        print(f"Marked {recovered} interrupted jobs as failed.")
+
+    if PROFILING_RESET_ON_STARTUP:
+        ProfilingSettings(shared_path=os.path.join(PROFILING_DIR, SHARED_SETTINGS_FILENAME)).update(
+            enabled=PROFILING_ENABLED, sample_rate=PROFILING_SAMPLE_RATE, allow_header=PROFILING_ALLOW_HEADER
+        )
+
+    # Already done above; workers only validate the collection, must not fail jobs their peers are running,
+    # and must not reset profiling settings changed at runtime when uvicorn restarts one of them.
+    os.environ["QDRANT_MANAGE_COLLECTION"] = "false"
+    os.environ["JOB_RECOVER_ON_STARTUP"] = "false"
+    os.environ["PROFILING_RESET_ON_STARTUP"] = "false"
+
+
+def main():
+    from config import SERVE_HOST, SERVE_PORT, SERVE_WORKERS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--app", default="backend:app", help="ASGI app import string each worker loads.")
+    parser.add_argument("--factory", action="store_true", help="--app names a factory returning the app (benchmark_replay.py uses this).")
+    args = parser.parse_args()
+
+    preload()
+    uvicorn.run(args.app, factory=args.factory, host=args.host, port=args.port, workers=args.workers, timeout_graceful_shutdown=30)
+
+
+if __name__ == "__main__":
+    main()
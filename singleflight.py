@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+# --- Thread-based single-flight (used inside the sync pipeline stages) ---
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Concurrent callers using the same key share one execution of the function."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+# --- Asyncio-based single-flight (used at the endpoint level) ---
+class AsyncSingleFlight:
+    """Concurrent awaiters using the same key share one task; waiters do not hold worker threads."""
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, coro_fn: Callable, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+
+            def _forget(finished_task, flight_key=key):
+                if self._tasks.get(flight_key) is finished_task:
+                    del self._tasks[flight_key]
+
+            task.add_done_callback(_forget)
+        # Shield so one client disconnecting does not cancel the shared execution for everyone else.
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules live at the repository root rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py refuses to load without Azure OpenAI settings. Tests that import it (or backend) get placeholders, which
+# are never called, and keep the job store, spool, profiles, captures and value index out of the working tree.
+_state_dir = tempfile.mkdtemp(prefix="text2sql-tests-")
+for name, value in {
+    "AZURE_OPENAI_ENDPOINT": "https://example.invalid",
+    "AZURE_OPENAI_API_KEY": "test",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME": "test-embedding",
+    "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME": "test-chat",
+    "JOB_STORE_PATH": os.path.join(_state_dir, "jobs.db"),
+    "RESULT_SPOOL_DIR": os.path.join(_state_dir, "result_spool"),
+    "PROFILING_DIR": os.path.join(_state_dir, "profiles"),
+    "CAPTURE_DIR": os.path.join(_state_dir, "captures"),
+    "VALUE_INDEX_PATH": os.path.join(_state_dir, "value_index.json"),
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def result_spool(tmp_path, monkeypatch):
+    # backend creates its spool in the app's lifespan; tests that run the pipeline without it get their own.
+    import backend
+    from result_spool import ResultSpool
+
+    spool = ResultSpool(str(tmp_path / "result_spool"))
+    monkeypatch.setattr(backend, "result_spool", spool)
+    yield spool
+    spool.close()
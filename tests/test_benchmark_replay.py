@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from benchmark_replay import is_saturated, percentile, poisson_schedule, recorded_schedule, request_body
+
+
+def entries(*timestamps):
+    return [{"ts": ts, "user_question": f"q{n}"} for n, ts in enumerate(timestamps)]
+
+
+def test_recorded_schedule_keeps_the_gaps_scaled_by_speed():
+    captured = entries(100.0, 101.0, 104.0)
+
+    assert [offset for offset, _ in recorded_schedule(captured, 1)] == [0.0, 1.0, 4.0]
+    assert [offset for offset, _ in recorded_schedule(captured, 4)] == [0.0, 0.25, 1.0]
+    assert [entry["user_question"] for _, entry in recorded_schedule(captured, 2)] == ["q0", "q1", "q2"]
+
+
+def test_poisson_schedule_hits_the_rate_and_cycles_through_the_questions():
+    captured = entries(0.0, 1.0, 2.0)
+    schedule = poisson_schedule(captured, rate=50, duration_seconds=20, rng=random.Random(3))
+
+    assert 900 <= len(schedule) <= 1100
+    offsets = [offset for offset, _ in schedule]
+    assert offsets == sorted(offsets) and 0 < offsets[0] and offsets[-1] < 20
+    assert [entry["user_question"] for _, entry in schedule[:4]] == ["q0", "q1", "q2", "q0"]
+    assert poisson_schedule(captured, 50, 20, random.Random(3)) == schedule
+
+
+@pytest.mark.parametrize("values, fraction, expected", [
+    ([], 0.99, 0.0),
+    ([5.0], 0.5, 5.0),
+    ([float(n) for n in range(1, 101)], 0.5, 50.0),
+    ([float(n) for n in range(1, 101)], 0.95, 95.0),
+    ([float(n) for n in range(1, 101)], 0.99, 99.0),
+    ([float(n) for n in range(1, 101)], 1.0, 100.0),
+    ([1.0, 2.0, 3.0], 0.0, 1.0),
+])
+def test_percentile_is_nearest_rank(values, fraction, expected):
+    assert percentile(values, fraction) == expected
+
+
+def step(**overrides):
+    return {"offered_rps": 10.0, "throughput_rps": 10.0, "p99_ms": 800.0, "error_rate": 0.0, **overrides}
+
+
+@pytest.mark.parametrize("overrides, saturated", [
+    ({}, False),
+    ({"throughput_rps": 9.0}, False),
+    ({"throughput_rps": 8.9}, True),
+    ({"p99_ms": 2001.0}, True),
+    ({"error_rate": 0.02}, True),
+    ({"error_rate": 0.01}, False),
+])
+def test_saturation_is_falling_behind_missing_the_slo_or_failing(overrides, saturated):
+    assert is_saturated(step(**overrides), slo_p99_ms=2000, max_error_rate=0.01) == saturated
+
+
+def test_request_body_replays_only_what_was_sent():
+    captured = {
+        "ts": 1.0, "user_question": "Top customers", "datasource_id": None, "sql_candidates": 3, "candidate_strategy": None,
+        "page_size": 50, "fields": ["generated_sql"], "verbosity": None, "status": 200, "latency_ms": 12.0, "stages": [],
+    }
+
+    assert request_body(captured) == {"user_question": "Top customers", "sql_candidates": 3, "page_size": 50, "fields": ["generated_sql"]}
+    assert request_body({"ts": 1.0, "user_question": "q"}) == {"user_question": "q"}
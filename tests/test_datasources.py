@@ -0,0 +1,90 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from datasources import (
+    DEFAULT_DATASOURCE_ID,
+    Datasource,
+    DatasourceNotFoundError,
+    DatasourceRegistry,
+    create_datasource_from_config,
+)
+
+
+@pytest.fixture
+def tenant_configs(tmp_path):
+    configs = {}
+    for tenant in ("a", "b"):
+        path = tmp_path / f"tenant_{tenant}.db"
+        with create_engine(f"sqlite:///{path}").begin() as connection:
+            connection.execute(text("CREATE TABLE tenant (name TEXT)"))
+            connection.execute(text("INSERT INTO tenant VALUES (:name)"), {"name": f"tenant {tenant}"})
+        configs[tenant] = {"db_connection_string": f"sqlite:///{path}"}
+    return configs
+
+
+def make_registry(tenant_configs, **kwargs):
+    return DatasourceRegistry(
+        factory=lambda datasource_id: create_datasource_from_config(datasource_id, tenant_configs[datasource_id]),
+        known_ids=lambda: list(tenant_configs),
+        **kwargs,
+    )
+
+
+def is_disposed(datasource, pool):
+    # Engine.dispose() swaps in a fresh pool.
+    return datasource.engine.pool is not pool
+
+
+def test_each_datasource_id_gets_its_own_engine(tenant_configs):
+    registry = make_registry(tenant_configs)
+
+    tenant_a, tenant_b = registry.get("a"), registry.get("b")
+    assert tenant_a.engine is not tenant_b.engine
+    assert tenant_a.db.run("SELECT name FROM tenant") == "[('tenant a',)]"
+    assert tenant_b.db.run("SELECT name FROM tenant") == "[('tenant b',)]"
+    assert "tenant(name)" in tenant_a.db_schema.lower()
+    assert registry.get("a") is tenant_a
+    with pytest.raises(DatasourceNotFoundError):
+        registry.get("c")
+
+
+def test_least_recently_used_datasource_is_evicted_and_disposed(tenant_configs):
+    registry = make_registry(tenant_configs, max_size=1)
+    tenant_a = registry.get("a")
+    tenant_a_pool = tenant_a.engine.pool
+
+    registry.get("b")
+    assert registry.status()["cached"] == ["b"]
+    assert is_disposed(tenant_a, tenant_a_pool)
+    assert registry.get("a") is not tenant_a
+
+
+def test_idle_datasource_is_evicted_and_disposed(tenant_configs):
+    registry = make_registry(tenant_configs, idle_ttl_seconds=0.05)
+    tenant_a = registry.get("a")
+    tenant_a_pool = tenant_a.engine.pool
+
+    time.sleep(0.1)
+    assert registry.evict_idle() == 1
+    assert registry.status()["cached"] == []
+    assert is_disposed(tenant_a, tenant_a_pool)
+
+
+def test_pinned_default_datasource_is_never_evicted(tenant_configs):
+    registry = make_registry(tenant_configs, max_size=1, idle_ttl_seconds=0.05)
+    default_engine = create_engine("sqlite://")
+    default = Datasource(DEFAULT_DATASOURCE_ID, engine=default_engine)
+    default_pool = default_engine.pool
+    registry.pin(default)
+
+    registry.get("a")
+    registry.get("b")
+    time.sleep(0.1)
+    registry.evict_idle()
+
+    assert registry.get() is default
+    assert registry.get(DEFAULT_DATASOURCE_ID) is default
+    assert not is_disposed(default, default_pool)
+    assert registry.status()["pinned"] == [DEFAULT_DATASOURCE_ID]
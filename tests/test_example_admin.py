@@ -0,0 +1,120 @@
+import pytest
+from fastapi.testclient import TestClient
+from qdrant_client import QdrantClient, models
+
+import backend
+from backend_logic import build_example_filter_logic, delete_qdrant_points_bulk_logic, facet_qdrant_points_logic, parse_qdrant_point_id_logic
+
+COLLECTION = "examples"
+EXAMPLES = [
+    (1, ["Customer"], "simple_select"),
+    (2, ["Customer", "Invoice"], "join"),
+    (3, ["Invoice"], "aggregation"),
+    (4, ["Track"], "simple_select"),
+]
+
+
+@pytest.fixture
+def client():
+    client = QdrantClient(":memory:")
+    client.create_collection(COLLECTION, vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    client.upsert(COLLECTION, points=[
+        models.PointStruct(id=point_id, vector=[1.0, float(point_id)], payload={"page_content": f"q{point_id}", "metadata": {"tables": tables, "type": example_type}})
+        for point_id, tables, example_type in EXAMPLES
+    ])
+    return client
+
+
+def remaining_ids(client):
+    return sorted(point.id for point in client.scroll(COLLECTION, limit=100)[0])
+
+
+class NoFacetClient:
+    # A server without the facet API: everything else is the real client.
+    def __init__(self, client):
+        self._client = client
+
+    def facet(self, **kwargs):
+        raise RuntimeError("facet is not supported")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def test_filter_matches_any_table_and_the_type():
+    assert build_example_filter_logic() is None
+    query_filter = build_example_filter_logic(["Customer", "Invoice"], "join")
+    assert query_filter.must == [
+        models.FieldCondition(key="metadata.tables", match=models.MatchAny(any=["Customer", "Invoice"])),
+        models.FieldCondition(key="metadata.type", match=models.MatchValue(value="join")),
+    ]
+
+
+def test_bulk_delete_by_table_filter(client):
+    result = delete_qdrant_points_bulk_logic(client, COLLECTION, query_filter=build_example_filter_logic(tables=["Invoice"]))
+
+    assert result["matched_count"] == 2
+    assert remaining_ids(client) == [1, 4]
+
+
+def test_bulk_delete_by_tables_and_type(client):
+    result = delete_qdrant_points_bulk_logic(client, COLLECTION, query_filter=build_example_filter_logic(["Customer", "Track"], "simple_select"))
+
+    assert result["matched_count"] == 2
+    assert remaining_ids(client) == [2, 3]
+
+
+def test_bulk_delete_by_ids_counts_only_existing_points(client):
+    result = delete_qdrant_points_bulk_logic(client, COLLECTION, point_ids=[1, "3", 99])
+
+    assert result["matched_count"] == 2
+    assert remaining_ids(client) == [2, 4]
+
+
+@pytest.mark.parametrize("point_ids, query_filter", [(None, None), ([], None), ([1], build_example_filter_logic(tables=["Track"]))])
+def test_bulk_delete_needs_exactly_one_selector(client, point_ids, query_filter):
+    with pytest.raises(ValueError):
+        delete_qdrant_points_bulk_logic(client, COLLECTION, point_ids=point_ids, query_filter=query_filter)
+    assert remaining_ids(client) == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("point_id, parsed", [
+    (7, 7), ("7", 7), (" 7 ", 7),
+    ("0A6B1C2D-3E4F-5A6B-7C8D-9E0F1A2B3C4D", "0a6b1c2d-3e4f-5a6b-7c8d-9e0f1a2b3c4d"),
+    ("0a6b1c2d3e4f5a6b7c8d9e0f1a2b3c4d", "0a6b1c2d-3e4f-5a6b-7c8d-9e0f1a2b3c4d"),
+])
+def test_point_ids_are_unsigned_integers_or_uuids(point_id, parsed):
+    assert parse_qdrant_point_id_logic(point_id) == parsed
+
+
+@pytest.mark.parametrize("point_id", ["abc", "", "-3", -3, "1.5", 1.5, True, None, "0a6b1c2d-3e4f"])
+def test_malformed_point_ids_are_rejected(point_id):
+    with pytest.raises(ValueError):
+        parse_qdrant_point_id_logic(point_id)
+
+
+def test_bulk_delete_with_a_malformed_id_is_a_400_and_deletes_nothing(client, monkeypatch):
+    monkeypatch.setattr(backend, "qdrant_client_instance", client)
+    monkeypatch.setattr(backend, "QDRANT_COLLECTION_NAME", COLLECTION)
+
+    response = TestClient(backend.app).post("/examples/bulk-delete", json={"ids": ["1", "not-a-point-id"]})
+
+    assert response.status_code == 400
+    assert "not-a-point-id" in response.json()["detail"]
+    assert remaining_ids(client) == [1, 2, 3, 4]
+
+
+def test_facets_fall_back_to_scrolling_without_the_facet_api(client):
+    client.create_payload_index(COLLECTION, "metadata.tables", models.PayloadSchemaType.KEYWORD)
+    from_facet = facet_qdrant_points_logic(client, COLLECTION, "tables")
+    from_scroll = facet_qdrant_points_logic(NoFacetClient(client), COLLECTION, "tables")
+
+    assert from_facet["source"] == "facet" and from_scroll["source"] == "scroll"
+    assert from_scroll["values"][:2] == [{"value": "Customer", "count": 2}, {"value": "Invoice", "count": 2}]
+    assert sorted((v["value"], v["count"]) for v in from_scroll["values"]) == sorted((v["value"], v["count"]) for v in from_facet["values"])
+
+
+def test_scrolled_facets_respect_the_filter_and_limit(client):
+    facets = facet_qdrant_points_logic(NoFacetClient(client), COLLECTION, "type", limit=1, query_filter=build_example_filter_logic(tables=["Customer", "Track"]))
+
+    assert facets == {"key": "type", "source": "scroll", "values": [{"value": "simple_select", "count": 2}]}
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models.fake import FakeListLLM
+from sqlalchemy import create_engine, text
+
+import backend
+from backend_logic import find_reusable_example_logic
+from datasources import Datasource
+
+ANALYSIS = json.dumps({"relevant": "yes", "query": "List all customers", "relevant_tables": ["Customer"], "query_types": ["selection"]})
+
+
+class CountingLLM(FakeListLLM):
+    calls: int = 0
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        return super()._call(*args, **kwargs)
+
+
+def example(score, tables=("Customer",), sql="SELECT * FROM Customer"):
+    return {"nl": "List all customers", "sql": sql, "tables": list(tables), "score": score}
+
+
+@pytest.mark.parametrize("score, reused", [(0.99, True), (0.97, True), (0.969, False), (0.5, False)])
+def test_top_example_is_reused_only_at_or_above_the_threshold(score, reused):
+    top_example = example(score)
+    assert (find_reusable_example_logic([top_example], ["Customer"], 0.97) is top_example) == reused
+
+
+def test_only_the_top_example_is_considered():
+    assert find_reusable_example_logic([example(0.9), example(0.99)], ["Customer"], 0.97) is None
+
+
+@pytest.mark.parametrize("relevant_tables", [["Invoice"], ["Customer", "Invoice"], []])
+def test_table_mismatch_falls_back_to_generation(relevant_tables):
+    assert find_reusable_example_logic([example(0.99)], relevant_tables, 0.97) is None
+
+
+def test_tables_match_regardless_of_case_order_and_whitespace():
+    top_example = example(0.99, tables=["Invoice", "customer "])
+    assert find_reusable_example_logic([top_example], ["Customer", "invoice"], 0.97) is top_example
+
+
+def test_examples_without_sql_or_tables_are_not_reused():
+    assert find_reusable_example_logic([example(0.99, sql="")], ["Customer"], 0.97) is None
+    assert find_reusable_example_logic([example(0.99, tables=())], [], 0.97) is None
+
+
+def test_zero_threshold_disables_reuse():
+    assert find_reusable_example_logic([example(1.0)], ["Customer"], 0.0) is None
+
+
+@pytest.mark.parametrize("distance, reused", [("Cosine", True), ("Dot", True), ("Euclid", False), ("Manhattan", False)])
+def test_threshold_applies_only_to_similarity_scores(distance, reused):
+    # A Euclid distance of 0.99 is not "99% similar".
+    top_example = example(0.99)
+    assert (find_reusable_example_logic([top_example], ["Customer"], 0.97, distance=distance) is top_example) == reused
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path, result_spool):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE Customer (name TEXT)"))
+        connection.execute(text("INSERT INTO Customer VALUES ('Ada'), ('Grace')"))
+    # Retrieval is stubbed below; the pipeline only checks that the datasource has a vector store.
+    datasource = Datasource("reuse-test", db=SQLDatabase(engine), vector_store=object(), db_schema="Customer(name)", engine=engine)
+    llms = {
+        "analysis": CountingLLM(responses=[ANALYSIS]),
+        "sql": CountingLLM(responses=["SELECT name FROM Customer ORDER BY name"]),
+        "nl": CountingLLM(responses=["Ada and Grace."]),
+    }
+    monkeypatch.setattr(backend, "llm", llms["analysis"])
+    monkeypatch.setattr(backend, "sql_generation_llms", {"fast": llms["sql"], "strong": llms["sql"]})
+    monkeypatch.setattr(backend, "natural_language_llm", llms["nl"])
+
+    def run(stored_sql):
+        monkeypatch.setattr(backend, "retrieve_similar_examples_logic", lambda **kwargs: [example(0.99, sql=stored_sql)])
+        return backend.run_query_pipeline("List all customers", datasource)
+    run.llms = llms
+    return run
+
+
+def llm_calls(llms):
+    return {name: llm.calls for name, llm in llms.items()}
+
+
+def test_reused_sql_runs_without_a_generation_call(pipeline):
+    response = pipeline("SELECT name FROM Customer WHERE name = 'Ada'")
+
+    assert response.error_message is None
+    assert (response.sql_source, response.generated_sql) == ("example_reuse", "SELECT name FROM Customer WHERE name = 'Ada'")
+    assert response.result_rows == [["Ada"]]
+    # The analysis still runs: the example is only reused when its tables match the analysis' relevant tables.
+    assert llm_calls(pipeline.llms) == {"analysis": 1, "sql": 0, "nl": 1}
+
+
+@pytest.mark.parametrize("stored_sql", ["SELECT name FROM Customers", "DELETE FROM Customer"])
+def test_reused_sql_that_fails_falls_back_to_generation(pipeline, stored_sql):
+    response = pipeline(stored_sql)
+
+    assert response.error_message is None
+    assert (response.sql_source, response.generated_sql) == ("generated", "SELECT name FROM Customer ORDER BY name")
+    assert response.result_rows == [["Ada"], ["Grace"]]
+    assert response.nl_response == "Ada and Grace."
+    assert llm_calls(pipeline.llms) == {"analysis": 1, "sql": 1, "nl": 1}
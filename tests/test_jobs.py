@@ -0,0 +1,212 @@
+import gc
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import weakref
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from sqlalchemy import create_engine, text
+
+import jobs
+from datasources import Datasource, DatasourceRegistry
+from jobs import CancellationToken, JobCancelledError, JobManager, JobStore, instrument_engine_for_cancellation
+from result_spool import ResultSpool
+
+SLOW_QUERY = text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n")
+
+
+def run_cancelled(engine, token, cancel_after=0.2):
+    errors = []
+
+    def execute():
+        try:
+            with engine.connect() as connection:
+                connection.execution_options(cancel_token=token).execute(SLOW_QUERY).fetchall()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=execute)
+    thread.start()
+    time.sleep(cancel_after)
+    token.cancel()
+    thread.join(5)
+    assert not thread.is_alive(), "statement was not interrupted"
+    return errors
+
+
+def wait_for_status(manager, job_id, status, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while manager.get(job_id)["status"] != status and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return manager.get(job_id)["status"]
+
+
+class FakeRequest(BaseModel):
+    question: str = "q"
+
+
+def test_cancel_interrupts_running_statement():
+    engine = create_engine("sqlite://")
+    instrument_engine_for_cancellation(engine)
+
+    errors = run_cancelled(engine, CancellationToken())
+    assert errors and "interrupted" in str(errors[0])
+
+
+def test_cancelled_job_is_reported_cancelled(tmp_path):
+    engine = create_engine("sqlite://")
+    instrument_engine_for_cancellation(engine)
+
+    def runner(request, token):
+        try:
+            with engine.connect() as connection:
+                connection.execute(SLOW_QUERY).fetchall()
+        finally:
+            token.raise_if_cancelled()
+
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")), runner, max_workers=1)
+    job_id = manager.submit(FakeRequest())
+    assert wait_for_status(manager, job_id, jobs.JOB_STATUS_RUNNING) == jobs.JOB_STATUS_RUNNING
+    time.sleep(0.2)
+    manager.cancel(job_id)
+
+    assert wait_for_status(manager, job_id, jobs.JOB_STATUS_CANCELLED) == jobs.JOB_STATUS_CANCELLED
+
+
+def test_engines_created_after_registry_eviction_are_instrumented():
+    registry = DatasourceRegistry(
+        factory=lambda datasource_id: Datasource(datasource_id, engine=create_engine("sqlite://")),
+        known_ids=lambda: ["a", "b"],
+        max_size=1,
+    )
+    evicted_engine = registry.get("a").engine
+    instrument_engine_for_cancellation(evicted_engine)
+    assert evicted_engine in jobs._instrumented_engines
+
+    registry.get("b")  # evicts and disposes "a"
+    assert registry.status()["cached"] == ["b"]
+    evicted_ref = weakref.ref(evicted_engine)
+    del evicted_engine
+    gc.collect()
+    assert evicted_ref() is None  # not kept alive by the instrumentation bookkeeping
+
+    new_engine = registry.get("b").engine
+    assert new_engine not in jobs._instrumented_engines
+    instrument_engine_for_cancellation(new_engine)
+    errors = run_cancelled(new_engine, CancellationToken())
+    assert errors and "interrupted" in str(errors[0])
+
+
+def test_instrumenting_twice_registers_listeners_once():
+    engine = create_engine("sqlite://")
+    instrument_engine_for_cancellation(engine)
+    instrument_engine_for_cancellation(engine)
+
+    assert len(engine.dispatch.before_cursor_execute) == 1
+
+
+def test_child_tokens_follow_parent():
+    parent = CancellationToken()
+    child = parent.child()
+    parent.cancel()
+
+    assert child.cancelled
+    with pytest.raises(JobCancelledError):
+        child.raise_if_cancelled()
+    assert parent.child().cancelled
+
+
+# Returns ten rows at once, then scans forever for an eleventh.
+STREAMED_SLOW_QUERY = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT i FROM n WHERE i <= 10 OR i < 0"
+
+
+def test_cancelled_job_interrupts_a_slow_streamed_fetch(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    instrument_engine_for_cancellation(engine)
+    spool = ResultSpool(str(tmp_path / "spool"))
+
+    def runner(request, token):
+        try:
+            spool.execute(engine, STREAMED_SLOW_QUERY, page_size=20, cancel_token=token)
+        finally:
+            token.raise_if_cancelled()
+
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")), runner, max_workers=1)
+    job_id = manager.submit(FakeRequest())
+    assert wait_for_status(manager, job_id, jobs.JOB_STATUS_RUNNING) == jobs.JOB_STATUS_RUNNING
+    time.sleep(0.2)
+    manager.cancel(job_id)
+
+    assert wait_for_status(manager, job_id, jobs.JOB_STATUS_CANCELLED) == jobs.JOB_STATUS_CANCELLED
+
+
+def test_cancel_interrupts_the_background_spooler_fetch(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    instrument_engine_for_cancellation(engine)
+    token = CancellationToken()
+    spooled = ResultSpool(str(tmp_path / "spool")).execute(engine, STREAMED_SLOW_QUERY, page_size=2, cancel_token=token)
+    assert spooled.first_page_rows == [[1], [2]]
+
+    time.sleep(0.2)
+    token.cancel()
+    assert spooled.wait_until_complete(5.0), "streamed fetch was not interrupted"
+    assert spooled.error == "Query was cancelled."
+
+
+def test_shutdown_finishes_running_jobs_and_leaves_queued_ones_for_recovery(tmp_path):
+    release = threading.Event()
+
+    def runner(request, token):
+        release.wait(5)
+        return request
+
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")), runner, max_workers=1, cleanup_interval_seconds=0.01, cancel_poll_seconds=0.01)
+    running_id = manager.submit(FakeRequest())
+    queued_id = manager.submit(FakeRequest())
+    assert wait_for_status(manager, running_id, jobs.JOB_STATUS_RUNNING) == jobs.JOB_STATUS_RUNNING
+
+    shutdown = threading.Thread(target=manager.shutdown)
+    shutdown.start()
+    release.set()
+    shutdown.join(5)
+    assert not shutdown.is_alive()
+    assert not any(thread.is_alive() for thread in manager._threads)
+
+    store = JobStore(str(tmp_path / "jobs.db"))
+    assert store.get(running_id)["status"] == jobs.JOB_STATUS_SUCCEEDED
+    assert store.get(queued_id)["status"] == jobs.JOB_STATUS_QUEUED
+    assert store.fail_unfinished("Job was interrupted by a server restart.", 60) == 1
+    store.close()
+
+
+def test_importing_backend_creates_no_job_store_spool_or_threads(tmp_path):
+    env = {**os.environ, "JOB_STORE_PATH": str(tmp_path / "jobs.db"), "RESULT_SPOOL_DIR": str(tmp_path / "result_spool")}
+    code = "import threading, backend; print(sorted(t.name for t in threading.enumerate() if t.name.startswith('query-job')))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parents[1], env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_lifespan_creates_and_shuts_down_the_job_manager_and_spool(tmp_path, monkeypatch):
+    import backend
+
+    monkeypatch.setattr(backend, "JOB_STORE_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(backend, "RESULT_SPOOL_DIR", str(tmp_path / "result_spool"))
+    monkeypatch.setattr(backend, "job_manager", None)
+    monkeypatch.setattr(backend, "result_spool", None)
+    with TestClient(backend.app) as client:
+        manager = backend.job_manager
+        assert manager is not None and backend.result_spool.directory == str(tmp_path / "result_spool")
+        assert client.get("/jobs/unknown").status_code == 404
+
+    assert not any(thread.is_alive() for thread in manager._threads)
+    with pytest.raises(sqlite3.ProgrammingError):
+        manager.get("unknown")
@@ -0,0 +1,40 @@
+from backend_logic import DB_SCHEMA_EXAMPLE, complete_join_tables_logic, format_dynamic_schema_logic, get_join_graph_logic, resolve_join_tables_logic
+
+
+def test_completes_tables_on_the_shortest_join_path():
+    tables, join_hints = resolve_join_tables_logic(["Customer", "Genre"], get_join_graph_logic(DB_SCHEMA_EXAMPLE))
+
+    assert tables == ["Customer", "Invoice", "InvoiceLine", "Track", "Genre"]
+    assert join_hints == [
+        "Invoice.CustomerId = Customer.CustomerId",
+        "InvoiceLine.InvoiceId = Invoice.InvoiceId",
+        "InvoiceLine.TrackId = Track.TrackId",
+        "Track.GenreId = Genre.GenreId",
+    ]
+
+
+def test_unknown_tables_are_dropped_and_names_canonicalized():
+    join_graph = get_join_graph_logic(DB_SCHEMA_EXAMPLE)
+
+    assert resolve_join_tables_logic(["customer", "Nope"], join_graph) == (["Customer"], [])
+    assert resolve_join_tables_logic(["Nope"], join_graph) == ([], [])
+
+
+def test_completion_falls_back_to_the_analysis_tables_when_none_are_known():
+    assert complete_join_tables_logic(["customer", "Nope"], DB_SCHEMA_EXAMPLE) == (["Customer"], [])
+    assert complete_join_tables_logic(["Nope"], DB_SCHEMA_EXAMPLE) == (["Nope"], [])
+
+
+def test_explicit_foreign_keys_are_used():
+    schema = "orders(id, customer_id)\ncustomers(id, name)"
+    join_graph = get_join_graph_logic(schema, (("orders", "customer_id", "customers", "id"),))
+
+    assert resolve_join_tables_logic(["orders", "customers"], join_graph) == (["orders", "customers"], ["orders.customer_id = customers.id"])
+
+
+def test_dynamic_schema_lists_join_path_tables_and_hints():
+    dynamic_schema = format_dynamic_schema_logic(["Album", "Artist"], DB_SCHEMA_EXAMPLE)
+
+    assert dynamic_schema.startswith("Album(")
+    assert "\nArtist(" in dynamic_schema
+    assert dynamic_schema.endswith("# Join hints:\n# Album.ArtistId = Artist.ArtistId")
@@ -0,0 +1,96 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models.fake import FakeListLLM
+from sqlalchemy import create_engine, text
+
+import backend
+from backend_logic import choose_sql_model_tier_logic
+from datasources import Datasource
+
+# The default SQL_ROUTING_FAST_QUERY_TYPES; the analysis prompt's types are
+# selection, filter, aggregation, order, subquery, limit, join and other.
+FAST_QUERY_TYPES = ["selection", "filter", "order", "limit"]
+
+
+@pytest.mark.parametrize("query_types, tables, tier", [
+    (["selection"], ["Customer"], "fast"),
+    ([" Filter", "SELECTION", "order"], ["Customer"], "fast"),
+    (["selection", "limit"], [], "fast"),
+    (["selection", "aggregation"], ["Customer"], "strong"),
+    (["filter", "join"], ["Customer"], "strong"),
+    (["selection"], ["Customer", "Invoice"], "strong"),
+    (["other"], ["Customer"], "strong"),
+    ([], ["Customer"], "strong"),
+    (None, None, "strong"),
+])
+def test_only_simple_single_table_questions_route_to_the_fast_tier(query_types, tables, tier):
+    assert choose_sql_model_tier_logic(query_types, tables, FAST_QUERY_TYPES, fast_max_tables=1) == tier
+
+
+def test_fast_max_tables_widens_the_fast_tier():
+    assert choose_sql_model_tier_logic(["filter"], ["Customer", "Invoice"], FAST_QUERY_TYPES, fast_max_tables=2) == "fast"
+
+
+def test_routing_field_does_not_trip_pydantic_protected_namespace_warning():
+    # A fresh interpreter: the warning is raised once, when the model class is defined.
+    result = subprocess.run([sys.executable, "-W", "error", "-c", "import schema"], cwd=Path(__file__).parents[1], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.fixture
+def datasource(tmp_path, result_spool):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (n INTEGER)"))
+        connection.execute(text("INSERT INTO t VALUES (1), (2)"))
+    return Datasource("routing-test", db=SQLDatabase(engine), engine=engine)
+
+
+def use_tiers(monkeypatch, fast_sql, strong_sql, escalate=True):
+    monkeypatch.setattr(backend, "sql_generation_llms", {"fast": FakeListLLM(responses=[fast_sql]), "strong": FakeListLLM(responses=[strong_sql])})
+    monkeypatch.setattr(backend, "sql_generation_deployments", {"fast": "fast-deployment", "strong": "strong-deployment"})
+    monkeypatch.setattr(backend, "SQL_ROUTING_ESCALATE", escalate)
+
+
+def test_fast_tier_success_is_not_escalated(monkeypatch, datasource):
+    use_tiers(monkeypatch, "SELECT n FROM t ORDER BY n", "SELECT 'strong'")
+    sql, query_result, validation_failure, routing = backend.generate_sql_with_cascade("SQL Query:", "fast", datasource)
+
+    assert sql == "SELECT n FROM t ORDER BY n"
+    assert query_result.first_page_rows == [[1], [2]]
+    assert validation_failure is None
+    assert (routing["final_tier"], routing["escalated"]) == ("fast", False)
+
+
+@pytest.mark.parametrize("fast_sql, failure", [
+    ("```sql\nSELECT n FROM t\n```", "markdown fences"),
+    ("DELETE FROM t", "does not start with SELECT"),
+    ("SELECT missing FROM t", "Error executing SQL"),
+])
+def test_failed_fast_attempt_escalates_to_the_strong_tier(monkeypatch, datasource, fast_sql, failure):
+    use_tiers(monkeypatch, fast_sql, "SELECT n FROM t ORDER BY n")
+    sql, query_result, validation_failure, routing = backend.generate_sql_with_cascade("SQL Query:", "fast", datasource)
+
+    assert sql == "SELECT n FROM t ORDER BY n"
+    assert query_result.first_page_rows == [[1], [2]]
+    assert validation_failure is None
+    assert (routing["initial_tier"], routing["final_tier"], routing["escalated"]) == ("fast", "strong", True)
+    assert [attempt["tier"] for attempt in routing["attempts"]] == ["fast", "strong"]
+    assert failure in routing["attempts"][0]["failure"]
+    assert routing["attempts"][1]["failure"] is None
+
+
+def test_no_escalation_when_disabled_or_already_strong(monkeypatch, datasource):
+    use_tiers(monkeypatch, "DELETE FROM t", "DELETE FROM t", escalate=False)
+    sql, query_result, validation_failure, routing = backend.generate_sql_with_cascade("SQL Query:", "fast", datasource)
+    assert query_result is None and "does not start with SELECT" in validation_failure
+    assert [attempt["tier"] for attempt in routing["attempts"]] == ["fast"]
+
+    use_tiers(monkeypatch, "SELECT 'fast'", "DELETE FROM t")
+    sql, query_result, validation_failure, routing = backend.generate_sql_with_cascade("SQL Query:", "strong", datasource)
+    assert [attempt["tier"] for attempt in routing["attempts"]] == ["strong"]
+    assert routing["escalated"] is False and validation_failure is not None
@@ -0,0 +1,158 @@
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend
+import profiling
+from profiling import ProfileNotFoundError, ProfileStore, ProfilingSettings, profile_stage, run_profiled
+
+
+def summary(profile_id, **fields):
+    return {"profile_id": profile_id, "label": f"q {profile_id}", "created_at": 0.0, "wall_ms": 1.0, "cpu_ms": 1.0, **fields}
+
+
+def age(store, profile_id, seconds):
+    then = time.time() - seconds
+    os.utime(os.path.join(store.directory, f"{profile_id}.json"), (then, then))
+
+
+def test_should_profile_is_off_when_disabled_whatever_the_sample_rate(monkeypatch):
+    monkeypatch.setattr(profiling.random, "random", lambda: 0.0)
+    assert not ProfilingSettings(enabled=False, sample_rate=1.0).should_profile()
+    assert not ProfilingSettings(enabled=True, sample_rate=0.0).should_profile()
+
+
+@pytest.mark.parametrize("header, allow_header, profiled", [
+    ("1", True, True), (" Yes ", True, True), ("on", True, True),
+    ("0", True, False), ("", True, False), (None, True, False),
+    ("1", False, False),
+])
+def test_header_opt_in(header, allow_header, profiled):
+    settings = ProfilingSettings(enabled=False, allow_header=allow_header)
+    assert settings.should_profile(header) == profiled
+
+
+@pytest.mark.parametrize("draw, profiled", [(0.29, True), (0.3, False), (0.9, False)])
+def test_requests_are_sampled_at_the_sample_rate(monkeypatch, draw, profiled):
+    monkeypatch.setattr(profiling.random, "random", lambda: draw)
+    assert ProfilingSettings(enabled=True, sample_rate=0.3).should_profile() == profiled
+
+
+def test_runtime_settings_reach_every_worker(tmp_path):
+    shared_path = str(tmp_path / profiling.SHARED_SETTINGS_FILENAME)
+    worker_a = ProfilingSettings(shared_path=shared_path, refresh_interval_seconds=0.0)
+    worker_b = ProfilingSettings(shared_path=shared_path, refresh_interval_seconds=0.0)
+    worker_a.update(enabled=False, sample_rate=0.0, allow_header=False)
+    assert not worker_b.should_profile("1")
+    assert (worker_b.enabled, worker_b.sample_rate, worker_b.allow_header) == (False, 0.0, False)
+
+    time.sleep(0.05)  # changes are noticed by the file's mtime
+    worker_b.update(enabled=True, sample_rate=1.0, allow_header=False)
+    assert worker_a.should_profile()
+
+
+def test_store_saves_lists_newest_first_and_prunes_the_oldest(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=2)
+    for seconds_ago, profile_id in ((30, "first"), (20, "second")):
+        store.save(summary(profile_id), "main;stage:x 3\n")
+        age(store, profile_id, seconds_ago)
+
+    assert store.get("first")["label"] == "q first"
+    assert store.get_collapsed("first") == "main;stage:x 3\n"
+    assert [p["profile_id"] for p in store.list()] == ["second", "first"]
+
+    store.save(summary("third"), "")
+    assert [p["profile_id"] for p in store.list()] == ["third", "second"]
+    assert [p["profile_id"] for p in store.list(limit=1)] == ["third"]
+    with pytest.raises(ProfileNotFoundError):
+        store.get("first")
+    assert not (tmp_path / "first.collapsed").exists()
+
+
+def test_prune_skips_files_that_are_not_profiles(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=1)
+    (tmp_path / "notes-v1.json").write_text("{}")
+    age(store, "notes-v1", 60)
+    (tmp_path / profiling.SHARED_SETTINGS_FILENAME).write_text("{}")
+
+    store.save(summary("first"), "")
+    store.save(summary("second"), "")
+
+    assert (tmp_path / "notes-v1.json").exists()
+    assert [p["profile_id"] for p in store.list()] == ["second"]
+
+
+def test_prune_skips_profiles_removed_meanwhile(tmp_path, monkeypatch):
+    store = ProfileStore(str(tmp_path), max_profiles=1)
+    store.save(summary("first"), "")
+
+    class VanishedEntry:
+        # Another worker pruned it between scandir() and stat().
+        name = "gone.json"
+
+        def stat(self):
+            raise FileNotFoundError(self.name)
+
+    real_scandir = os.scandir
+    monkeypatch.setattr(profiling.os, "scandir", lambda path: [VanishedEntry(), *real_scandir(path)])
+
+    store.save(summary("second"), "")
+    assert [p["profile_id"] for p in store.list()] == ["second"]
+
+
+def test_ids_that_could_leave_the_directory_are_not_found_without_touching_disk(tmp_path, monkeypatch):
+    store = ProfileStore(str(tmp_path))
+
+    def no_disk(*args, **kwargs):
+        raise AssertionError("opened a file")
+
+    monkeypatch.setattr(profiling, "open", no_disk, raising=False)
+    for profile_id in ("..", "a.b", "x-y", "%2e%2e"):
+        with pytest.raises(ProfileNotFoundError):
+            store.get(profile_id)
+        with pytest.raises(ProfileNotFoundError):
+            store.get_collapsed(profile_id)
+
+    monkeypatch.setattr(backend, "profile_store", store)
+    client = TestClient(backend.app)
+    assert client.get("/profiles/a.b").status_code == 404
+    assert client.get("/profiles/x-y/collapsed").status_code == 404
+
+
+def test_run_profiled_records_stage_timings(tmp_path):
+    store = ProfileStore(str(tmp_path))
+
+    def pipeline(x):
+        profile_stage("analysis_llm")
+        time.sleep(0.03)
+        profile_stage("sql_execution")
+        return x * 2
+
+    result, profile_id = run_profiled(store, "label", 0.005, pipeline, 21)
+
+    assert result == 42
+    saved = store.get(profile_id)
+    assert [stage["name"] for stage in saved["stages"]] == ["analysis_llm", "sql_execution"]
+    assert saved["stages"][0]["wall_ms"] >= 25
+    assert saved["error"] is None and saved["sample_count"] > 0
+    assert "stage:analysis_llm" in store.get_collapsed(profile_id)
+    # Outside run_profiled, stage marks are no-ops.
+    profile_stage("after")
+    assert [stage["name"] for stage in store.get(profile_id)["stages"]] == ["analysis_llm", "sql_execution"]
+
+
+def test_run_profiled_saves_the_profile_of_a_failed_run(tmp_path):
+    store = ProfileStore(str(tmp_path))
+
+    def pipeline():
+        profile_stage("sql_execution")
+        raise ValueError("no such table")
+
+    with pytest.raises(ValueError):
+        run_profiled(store, "label", 0.005, pipeline, profile_id="failed")
+
+    saved = store.get("failed")
+    assert saved["error"] == "ValueError: no such table"
+    assert [stage["name"] for stage in saved["stages"]] == ["sql_execution"]
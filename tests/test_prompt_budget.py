@@ -0,0 +1,90 @@
+import re
+
+from backend_logic import DB_SCHEMA_EXAMPLE, build_text_to_sql_prompt_logic, count_tokens_logic
+
+# An unknown encoding makes count_tokens_logic fall back to ~4 characters per token, so budgets are deterministic.
+ENCODING = "test-no-such-encoding"
+SCHEMA = (
+    "Customer(CustomerId, FirstName, LastName, Company, Address, City, State, Country, PostalCode, Phone, Fax, Email, SupportRepId)\n"
+    "Employee(EmployeeId, LastName, FirstName, Title)"
+)
+
+
+class StaticValueIndex:
+    def __init__(self, matches):
+        self.matches = matches
+
+    def lookup(self, question, tables=None, limit=5, min_score=0.55):
+        self.tables = tables
+        return self.matches
+
+
+def schema_columns(prompt, table_name):
+    match = re.search(rf"^{table_name}\((.*)\)$", prompt, re.MULTILINE)
+    return [c.strip() for c in match.group(1).split(",")]
+
+
+def build(question, tables, schema, budget, **kwargs):
+    return build_text_to_sql_prompt_logic("Write SQL.", question, [], tables, schema, token_budget=budget, encoding_name=ENCODING, **kwargs)
+
+
+def trimmed_to(question, tables, schema, columns_to_drop, **kwargs):
+    # Shrinks the budget until exactly ``columns_to_drop`` columns had to go.
+    prompt, counts = build(question, tables, schema, None, **kwargs)
+    budget = counts["total"]
+    while counts["dropped_columns"] < columns_to_drop:
+        budget -= 1
+        prompt, counts = build(question, tables, schema, budget, **kwargs)
+    assert counts["dropped_columns"] == columns_to_drop
+    return prompt, counts
+
+
+def test_drops_unrelated_columns_before_question_columns():
+    prompt, _ = trimmed_to("customer phone numbers by country", ["Customer"], SCHEMA, 9)
+
+    assert schema_columns(prompt, "Customer") == ["CustomerId", "Country", "Phone", "SupportRepId"]
+
+
+def test_drops_unrelated_columns_before_question_and_value_hint_columns():
+    value_index = StaticValueIndex([{"table": "Customer", "column": "Country", "value": "Brazil", "score": 1.0}])
+    prompt, _ = trimmed_to("customer phone numbers from Brazil", ["Customer"], SCHEMA, 9, column_value_index=value_index)
+
+    assert "-- Customer.Country = 'Brazil'" in prompt
+    assert schema_columns(prompt, "Customer") == ["CustomerId", "Country", "Phone", "SupportRepId"]
+
+
+def test_value_hints_are_looked_up_over_join_path_tables():
+    value_index = StaticValueIndex([])
+    build_text_to_sql_prompt_logic("Write SQL.", "rock tracks bought by customers", [], ["Customer", "Genre"], DB_SCHEMA_EXAMPLE, column_value_index=value_index)
+
+    assert value_index.tables == ["Customer", "Invoice", "InvoiceLine", "Track", "Genre"]
+
+
+def test_drops_last_column_of_widest_table_among_equally_ranked():
+    prompt, _ = trimmed_to("list everything", ["Customer", "Employee"], SCHEMA, 1)
+
+    assert "Email" not in schema_columns(prompt, "Customer")
+    assert schema_columns(prompt, "Employee") == ["EmployeeId", "LastName", "FirstName", "Title"]
+
+
+def test_keeps_snake_case_keys():
+    schema = "orders(id, customer_id, status, note, shipped_at)\ncustomers(id, full_name, segment)"
+    prompt, counts = build("orders per customer", ["orders", "customers"], schema, 1)
+
+    assert counts["dropped_columns"] == 5
+    assert schema_columns(prompt, "orders") == ["id", "customer_id"]
+    assert schema_columns(prompt, "customers") == ["id"]
+
+
+def test_keeps_foreign_key_columns_of_reflected_schemas():
+    schema = "orders(id, buyer, status, note)\ncustomers(id, full_name, segment)"
+    foreign_keys = [("orders", "buyer", "customers", "id")]
+    prompt, counts = build("orders per customer", ["orders", "customers"], schema, 1, foreign_keys=foreign_keys)
+
+    assert counts["dropped_columns"] == 4
+    assert schema_columns(prompt, "orders") == ["id", "buyer"]
+    assert schema_columns(prompt, "customers") == ["id"]
+
+
+def test_fallback_token_count_without_tokenizer():
+    assert count_tokens_logic("abcdefgh", ENCODING) == 2
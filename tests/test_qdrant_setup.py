@@ -0,0 +1,124 @@
+import pytest
+from qdrant_client import QdrantClient, models
+
+from qdrant_setup import CollectionSettings, ensure_example_collection
+
+COLLECTION = "examples"
+CURRENT = CollectionSettings(vector_size=2, hnsw_m=16, hnsw_ef_construct=100, quantization="scalar")
+
+
+class ServerLikeClient:
+    """QdrantClient(":memory:") that keeps what local mode ignores: HNSW, quantization and payload indexes.
+
+    Local mode always reports the default HNSW config, no quantization and no payload indexes, so a migration
+    against it alone could neither be seen to happen nor to stop once applied.
+    """
+
+    def __init__(self):
+        self._client = QdrantClient(":memory:")
+        self._hnsw, self._quantization, self._payload_schema = {}, {}, {}
+        self.updates = []
+        self.indexed = []
+
+    def create_collection(self, collection_name, hnsw_config=None, quantization_config=None, **kwargs):
+        self._client.create_collection(collection_name, **kwargs)
+        self._hnsw[collection_name] = models.HnswConfig(
+            m=hnsw_config.m if hnsw_config else 16, ef_construct=hnsw_config.ef_construct if hnsw_config else 100, full_scan_threshold=10000
+        )
+        self._quantization[collection_name] = quantization_config
+        self._payload_schema[collection_name] = {}
+
+    def update_collection(self, collection_name, hnsw_config=None, quantization_config=None, **kwargs):
+        self.updates.append({"hnsw_config": hnsw_config, "quantization_config": quantization_config})
+        if hnsw_config is not None:
+            self._hnsw[collection_name] = self._hnsw[collection_name].model_copy(update=hnsw_config.model_dump(exclude_none=True))
+        if quantization_config is not None:
+            self._quantization[collection_name] = None if quantization_config == models.Disabled.DISABLED else quantization_config
+        return True
+
+    def create_payload_index(self, collection_name, field_name, field_schema, **kwargs):
+        self.indexed.append(field_name)
+        self._payload_schema[collection_name][field_name] = models.PayloadIndexInfo(data_type=field_schema, points=0)
+
+    def get_collection(self, collection_name):
+        info = self._client.get_collection(collection_name)
+        config = info.config.model_copy(update={"hnsw_config": self._hnsw[collection_name], "quantization_config": self._quantization[collection_name]})
+        return info.model_copy(update={"config": config, "payload_schema": dict(self._payload_schema[collection_name])})
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def create(client, settings, with_points=True):
+    client.create_collection(
+        COLLECTION,
+        vectors_config=models.VectorParams(size=2, distance=settings.distance),
+        hnsw_config=settings.hnsw_config(),
+        quantization_config=settings.quantization_config(),
+    )
+    if with_points:
+        client.upsert(COLLECTION, points=[models.PointStruct(id=1, vector=[1.0, 0.0], payload={"page_content": "q1", "metadata": {"tables": ["Customer"]}})])
+
+
+def test_missing_collection_is_created_with_the_settings():
+    client = ServerLikeClient()
+    result = ensure_example_collection(client, COLLECTION, CURRENT)
+
+    assert result["changes"][0] == "created (size=2, distance=Cosine)"
+    config = client.get_collection(COLLECTION).config
+    assert (config.hnsw_config.m, config.hnsw_config.ef_construct) == (16, 100)
+    assert isinstance(config.quantization_config, models.ScalarQuantization)
+    assert sorted(client.indexed) == sorted(CURRENT.payload_index_keys)
+
+
+def test_collection_with_old_parameters_is_migrated_in_place():
+    client = ServerLikeClient()
+    create(client, CollectionSettings(vector_size=2, hnsw_m=8, hnsw_ef_construct=50, quantization="none"))
+
+    result = ensure_example_collection(client, COLLECTION, CURRENT)
+
+    assert result["changes"][:2] == ["hnsw m=8->16, ef_construct=50->100", "quantization none->scalar"]
+    assert len(client.updates) == 1
+    config = client.get_collection(COLLECTION).config
+    assert (config.hnsw_config.m, config.hnsw_config.ef_construct) == (16, 100)
+    assert isinstance(config.quantization_config, models.ScalarQuantization)
+    # Migrated, not re-created: the examples are still there.
+    assert [point.id for point in client.retrieve(COLLECTION, ids=[1])] == [1]
+
+    assert ensure_example_collection(client, COLLECTION, CURRENT)["changes"] == []
+    assert len(client.updates) == 1
+
+
+def test_quantization_is_switched_off_when_configured_none():
+    client = ServerLikeClient()
+    create(client, CollectionSettings(vector_size=2, quantization="binary"))
+
+    result = ensure_example_collection(client, COLLECTION, CollectionSettings(vector_size=2, quantization="none"))
+
+    assert "quantization binary->none" in result["changes"]
+    assert client.updates[0]["quantization_config"] == models.Disabled.DISABLED
+    assert client.get_collection(COLLECTION).config.quantization_config is None
+
+
+def test_current_collection_is_left_alone():
+    client = ServerLikeClient()
+    create(client, CURRENT)
+    for key in CURRENT.payload_index_keys:
+        client.create_payload_index(COLLECTION, key, models.PayloadSchemaType.KEYWORD)
+    client.indexed.clear()
+
+    assert ensure_example_collection(client, COLLECTION, CURRENT) == {"collection": COLLECTION, "changes": []}
+    assert client.updates == [] and client.indexed == []
+
+
+@pytest.mark.parametrize("settings, message", [
+    (CollectionSettings(vector_size=2, distance="Dot"), "distance"),
+    (CollectionSettings(vector_size=3), "vector size"),
+])
+def test_layout_that_cannot_be_migrated_is_refused(settings, message):
+    client = ServerLikeClient()
+    create(client, CURRENT)
+
+    with pytest.raises(ValueError, match=message):
+        ensure_example_collection(client, COLLECTION, settings)
+    assert client.updates == []
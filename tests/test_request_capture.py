@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import backend
+import request_capture
+from request_capture import RequestCapture
+
+
+def wait_for(condition, timeout_seconds=5.0):
+    deadline = time.monotonic() + timeout_seconds
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the capture writer"
+        time.sleep(0.01)
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+class StalledCapture(RequestCapture):
+    # The writer waits for ``release``: stands in for a disk that cannot keep up.
+    def __init__(self, *args, **kwargs):
+        self.release = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    def _write_loop(self):
+        self.release.wait()
+        super()._write_loop()
+
+
+def test_rotation_keeps_existing_segments(tmp_path):
+    leftover = tmp_path / f"requests-{os.getpid()}.1.jsonl"
+    leftover.write_text('{"left": "by an earlier process with this pid"}\n')
+    capture = RequestCapture(str(tmp_path), max_file_bytes=5)
+
+    for n in range(2):
+        capture.record({"n": n})
+        # Each record outgrows the file, which is then rotated to the next free segment.
+        wait_for(lambda: os.path.exists(tmp_path / f"requests-{os.getpid()}.{n + 2}.jsonl"))
+
+    assert leftover.read_text() == '{"left": "by an earlier process with this pid"}\n'
+    assert read_records(tmp_path / f"requests-{os.getpid()}.2.jsonl") == [{"n": 0}]
+    assert read_records(tmp_path / f"requests-{os.getpid()}.3.jsonl") == [{"n": 1}]
+    assert read_records(capture.path) == []
+
+
+def test_records_are_dropped_and_counted_when_the_queue_is_full(tmp_path):
+    capture = StalledCapture(str(tmp_path), queue_size=2)
+    for n in range(5):
+        capture.record({"n": n})
+    assert (capture.dropped, capture.stats()["queued"]) == (3, 2)
+
+    capture.release.set()
+    wait_for(lambda: capture.recorded == 2)
+    assert read_records(capture.path) == [{"n": 0}, {"n": 1}]
+    assert capture.stats()["dropped"] == 3
+
+
+@pytest.mark.parametrize("sample_rate, draw, captured", [(0.0, 0.0, False), (1.0, 0.999, True), (0.5, 0.4, True), (0.5, 0.6, False)])
+def test_should_capture_follows_the_sample_rate(tmp_path, monkeypatch, sample_rate, draw, captured):
+    monkeypatch.setattr(request_capture.random, "random", lambda: draw)
+    assert RequestCapture(str(tmp_path), sample_rate=sample_rate).should_capture() == captured
+
+
+@pytest.fixture
+def capturing_backend(tmp_path, monkeypatch):
+    capture = RequestCapture(str(tmp_path))
+    monkeypatch.setattr(backend, "request_capture", capture)
+
+    async def answer_query_request(request, x_profile, fields, verbosity, timed=False):
+        assert timed
+        if request.user_question == "missing":
+            raise HTTPException(status_code=404, detail="Unknown datasource.")
+        return JSONResponse({"nl_response": "ok"}), [{"name": "analysis_llm", "wall_ms": 1.5}]
+
+    monkeypatch.setattr(backend, "answer_query_request", answer_query_request)
+    return capture
+
+
+def test_process_query_records_what_replay_needs(capturing_backend):
+    client = TestClient(backend.app)
+    before = time.time()
+    response = client.post(
+        "/process-query",
+        json={"user_question": "Top customers", "datasource_id": "sales_eu", "sql_candidates": 3, "candidate_strategy": "majority", "page_size": 50},
+        params={"fields": "generated_sql,nl_response"},
+    )
+    assert response.status_code == 200
+    assert client.post("/process-query", json={"user_question": "missing", "verbosity": "minimal"}).status_code == 404
+    wait_for(lambda: capturing_backend.recorded == 2)
+
+    ok, missing = read_records(capturing_backend.path)
+    assert ok["ts"] >= before and ok["latency_ms"] >= 0
+    assert {key: value for key, value in ok.items() if key not in ("ts", "latency_ms")} == {
+        "user_question": "Top customers",
+        "datasource_id": "sales_eu",
+        "sql_candidates": 3,
+        "candidate_strategy": "majority",
+        "page_size": 50,
+        "fields": ["generated_sql", "nl_response"],
+        "verbosity": None,
+        "status": 200,
+        "stages": [{"name": "analysis_llm", "wall_ms": 1.5}],
+    }
+    assert (missing["status"], missing["verbosity"], missing["stages"]) == (404, "minimal", None)
+
+    stats = client.get("/admin/capture").json()
+    assert stats["enabled"] is True
+    assert (stats["path"], stats["recorded"], stats["dropped"]) == (capturing_backend.path, 2, 0)
+
+
+def test_capture_endpoint_reports_when_disabled(monkeypatch):
+    monkeypatch.setattr(backend, "request_capture", None)
+    assert TestClient(backend.app).get("/admin/capture").json()["enabled"] is False
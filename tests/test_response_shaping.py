@@ -0,0 +1,138 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models.fake import FakeListLLM
+from sqlalchemy import create_engine, text
+
+import backend
+import config
+from datasources import Datasource
+import response_shaping
+from response_shaping import ALWAYS_INCLUDED_FIELDS, CompressionMiddleware, resolve_response_fields
+
+ANALYSIS = json.dumps({"relevant": "yes", "query": "List every n", "relevant_tables": ["t"], "query_types": ["selection"]})
+
+
+class CountingLLM(FakeListLLM):
+    calls: int = 0
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        return super()._call(*args, **kwargs)
+
+
+def test_fields_are_validated_and_always_include_the_basics():
+    assert resolve_response_fields(fields=["generated_sql", " nl_response "]) == {"generated_sql", "nl_response"} | ALWAYS_INCLUDED_FIELDS
+    with pytest.raises(ValueError, match="answer"):
+        resolve_response_fields(fields=["generated_sql", "answer"])
+
+
+def test_verbosity_presets():
+    assert resolve_response_fields() is None
+    assert resolve_response_fields(verbosity="full") is None
+    assert resolve_response_fields(verbosity="minimal") == {"generated_sql", "nl_response"} | ALWAYS_INCLUDED_FIELDS
+    assert "result_rows" in resolve_response_fields(verbosity="standard")
+    # fields win over verbosity
+    assert resolve_response_fields(fields=["analysis"], verbosity="full") == {"analysis"} | ALWAYS_INCLUDED_FIELDS
+    with pytest.raises(ValueError):
+        resolve_response_fields(verbosity="chatty")
+
+
+@pytest.mark.parametrize("body, params", [
+    ({"user_question": "q", "fields": ["answer"]}, {}),
+    ({"user_question": "q"}, {"fields": "generated_sql,answer"}),
+    ({"user_question": "q", "verbosity": "chatty"}, {}),
+    ({"user_question": "q"}, {"verbosity": "chatty"}),
+])
+def test_unknown_fields_or_verbosity_are_rejected_with_422(body, params):
+    response = TestClient(backend.app).post("/process-query", json=body, params=params)
+    assert response.status_code == 422
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path, result_spool):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (n INTEGER)"))
+        connection.execute(text("INSERT INTO t VALUES (1), (2)"))
+    datasource = Datasource("shaping-test", db=SQLDatabase(engine), db_schema="t(n)", engine=engine)
+    sql_llm = FakeListLLM(responses=["SELECT n FROM t ORDER BY n"])
+    nl_llm = CountingLLM(responses=["There are two values: 1 and 2."])
+    monkeypatch.setattr(backend, "llm", FakeListLLM(responses=[ANALYSIS]))
+    monkeypatch.setattr(backend, "sql_generation_llms", {"fast": sql_llm, "strong": sql_llm})
+    monkeypatch.setattr(backend, "natural_language_llm", nl_llm)
+
+    def run(response_fields, page_size=50):
+        return backend.run_query_pipeline("List every n", datasource, page_size=page_size, response_fields=response_fields)
+    run.nl_llm = nl_llm
+    return run
+
+
+def test_answer_llm_is_not_called_unless_nl_response_is_requested(pipeline):
+    response = pipeline(resolve_response_fields(fields=["generated_sql", "result_rows"]))
+
+    assert response.error_message is None
+    assert response.generated_sql == "SELECT n FROM t ORDER BY n"
+    assert response.result_rows == [[1], [2]]
+    assert response.nl_response is None and response.query_result is None
+    assert pipeline.nl_llm.calls == 0
+
+    response = pipeline(resolve_response_fields(verbosity="minimal"))
+    assert response.nl_response == "There are two values: 1 and 2."
+    assert pipeline.nl_llm.calls == 1
+
+
+def test_answer_over_a_first_page_says_so(pipeline):
+    response = pipeline(resolve_response_fields(verbosity="minimal"), page_size=1)
+
+    assert response.result_has_more is True
+    assert response.nl_response.startswith("There are two values: 1 and 2.\n\n(This answer is based on the first 1 ")
+    assert response.nl_response.endswith("page through result_handle for the rest.)")
+
+    response = pipeline(resolve_response_fields(verbosity="minimal"), page_size=3)
+    assert response.result_has_more is False
+    assert response.nl_response == "There are two values: 1 and 2."
+
+
+@pytest.fixture
+def compressing_client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+    @app.get("/small")
+    def small():
+        return {"rows": "x" * 100}
+
+    @app.get("/large")
+    def large():
+        return {"rows": "x" * 1000}
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path, accept_encoding, content_encoding", [
+    ("/large", "gzip", "gzip"),
+    # brotli is optional; without it gzip is used
+    ("/large", "br, gzip", "br" if response_shaping.brotli is not None else "gzip"),
+    ("/large", "br;q=0, gzip", "gzip"),
+    ("/large", "gzip;q=0", None),
+    ("/large", "identity", None),
+    ("/small", "gzip", None),
+    ("/small", "br", None),
+])
+def test_compression_respects_minimum_size_and_accept_encoding(compressing_client, path, accept_encoding, content_encoding):
+    response = compressing_client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == content_encoding
+    assert response.json()["rows"].startswith("x")
+
+
+def test_backend_compresses_from_the_configured_minimum_size():
+    middleware = [m for m in backend.app.user_middleware if m.cls is CompressionMiddleware]
+    assert len(middleware) == (1 if config.RESPONSE_COMPRESSION_ENABLED else 0)
+    if middleware:
+        assert middleware[0].kwargs["minimum_size"] == config.RESPONSE_COMPRESSION_MIN_BYTES
@@ -0,0 +1,130 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from backend_logic import query_result_vote_key_logic
+from result_spool import ResultHandleNotFoundError, ResultSpool
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (n INTEGER, label TEXT)"))
+        for n in range(23):
+            connection.execute(text("INSERT INTO t VALUES (:n, :label)"), {"n": n, "label": f"row {n}"})
+    return engine
+
+
+def wait_until_complete(spooled, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not spooled.complete and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert spooled.complete
+
+
+def test_pages_are_served_by_the_owner_and_by_another_worker(engine, tmp_path):
+    spool_dir = str(tmp_path / "spool")
+    spool = ResultSpool(spool_dir, page_size=5)
+    spooled = spool.execute(engine, "SELECT n, label FROM t ORDER BY n")
+
+    assert [row[0] for row in spooled.first_page_rows] == [0, 1, 2, 3, 4]
+    assert [row[0] for row in spool.fetch_page(spooled.handle, 4)["rows"]] == [20, 21, 22]
+    wait_until_complete(spooled)
+    last_page = spool.fetch_page(spooled.handle, 4)
+    assert last_page["has_more"] is False and last_page["total_rows"] == 23
+
+    other_worker = ResultSpool(spool_dir, page_size=5)
+    for page in range(5):
+        assert other_worker.fetch_page(spooled.handle, page)["rows"] == spool.fetch_page(spooled.handle, page)["rows"]
+    assert other_worker.fetch_page(spooled.handle, 5)["rows"] == []
+
+
+def test_text_of_a_multi_page_result_says_how_many_rows_are_left_out(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=5)
+    spooled = spool.execute(engine, "SELECT n, label FROM t ORDER BY n")
+    wait_until_complete(spooled)
+
+    assert str(spooled) == "[(0, 'row 0'), (1, 'row 1'), (2, 'row 2'), (3, 'row 3'), (4, 'row 4')]\n(Only the first 5 of 23 rows are shown.)"
+    assert str(spool.execute(engine, "SELECT n FROM t WHERE n < 2 ORDER BY n")) == "[(0,), (1,)]"
+
+
+def test_rows_shown_only_claims_a_total_once_it_is_known(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=5, max_active_spools=1, inline_max_rows=5)
+    assert spool._spool_slots.acquire(blocking=False)  # inline: complete (and truncated) on return
+    assert spool.execute(engine, "SELECT n FROM t ORDER BY n").rows_shown() == "the first 5 of 10 or more rows"
+    spool._spool_slots.release()
+
+    spooled = spool.execute(engine, "SELECT n FROM t ORDER BY n")
+    wait_until_complete(spooled)
+    assert spooled.rows_shown() == "the first 5 of 23 rows"
+
+
+def test_results_differing_after_the_first_page_get_different_vote_keys(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=5)
+    everything = spool.execute(engine, "SELECT n FROM t ORDER BY n")
+    same_rows = spool.execute(engine, "SELECT n FROM t WHERE n >= 0 ORDER BY n")
+    fewer_rows = spool.execute(engine, "SELECT n FROM t WHERE n < 20 ORDER BY n")
+
+    assert everything.first_page_rows == fewer_rows.first_page_rows
+    assert query_result_vote_key_logic(everything, 5.0) == query_result_vote_key_logic(same_rows, 5.0)
+    assert query_result_vote_key_logic(everything, 5.0) != query_result_vote_key_logic(fewer_rows, 5.0)
+
+
+def test_statement_without_result_set_returns_empty_string(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"))
+    assert spool.execute(engine, "UPDATE t SET label = 'x' WHERE n < 0") == ""
+    empty = spool.execute(engine, "SELECT n FROM t WHERE n < 0")
+    assert empty.complete and empty.row_count == 0
+
+
+def test_oldest_handle_is_evicted_beyond_max_handles(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=50, max_handles=1)
+    first = spool.execute(engine, "SELECT n FROM t")
+    second = spool.execute(engine, "SELECT label FROM t")
+
+    with pytest.raises(ResultHandleNotFoundError):
+        spool.fetch_page(first.handle, 0)
+    assert len(spool.fetch_page(second.handle, 0)["rows"]) == 23
+
+
+@pytest.mark.parametrize("handle", ["0123abcd", "../data", "..%2Fdata", ""])
+def test_unknown_or_path_like_handles_are_not_found(engine, tmp_path, handle):
+    spool = ResultSpool(str(tmp_path / "spool"))
+    with pytest.raises(ResultHandleNotFoundError):
+        spool.fetch_page(handle, 0)
+
+
+def test_inline_fallback_truncates_when_no_spooler_is_free(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=5, max_active_spools=1, inline_max_rows=5)
+    assert spool._spool_slots.acquire(blocking=False)  # the only spooler is busy
+    spooled = spool.execute(engine, "SELECT n FROM t ORDER BY n")
+
+    assert spooled.complete and spooled.truncated
+    assert spooled.row_count == 10
+
+
+def test_vanished_spool_file_is_not_found(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=50)
+    spooled = spool.execute(engine, "SELECT n FROM t")
+    os.remove(spooled.path)
+
+    with pytest.raises(ResultHandleNotFoundError):
+        spool.fetch_page(spooled.handle, 0)
+
+
+def test_close_stops_results_still_spooling_and_keeps_finished_ones(engine, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), page_size=5, max_rows=10_000_000)
+    finished = spool.execute(engine, "SELECT n FROM t ORDER BY n")
+    wait_until_complete(finished)
+    endless = spool.execute(engine, "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT i FROM n")
+    assert not endless.complete
+
+    spool.close()
+
+    wait_until_complete(endless)
+    assert endless.evicted and not os.path.exists(endless.path)
+    # Another worker can still page through the finished result.
+    assert ResultSpool(str(tmp_path / "spool")).fetch_page(finished.handle, 4)["rows"] == [[20], [21], [22]]
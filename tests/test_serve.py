@@ -0,0 +1,43 @@
+import os
+
+import pytest
+from qdrant_client import QdrantClient, models
+
+import config
+import serve
+from qdrant_setup import CollectionSettings
+
+
+@pytest.fixture
+def preload_config(monkeypatch, tmp_path):
+    client = QdrantClient(":memory:")
+    monkeypatch.setattr(config, "qdrant_client_instance", client)
+    monkeypatch.setattr(config, "example_collection_settings", CollectionSettings(vector_size=4))
+    monkeypatch.setattr(config, "QDRANT_COLLECTION_NAME", "examples")
+    monkeypatch.setattr(config, "QDRANT_MANAGE_COLLECTION", True)
+    monkeypatch.setattr(config, "DATASOURCES", {
+        "tenant_a": {"db_connection_string": "sqlite://", "qdrant_collection_name": "tenant_a_examples"},
+        "tenant_b": {"db_connection_string": "sqlite://", "qdrant_collection_name": "examples"},
+        "tenant_c": {"db_connection_string": "sqlite://"},
+    })
+    monkeypatch.setattr(config, "JOB_STORE_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(config, "PROFILING_RESET_ON_STARTUP", False)
+    # preload() hands these to the workers through the environment; restore them afterwards.
+    for name in ("QDRANT_MANAGE_COLLECTION", "JOB_RECOVER_ON_STARTUP", "PROFILING_RESET_ON_STARTUP"):
+        monkeypatch.setenv(name, os.environ.get(name, "true"))
+    return client
+
+
+def test_preload_creates_default_and_tenant_collections(preload_config):
+    serve.preload()
+
+    assert sorted(c.name for c in preload_config.get_collections().collections) == ["examples", "tenant_a_examples"]
+    assert preload_config.get_collection("tenant_a_examples").config.params.vectors.size == 4
+    assert os.environ["QDRANT_MANAGE_COLLECTION"] == "false"
+
+
+def test_preload_fails_on_a_mismatched_tenant_collection(preload_config):
+    preload_config.create_collection("tenant_a_examples", vectors_config=models.VectorParams(size=4, distance=models.Distance.EUCLID))
+
+    with pytest.raises(ValueError, match="tenant_a_examples"):
+        serve.preload()
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend_logic import normalize_question_logic, normalize_sql_logic
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_sql_key_collapses_whitespace_between_tokens_only():
+    assert normalize_sql_logic("SELECT  *\n  FROM Customer ;") == normalize_sql_logic("SELECT * FROM Customer")
+    assert normalize_sql_logic("SELECT * FROM t WHERE Name = 'A  B'") != normalize_sql_logic("SELECT * FROM t WHERE Name = 'A B'")
+    assert normalize_sql_logic("SELECT 'it''s  here' ,  \"a  b\"") == "SELECT 'it''s  here' , \"a  b\""
+
+
+def test_question_key_ignores_case_and_spacing():
+    assert normalize_question_logic("  Customers   from BRAZIL ") == normalize_question_logic("customers from brazil")
+
+
+def run_concurrently(flight, keys, fn):
+    results = [None] * len(keys)
+    start = threading.Barrier(len(keys))
+
+    def call(position, key):
+        start.wait()
+        results[position] = flight.do(key, fn, key)
+
+    threads = [threading.Thread(target=call, args=(position, key)) for position, key in enumerate(keys)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_same_key_shares_one_execution_and_different_keys_do_not():
+    calls = []
+
+    def slow_execute(key):
+        calls.append(key)
+        time.sleep(0.2)
+        return f"result of {key}"
+
+    flight = SingleFlight()
+    keys = [normalize_sql_logic("SELECT  1"), normalize_sql_logic("SELECT 1 ;"), normalize_sql_logic("SELECT 'a  b'"), normalize_sql_logic("SELECT 'a b'")]
+    results = run_concurrently(flight, keys, slow_execute)
+
+    assert sorted(calls) == sorted({"SELECT 1", "SELECT 'a  b'", "SELECT 'a b'"})
+    assert results == [f"result of {key}" for key in keys]
+    assert flight.in_flight() == 0
+
+
+def test_waiters_receive_the_leaders_error_and_the_key_is_released():
+    def failing(key):
+        time.sleep(0.2)
+        raise RuntimeError("boom")
+
+    flight = SingleFlight()
+    errors = []
+
+    def call():
+        try:
+            flight.do("k", failing, "k")
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3 and len({id(e) for e in errors}) == 1
+    assert flight.do("k", lambda: "fresh") == "fresh"
+
+
+def test_async_flight_shares_one_task_per_key():
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return key.upper()
+
+    async def main():
+        flight = AsyncSingleFlight()
+        results = await asyncio.gather(flight.do("a", work, "a"), flight.do("a", work, "a"), flight.do("b", work, "b"))
+        return results, flight.in_flight()
+
+    results, in_flight = asyncio.run(main())
+    assert results == ["A", "A", "B"]
+    assert sorted(calls) == ["a", "b"]
+    assert in_flight == 0
+
+
+def test_async_waiter_cancellation_does_not_cancel_shared_task():
+    async def main():
+        flight = AsyncSingleFlight()
+        first = asyncio.ensure_future(flight.do("k", asyncio.sleep, 0.05, "done"))
+        second = asyncio.ensure_future(flight.do("k", asyncio.sleep, 0.05, "done"))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
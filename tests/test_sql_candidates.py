@@ -0,0 +1,116 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.language_models.fake import FakeListLLM
+from sqlalchemy import create_engine, text
+
+from backend_logic import execute_sql_query_paged_logic, run_sql_candidates_logic
+from result_spool import ResultHandleNotFoundError, ResultSpool
+
+
+class SlowFakeLLM(FakeListLLM):
+    delay: float = 0.0
+
+    def _call(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return super()._call(*args, **kwargs)
+
+
+def llm(sql, delay=0.0):
+    return SlowFakeLLM(responses=[sql], delay=delay)
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return ResultSpool(str(tmp_path / "spool"), page_size=5)
+
+
+@pytest.fixture
+def execute(tmp_path, spool):
+    engine = create_engine(f"sqlite:///{tmp_path / 'data.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (n INTEGER)"))
+        for n in range(23):
+            connection.execute(text("INSERT INTO t VALUES (:n)"), {"n": n})
+    db = SimpleNamespace(_engine=engine)
+    executed = []
+
+    def execute_fn(sql, cancel_token):
+        query_result = execute_sql_query_paged_logic(sql, db, spool, cancel_token=cancel_token)
+        executed.append((sql, query_result))
+        return query_result
+
+    execute_fn.executed = executed
+    return execute_fn
+
+
+def run(llms, execute, executor, spool, strategy, latency_budget_seconds=10.0):
+    return run_sql_candidates_logic(
+        "SQL Query:",
+        llms,
+        execute,
+        executor,
+        strategy=strategy,
+        latency_budget_seconds=latency_budget_seconds,
+        discard_result_fn=lambda query_result: spool.discard(query_result.handle) if hasattr(query_result, "handle") else None,
+    )
+
+
+def test_first_valid_skips_failing_candidates(execute, executor, spool):
+    sql, query_result, info = run([llm("DELETE FROM t"), llm("SELECT missing FROM t"), llm("SELECT n FROM t WHERE n < 3", delay=0.2)], execute, executor, spool, "first_valid")
+
+    assert sql == "SELECT n FROM t WHERE n < 3"
+    assert query_result.first_page_rows == [[0], [1], [2]]
+    assert info["winner_index"] == 2 and info["valid"] == 1
+    assert [c["failure"] is None for c in info["candidates"]] == [False, False, True]
+
+
+def test_majority_compares_whole_results_and_discards_the_losers(execute, executor, spool):
+    llms = [
+        llm("SELECT n FROM t WHERE n < 20 ORDER BY n"),
+        llm("SELECT n FROM t ORDER BY n"),
+        llm("SELECT n FROM t WHERE n >= 0 ORDER BY n"),
+    ]
+    sql, query_result, info = run(llms, execute, executor, spool, "majority")
+
+    # All three share their first page; only the full results tell them apart.
+    assert sql in ("SELECT n FROM t ORDER BY n", "SELECT n FROM t WHERE n >= 0 ORDER BY n")
+    assert query_result.row_count == 23
+    assert spool.fetch_page(query_result.handle, 4)["rows"] == [[20], [21], [22]]
+    losers = [result for _, result in execute.executed if result is not query_result]
+    assert len(losers) == 2
+    for loser in losers:
+        with pytest.raises(ResultHandleNotFoundError):
+            spool.fetch_page(loser.handle, 0)
+
+
+def test_duplicate_candidates_execute_once_and_still_vote(execute, executor, spool):
+    llms = [llm("SELECT n FROM t WHERE n < 2"), llm("SELECT n  FROM t WHERE n < 2;"), llm("SELECT n FROM t WHERE n < 3", delay=0.2)]
+    sql, query_result, info = run(llms, execute, executor, spool, "majority")
+
+    assert len(execute.executed) == 2
+    assert info["unique_sql"] == 2 and info["valid"] == 3
+    assert sorted(c["duplicate_of"] is not None for c in info["candidates"]) == [False, False, True]
+    assert query_result.first_page_rows == [[0], [1]]
+
+
+def test_latency_budget_returns_without_waiting_for_slow_candidates(execute, executor, spool):
+    start = time.perf_counter()
+    sql, query_result, info = run([llm("SELECT n FROM t", delay=2.0), llm("SELECT n FROM t WHERE n < 3")], execute, executor, spool, "majority", latency_budget_seconds=0.5)
+
+    assert time.perf_counter() - start < 1.5
+    assert sql == "SELECT n FROM t WHERE n < 3"
+    assert info["completed"] == 1
+
+    sql, query_result, info = run([llm("SELECT n FROM t", delay=2.0)], execute, executor, spool, "first_valid", latency_budget_seconds=0.2)
+    assert (sql, query_result) == ("", None)
+    assert info["timed_out"] is True
@@ -0,0 +1,154 @@
+import random
+import time
+
+from sqlalchemy import create_engine, event, text
+
+from value_index import ColumnValueIndex, MappedColumnValueIndex
+
+COUNTRIES = ["Brazil", "Canada", "France", "Germany", "USA"]
+GENRES = ["Rock", "Jazz", "Metal", "Alternative & Punk", "Rock And Roll", "Blues", "Latin", "Reggae", "Pop", "Soundtrack"]
+
+
+def make_engine():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE Genre (GenreId INTEGER PRIMARY KEY, Name TEXT)"))
+        connection.execute(text("CREATE TABLE Customer (CustomerId INTEGER PRIMARY KEY, FirstName TEXT, Country TEXT)"))
+        for genre_id, name in enumerate(GENRES, start=1):
+            connection.execute(text("INSERT INTO Genre VALUES (:id, :name)"), {"id": genre_id, "name": name})
+        for customer_id in range(1, 60):
+            connection.execute(
+                text("INSERT INTO Customer VALUES (:id, :name, :country)"),
+                {"id": customer_id, "name": f"Customer {customer_id}", "country": COUNTRIES[customer_id % len(COUNTRIES)]}
+            )
+    return engine
+
+
+TABLES = {"Genre": ["GenreId", "Name"], "Customer": ["CustomerId", "FirstName", "Country"]}
+
+
+def test_indexes_low_cardinality_text_columns_and_matches_literals():
+    index = ColumnValueIndex(max_distinct_values=20)
+    index.refresh_from_engine(make_engine(), TABLES)
+
+    assert index.column_values[("Genre", "Name")] == sorted(GENRES)
+    assert index.column_values[("Customer", "Country")] == COUNTRIES
+    assert index.column_values[("Customer", "FirstName")] is None
+    assert index.lookup("customers from brasil")[0]["value"] == "Brazil"
+    matches = index.lookup("tracks in the Jazz genre", tables=["Genre"])
+    assert matches[0]["table"] == "Genre" and matches[0]["value"] == "Jazz"
+    assert index.lookup("tracks in the Jazz genre", tables=["Customer"]) == []
+
+
+def test_refresh_reindexes_only_changed_columns():
+    engine = make_engine()
+    index = ColumnValueIndex(max_distinct_values=20)
+    index.refresh_from_engine(engine, TABLES)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO Genre VALUES (99, 'Bossa Nova')"))
+
+    stats = index.refresh_from_engine(engine, TABLES)
+    assert stats == {"columns_checked": 2, "columns_changed": 1, "columns_skipped": 1}
+    assert "Bossa Nova" in index.column_values[("Genre", "Name")]
+
+
+def test_saved_index_loads_with_the_same_values(tmp_path):
+    index = ColumnValueIndex(max_distinct_values=20)
+    index.refresh_from_engine(make_engine(), TABLES)
+    path = str(tmp_path / "value_index.json")
+    index.save(path)
+
+    loaded = ColumnValueIndex.load(path)
+    assert loaded.max_distinct_values == 20
+    assert loaded.column_values == index.column_values
+    assert loaded.lookup("jazz")[0]["value"] == "Jazz"
+
+
+def test_defaults_index_lookup_tables_and_skip_near_unique_columns():
+    index = ColumnValueIndex()
+    index.refresh_from_engine(make_engine(), TABLES)
+
+    assert index.column_values[("Genre", "Name")] == sorted(GENRES)
+    assert index.column_values[("Customer", "Country")] == COUNTRIES
+    assert index.column_values[("Customer", "FirstName")] is None
+    matches = index.lookup("tracks in the Jazz genre", tables=["Genre"])
+    assert matches[0]["table"] == "Genre" and matches[0]["value"] == "Jazz"
+
+
+def test_ratio_check_applies_above_min_rows():
+    index = ColumnValueIndex(ratio_min_rows=5)
+    index.refresh_from_engine(make_engine(), TABLES)
+
+    assert index.column_values[("Genre", "Name")] is None
+    assert index.column_values[("Customer", "Country")] == COUNTRIES
+
+
+def test_refresh_counts_each_table_once():
+    engine = make_engine()
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    ColumnValueIndex().refresh_from_engine(engine, TABLES)
+
+    assert sum(1 for s in statements if s.startswith("SELECT COUNT(*)")) == 2
+
+
+def test_pronouns_and_function_words_do_not_match_literals():
+    index = ColumnValueIndex()
+    index.refresh_from_engine(make_engine(), TABLES)
+
+    # "us" used to match 'USA' and put a bogus Country filter in the prompt.
+    assert index.lookup("Tell us the total sales per year") == []
+    assert index.lookup("Give me the customers in the USA")[0]["value"] == "USA"
+
+
+def realistic_values(count, seed=7):
+    # Made-up place/album/composer-like names: one to three words of two or three syllables each.
+    rnd = random.Random(seed)
+    syllables = sorted({rnd.choice("bcdfghjklmnprstvwz") + rnd.choice("aeiou") + rnd.choice(["", "", "n", "r", "l", "s", "t"]) for _ in range(400)})
+    values = set()
+    while len(values) < count:
+        values.add(" ".join("".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 3))).capitalize() for _ in range(rnd.randint(1, 3))))
+    return sorted(values)
+
+
+def test_lookup_stays_under_a_millisecond_on_thousands_of_values(tmp_path):
+    index = ColumnValueIndex(max_distinct_values=3000)
+    values = realistic_values(6000)
+    index.set_column_values("Invoice", "BillingCity", values[:3000])
+    index.set_column_values("Album", "Title", values[3000:])
+    index.set_column_values("Customer", "Country", COUNTRIES)
+    snapshot_path = str(tmp_path / "value_index.cvi")
+    index.save_snapshot(snapshot_path)
+    mapped = MappedColumnValueIndex(snapshot_path)
+    city = values[1234]
+    questions = [
+        f"How many invoices were billed to {city} last year",
+        f"total sales for {city[:-1]} by month",  # one letter short
+        "Tell us the total sales per year",
+        "customers from brasil ordered by revenue",
+        "which composers wrote the longest tracks on each album",
+    ]
+
+    for lookup_index in (index, mapped):
+        assert lookup_index.lookup(questions[0])[0]["value"] == city
+        assert city in [match["value"] for match in lookup_index.lookup(questions[1])]
+        # Best of 20 runs per question: the lookup's own cost, not the noise of a shared test machine.
+        timings = []
+        for question in questions:
+            runs = []
+            for _ in range(20):
+                start = time.perf_counter()
+                lookup_index.lookup(question)
+                runs.append(time.perf_counter() - start)
+            timings.append(min(runs))
+        average = sum(timings) / len(timings)
+        assert average < 0.001, f"{type(lookup_index).__name__}: {average * 1000:.2f} ms per lookup"
+
+
+def test_postings_scanned_per_phrase_are_capped():
+    index = ColumnValueIndex(max_distinct_values=5000)
+    # Every value shares the question's trigrams: uncapped, each lookup would score all of them.
+    index.set_column_values("Track", "Name", [f"Rock {n}" for n in range(5000)])
+
+    assert len(index.lookup("rock", limit=5000, max_postings=100)) <= 100
+    assert len(index.lookup("rock", limit=5000, max_postings=100_000)) == 5000
@@ -0,0 +1,481 @@
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Optional, Tuple, Any
+
+from sqlalchemy import text
+
+
+# Words that never identify a literal on their own; matching them only adds noise to the prompt
+# (a fuzzy "us" matches 'USA' well enough to put a bogus filter in front of the model).
+_STOPWORDS = {
+    "a", "an", "and", "are", "by", "for", "from", "how", "in", "is", "list", "many", "me", "of", "on",
+    "or", "show", "the", "to", "what", "which", "who", "with", "all", "each", "per", "their", "that",
+    "i", "we", "us", "our", "you", "your", "it", "its", "they", "them", "he", "she", "his", "her", "my",
+    "at", "as", "be", "do", "does", "did", "was", "were", "has", "have", "had", "can", "could", "please",
+    "give", "tell", "get", "find", "there", "this", "these", "those", "than", "then", "any", "some", "much",
+}
+
+# Postings scanned for candidates per question phrase, at most: keeps a lookup bounded whatever the index size.
+MAX_POSTINGS_PER_PHRASE = 2000
+
+# A phrase matching a value at least this well is taken as that literal: its words are not looked up again on their own.
+COVERING_SCORE = 0.85
+
+
+def _ngrams(value: str) -> set:
+    # Character trigrams, padded twice so word edges weigh in: a one-letter typo ('brasil') still matches,
+    # and each trigram is rare enough among thousands of values to narrow the candidates (bigrams were not).
+    padded = f"  {value.lower()}  "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _phrase_scores(phrase_grams: set, postings_of, gram_count_of, min_score: float, max_postings: int) -> Dict[int, float]:
+    """Entry ID -> Dice score over trigrams against the phrase, for the entries scoring at least ``min_score``.
+
+    A value sharing ``s`` of the phrase's ``q`` trigrams scores at most 2s / (q + s), so it needs
+    s >= min_score * q / (2 - min_score). Every such value holds one of the q - s + 1 rarest trigrams, so only
+    their postings are scanned for candidates (up to ``max_postings`` entries); the commoner trigrams are then
+    only intersected with the candidates that can still get there.
+    """
+    phrase_size = len(phrase_grams)
+    postings = sorted((postings_of(gram) for gram in phrase_grams), key=len)
+    required = max(1, math.ceil(min_score * phrase_size / (2.0 - min_score) - 1e-9))
+    probe, scanned = [], 0
+    for posting in postings[:phrase_size - required + 1]:
+        scanned += len(posting)
+        if scanned > max_postings:
+            break
+        probe.append(posting)
+    shared = Counter(chain.from_iterable(probe))
+    rest = postings[phrase_size - required + 1:]
+    for position, posting in enumerate(rest):
+        if not shared:
+            break
+        shared.update(shared.keys() & posting)
+        # Candidates that cannot reach ``required`` even by holding every trigram left are dropped.
+        needed = required - (len(rest) - position - 1)
+        if needed > 1:
+            shared = Counter({entry_id: count for entry_id, count in shared.items() if count >= needed})
+    scores = {}
+    for entry_id, count in shared.items():
+        if count >= required:
+            score = 2.0 * count / (phrase_size + gram_count_of(entry_id))
+            if score >= min_score:
+                scores[entry_id] = score
+    return scores
+
+
+def _column_names(names: Optional[List[str]]) -> set:
+    return {name.strip().lower() for name in names or [] if name.strip()}
+
+
+class ColumnValueIndex:
+    """In-memory n-gram index over distinct values of low-cardinality text columns.
+
+    A column is indexed when it has at most ``max_distinct_values`` distinct values and, in tables of more than
+    ``ratio_min_rows`` rows, at most ``max_distinct_ratio`` distinct values per row, so near-unique columns
+    (names, emails, phone numbers) stay out while small lookup tables like genres or media types, whose values
+    are all distinct, are kept. ``include_columns`` ("Table.Column") skips the ratio check; ``exclude_columns``
+    are never indexed.
+    """
+
+    def __init__(
+        self,
+        max_distinct_values: int = 200,
+        max_value_length: int = 64,
+        max_distinct_ratio: float = 0.5,
+        ratio_min_rows: int = 50,
+        include_columns: Optional[List[str]] = None,
+        exclude_columns: Optional[List[str]] = None,
+    ):
+        self.max_distinct_values = max_distinct_values
+        self.max_value_length = max_value_length
+        self.max_distinct_ratio = max_distinct_ratio
+        self.ratio_min_rows = ratio_min_rows
+        self.include_columns = _column_names(include_columns)
+        self.exclude_columns = _column_names(exclude_columns)
+        self._lock = threading.Lock()
+        # (table, column) -> sorted distinct values; None marks a column skipped as high-cardinality.
+        self.column_values: Dict[Tuple[str, str], Optional[List[str]]] = {}
+        self._entries: Dict[int, Tuple[str, str, str, set]] = {}
+        self._entry_ids_by_column: Dict[Tuple[str, str], List[int]] = {}
+        self._postings: Dict[str, set] = {}
+        self._next_entry_id = 0
+
+    # --- Building / refreshing ---
+    def set_column_values(self, table: str, column: str, values: Optional[List[str]]) -> bool:
+        """Replaces the indexed values of one column; returns False when nothing changed."""
+        key = (table, column)
+        new_values = sorted(set(values)) if values is not None else None
+        with self._lock:
+            if key in self.column_values and self.column_values[key] == new_values:
+                return False
+            for entry_id in self._entry_ids_by_column.pop(key, []):
+                _, _, _, grams = self._entries.pop(entry_id)
+                for gram in grams:
+                    posting = self._postings.get(gram)
+                    if posting is not None:
+                        posting.discard(entry_id)
+                        if not posting:
+                            del self._postings[gram]
+            self.column_values[key] = new_values
+            entry_ids = []
+            for value in new_values or []:
+                grams = _ngrams(value)
+                entry_id = self._next_entry_id
+                self._next_entry_id += 1
+                self._entries[entry_id] = (table, column, value, grams)
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(entry_id)
+                entry_ids.append(entry_id)
+            self._entry_ids_by_column[key] = entry_ids
+        return True
+
+    def _fetch_distinct_values(self, connection, table: str, column: str, row_counts: Dict[str, int]) -> Optional[List[str]]:
+        quote = connection.dialect.identifier_preparer.quote
+        query = text(
+            f"SELECT DISTINCT {quote(column)} FROM {quote(table)} "
+            f"WHERE {quote(column)} IS NOT NULL LIMIT {self.max_distinct_values + 1}"
+        )
+        rows = connection.execute(query).fetchall()
+        if len(rows) > self.max_distinct_values:
+            return None
+        values = [row[0] for row in rows]
+        if any(not isinstance(v, str) for v in values):
+            return None
+        if values and f"{table}.{column}".lower() not in self.include_columns:
+            # One COUNT(*) per table, shared by all of its columns within a refresh.
+            if table not in row_counts:
+                row_counts[table] = connection.execute(text(f"SELECT COUNT(*) FROM {quote(table)}")).scalar() or 0
+            row_count = row_counts[table]
+            if row_count > self.ratio_min_rows and len(values) / row_count > self.max_distinct_ratio:
+                return None
+        return [v for v in values if v.strip() and len(v) <= self.max_value_length]
+
+    def refresh_from_engine(self, engine, tables: Dict[str, List[str]], full: bool = False) -> Dict[str, int]:
+        """Re-reads distinct values and reindexes only the columns whose values changed.
+
+        Columns already known to be high-cardinality are skipped unless ``full`` is set.
+        """
+        stats = {"columns_checked": 0, "columns_changed": 0, "columns_skipped": 0}
+        row_counts: Dict[str, int] = {}
+        with engine.connect() as connection:
+            for table, columns in tables.items():
+                for column in columns:
+                    if column.endswith("Id") or f"{table}.{column}".lower() in self.exclude_columns:
+                        if (table, column) in self.column_values:
+                            self.set_column_values(table, column, None)
+                        continue
+                    key = (table, column)
+                    if not full and key in self.column_values and self.column_values[key] is None:
+                        stats["columns_skipped"] += 1
+                        continue
+                    try:
+                        values = self._fetch_distinct_values(connection, table, column, row_counts)
+                    except Exception as e:
+                        connection.rollback()
+                        print(f"Warning: could not read distinct values for {table}.{column}: {str(e).splitlines()[0]}")
+                        continue
+                    stats["columns_checked"] += 1
+                    if self.set_column_values(table, column, values):
+                        stats["columns_changed"] += 1
+        return stats
+
+    # --- Persistence ---
+    def save(self, path: str):
+        with self._lock:
+            data = {
+                "max_distinct_values": self.max_distinct_values,
+                "columns": [
+                    {"table": table, "column": column, "values": values}
+                    for (table, column), values in self.column_values.items()
+                ],
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "ColumnValueIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        kwargs.setdefault("max_distinct_values", data.get("max_distinct_values", 200))
+        index = cls(**kwargs)
+        for column_data in data.get("columns", []):
+            index.set_column_values(column_data["table"], column_data["column"], column_data["values"])
+        return index
+
+    def save_snapshot(self, path: str):
+        """Writes the read-only binary form served by MappedColumnValueIndex (atomically replaces ``path``)."""
+        with self._lock:
+            # Entry IDs have gaps after updates; the snapshot numbers entries densely and remaps the postings.
+            positions = {entry_id: position for position, entry_id in enumerate(sorted(self._entries))}
+            entries = [self._entries[entry_id] for entry_id in sorted(self._entries)]
+            postings = {gram: sorted(positions[entry_id] for entry_id in entry_ids) for gram, entry_ids in self._postings.items()}
+        _write_snapshot(path, self.max_distinct_values, entries, postings)
+
+    # --- Lookup ---
+    def lookup(
+        self, question: str, tables: Optional[List[str]] = None, limit: int = 5, min_score: float = 0.55, max_postings: int = MAX_POSTINGS_PER_PHRASE
+    ) -> List[Dict[str, Any]]:
+        allowed_tables = {t.lower() for t in tables} if tables else None
+        best_by_value: Dict[Tuple[str, str, str], float] = {}
+        no_entries = frozenset()
+
+        with self._lock:
+            def score_phrase(phrase_grams) -> float:
+                scores = _phrase_scores(
+                    phrase_grams, lambda gram: self._postings.get(gram, no_entries), lambda entry_id: len(self._entries[entry_id][3]), min_score, max_postings
+                )
+                best = 0.0
+                for entry_id, score in scores.items():
+                    table, column, value, _ = self._entries[entry_id]
+                    if allowed_tables is not None and table.lower() not in allowed_tables:
+                        continue
+                    key = (table, column, value)
+                    best = max(best, score)
+                    if score > best_by_value.get(key, 0.0):
+                        best_by_value[key] = score
+                return best
+
+            _phrase_lookups(question, score_phrase)
+
+        return _top_matches(best_by_value, limit)
+
+
+def _question_phrase_grams(question: str):
+    # Word n-grams (longest first) as (first word, last word + 1, trigram set). A phrase starting or ending with a
+    # stopword ("in the Jazz") is skipped: the phrase without it is tried anyway, and scores better against the literal.
+    words = re.findall(r"[\w'-]+", question or "")
+    is_stopword = [w.lower() in _STOPWORDS for w in words]
+    for size in (3, 2, 1):
+        for start in range(len(words) - size + 1):
+            if is_stopword[start] or is_stopword[start + size - 1]:
+                continue
+            phrase = " ".join(words[start:start + size])
+            if len(phrase) < 2:
+                continue
+            yield start, start + size, _ngrams(phrase)
+
+
+def _phrase_lookups(question: str, score_phrase):
+    """Scores each question phrase with ``score_phrase``, skipping phrases over words a close match already covers.
+
+    Once "Sao Paulo" matched a value, "Sao" and "Paulo" on their own only add weaker matches (and work)."""
+    covered = set()
+    for start, end, phrase_grams in _question_phrase_grams(question):
+        if covered.intersection(range(start, end)):
+            continue
+        if score_phrase(phrase_grams) >= COVERING_SCORE:
+            covered.update(range(start, end))
+
+
+def _top_matches(best_by_value: Dict[Tuple[str, str, str], float], limit: int) -> List[Dict[str, Any]]:
+    matches = sorted(best_by_value.items(), key=lambda item: -item[1])[:limit]
+    return [
+        {"table": table, "column": column, "value": value, "score": round(score, 3)}
+        for (table, column, value), score in matches
+    ]
+
+
+# --- Shared read-only snapshot ---
+# Layout (little-endian): header, JSON name table, fixed-size entry records, UTF-8 value blob, sorted trigram keys,
+# posting offsets and postings. Every worker process maps the same file, so the pages are shared via the page cache.
+_SNAPSHOT_MAGIC = b"CVI1"
+_SNAPSHOT_VERSION = 2  # 1: bigram keys
+_SNAPSHOT_HEADER = struct.Struct("<4sIIIQQQQQQQ")
+_SNAPSHOT_ENTRY = struct.Struct("<IIIII")  # table name idx, column name idx, value offset, value length, trigram count
+
+
+def _gram_key(gram: str) -> int:
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+
+def snapshot_path_for(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + ".cvi"
+
+
+def _write_snapshot(path: str, max_distinct_values: int, entries: List[Tuple[str, str, str, set]], postings: Dict[str, List[int]]):
+    names: Dict[str, int] = {}
+    entry_records = bytearray()
+    value_blob = bytearray()
+    for table, column, value, grams in entries:
+        encoded_value = value.encode("utf-8")
+        entry_records += _SNAPSHOT_ENTRY.pack(
+            names.setdefault(table, len(names)), names.setdefault(column, len(names)),
+            len(value_blob), len(encoded_value), len(grams)
+        )
+        value_blob += encoded_value
+    sorted_grams = sorted(postings, key=_gram_key)
+    gram_keys = array("Q", (_gram_key(gram) for gram in sorted_grams))
+    posting_offsets = array("I", [0])
+    posting_ids = array("I")
+    for gram in sorted_grams:
+        posting_ids.extend(postings[gram])
+        posting_offsets.append(len(posting_ids))
+    meta = json.dumps({"max_distinct_values": max_distinct_values, "names": sorted(names, key=names.get)}).encode("utf-8")
+
+    sections = [meta, bytes(entry_records), bytes(value_blob), gram_keys.tobytes(), posting_offsets.tobytes(), posting_ids.tobytes()]
+    offsets = []
+    position = _SNAPSHOT_HEADER.size
+    for section in sections:
+        position += -position % 8  # keep the integer arrays 8-byte aligned for memoryview.cast
+        offsets.append(position)
+        position += len(section)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(entries), len(sorted_grams), *offsets, position))
+        for offset, section in zip(offsets, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class MappedColumnValueIndex:
+    """Read-only ColumnValueIndex backed by a memory-mapped snapshot; same lookup() results, no per-process copy.
+
+    A snapshot replaced on disk (e.g. by /refresh-value-index in another worker) is picked up within
+    ``reload_interval_seconds``.
+    """
+
+    def __init__(self, path: str, reload_interval_seconds: float = 2.0):
+        self.path = path
+        self.reload_interval_seconds = reload_interval_seconds
+        self._lock = threading.Lock()
+        self._next_reload_check = 0.0
+        self._map()
+
+    def _map(self):
+        with open(self.path, "rb") as f:
+            file_stat = os.fstat(f.fileno())
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_entries, n_grams, meta_off, entries_off, blob_off, keys_off, post_off_off, postings_off, end_off = _SNAPSHOT_HEADER.unpack_from(mapped, 0)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError(f"{self.path} is not a column-value index snapshot.")
+        view = memoryview(mapped)
+        meta = json.loads(bytes(view[meta_off:entries_off]).rstrip(b"\0"))
+        state = {
+            "mmap": mapped,
+            "names": meta["names"],
+            "entries": view[entries_off:entries_off + n_entries * _SNAPSHOT_ENTRY.size].cast("I"),
+            "blob": view[blob_off:keys_off],
+            "keys": view[keys_off:keys_off + n_grams * 8].cast("Q"),
+            "posting_offsets": view[post_off_off:post_off_off + (n_grams + 1) * 4].cast("I"),
+            "postings": view[postings_off:end_off].cast("I"),
+            "identity": (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size),
+        }
+        self.max_distinct_values = meta["max_distinct_values"]
+        # Swapped as one reference; lookups in flight keep using the previous mapping until they finish.
+        self._state = state
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return
+        with self._lock:
+            if now < self._next_reload_check:
+                return
+            self._next_reload_check = now + self.reload_interval_seconds
+            try:
+                file_stat = os.stat(self.path)
+            except OSError:
+                return
+            if (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size) != self._state["identity"]:
+                try:
+                    self._map()
+                except Exception as e:
+                    print(f"Warning: could not remap column-value index snapshot {self.path}: {e}")
+
+    def lookup(
+        self, question: str, tables: Optional[List[str]] = None, limit: int = 5, min_score: float = 0.55, max_postings: int = MAX_POSTINGS_PER_PHRASE
+    ) -> List[Dict[str, Any]]:
+        self._reload_if_changed()
+        state = self._state
+        names, entries, blob = state["names"], state["entries"], state["blob"]
+        keys, posting_offsets, postings = state["keys"], state["posting_offsets"], state["postings"]
+        allowed_name_ids = None
+        if tables:
+            allowed_tables = {t.lower() for t in tables}
+            allowed_name_ids = {name_id for name_id, name in enumerate(names) if name.lower() in allowed_tables}
+        fields_per_entry = _SNAPSHOT_ENTRY.size // 4
+        best_by_value: Dict[Tuple[str, str, str], float] = {}
+        # Phrases of one question share most of their trigrams; each posting is located once.
+        postings_by_gram: Dict[str, memoryview] = {}
+
+        def postings_of(gram: str) -> memoryview:
+            posting = postings_by_gram.get(gram)
+            if posting is None:
+                key = _gram_key(gram)
+                position = bisect_left(keys, key)
+                if position == len(keys) or keys[position] != key:
+                    posting = postings[0:0]
+                else:
+                    posting = postings[posting_offsets[position]:posting_offsets[position + 1]]
+                postings_by_gram[gram] = posting
+            return posting
+
+        def score_phrase(phrase_grams) -> float:
+            scores = _phrase_scores(
+                phrase_grams, postings_of, lambda entry_id: entries[entry_id * fields_per_entry + 4], min_score, max_postings
+            )
+            best = 0.0
+            for entry_id, score in scores.items():
+                base = entry_id * fields_per_entry
+                if allowed_name_ids is not None and entries[base] not in allowed_name_ids:
+                    continue
+                value_off, value_len = entries[base + 2], entries[base + 3]
+                key = (names[entries[base]], names[entries[base + 1]], bytes(blob[value_off:value_off + value_len]).decode("utf-8"))
+                best = max(best, score)
+                if score > best_by_value.get(key, 0.0):
+                    best_by_value[key] = score
+            return best
+
+        _phrase_lookups(question, score_phrase)
+
+        return _top_matches(best_by_value, limit)
+
+
+def load_shared_value_index(index_path: str, reload_interval_seconds: float = 2.0) -> MappedColumnValueIndex:
+    """Maps the snapshot next to ``index_path``, (re)writing it first when it is missing or older than the JSON index."""
+    snapshot_path = snapshot_path_for(index_path)
+    if not os.path.exists(snapshot_path) or os.path.getmtime(snapshot_path) < os.path.getmtime(index_path) or not _is_current_snapshot(snapshot_path):
+        ColumnValueIndex.load(index_path).save_snapshot(snapshot_path)
+    return MappedColumnValueIndex(snapshot_path, reload_interval_seconds=reload_interval_seconds)
+
+
+def _is_current_snapshot(path: str) -> bool:
+    # A snapshot written by an older version (other n-gram keys) is rebuilt rather than mapped.
+    with open(path, "rb") as f:
+        header = f.read(8)
+    return len(header) == 8 and struct.unpack("<4sI", header) == (_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION)
+
+
+if __name__ == "__main__":
+    # Offline build: python value_index.py [output_path] [--full]
+    import argparse
+    from config import db, VALUE_INDEX_PATH, value_index_options
+    from backend_logic import DB_SCHEMA_EXAMPLE, parse_schema_tables_logic
+
+    if db is None:
+        raise SystemExit("DB_CONNECTION_STRING is not configured; cannot build the column-value index.")
+    parser = argparse.ArgumentParser(description="Build or incrementally refresh the column-value index of the default datasource.")
+    parser.add_argument("output_path", nargs="?", default=VALUE_INDEX_PATH)
+    parser.add_argument("--full", action="store_true", help="Also re-check columns previously skipped as high-cardinality.")
+    args = parser.parse_args()
+    output_path = args.output_path
+    value_index = ColumnValueIndex.load(output_path, **value_index_options) if os.path.exists(output_path) else ColumnValueIndex(**value_index_options)
+    refresh_stats = value_index.refresh_from_engine(db._engine, parse_schema_tables_logic(DB_SCHEMA_EXAMPLE), full=args.full)
+    value_index.save(output_path)
+    value_index.save_snapshot(snapshot_path_for(output_path))
+    print(f"Column-value index written to {output_path}: {refresh_stats}")